@@ -0,0 +1,289 @@
+"""
+Deterministic intents answered before the intake model is called.
+
+Control commands ("restart", "exit"), a few well-defined questions
+("status", "resend my PDF", "where is the clinic", "what times are
+available") and the "YES" that accepts a waitlist offer do not need a model.
+The message is normalized like the red-flag screen does (accents, case and
+punctuation dropped) and matched against one compiled regular expression
+built from :data:`PATTERNS`. Only whole messages match, so "I need to
+restart my medication" is still an intake answer. Each pattern has one named
+group per intent and language, and the match picks both.
+
+Every message answered here is a model call saved; they are counted in the
+``llm_calls_saved`` metric.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.chains.schedule_chain import offer_times
+from app.services.clinic_info import clinics
+from app.services.finalization import DONE, FinalizationJob, finalization_pipeline
+from app.services.reminders import CLINIC_TIMEZONE, TEMPLATES
+from app.services.secure_storage import latest_intake_id
+from app.services.utils.utils import logger
+from app.services.waitlist import accept_offer
+
+from .red_flags import normalize
+
+RESET = "reset"
+EXIT = "exit"
+STATUS = "status"
+RESEND_PDF = "resend_pdf"
+CLINIC_LOCATION = "clinic_location"
+AVAILABLE_TIMES = "available_times"
+END_INTAKE = "end_intake"
+ACCEPT_OFFER = "accept_offer"
+# A bare "yes": a waitlist acceptance only right after the offer
+YES = "yes"
+
+# (intent, language) -> pattern over the normalized message
+PATTERNS: Dict[Tuple[str, str], str] = {
+    (RESET, "en"): r"(restart|reset|start over|start again|new intake)( the intake)?",
+    (RESET, "es"): r"(reiniciar|empezar de nuevo|comenzar de nuevo|empezar otra vez)",
+    (EXIT, "en"): r"(exit|quit|cancel|stop)( the intake)?",
+    (EXIT, "es"): r"(salir|cancelar)",
+    (STATUS, "en"): r"(status|progress|(what is|whats) my (status|progress)|how far along am i)",
+    (STATUS, "es"): r"(estado|progreso|(cual es )?mi (estado|progreso)|como voy)",
+    (RESEND_PDF, "en"): r"(re ?send|send) (me )?(my |the )?(pdf|form|intake form)( again)?",
+    (RESEND_PDF, "es"): (
+        r"(reenviar|reenviame|enviame|mandame|envia|manda) (el |mi )?(pdf|formulario)"
+        r"( de nuevo| otra vez)?"
+    ),
+    (CLINIC_LOCATION, "en"): (
+        r"(where is|wheres) (the )?(clinic|office)( located)?"
+        r"|(what is|whats) the (clinic |office )?address"
+        r"|(clinic|office) (address|location)"
+    ),
+    (CLINIC_LOCATION, "es"): (
+        r"donde (esta|queda) (la )?(clinica|oficina|consulta)"
+        r"|(cual es )?la direccion( de la clinica)?"
+    ),
+    (AVAILABLE_TIMES, "en"): (
+        r"(what|which) (appointment )?(times|appointments) are (available|open)"
+        r"|(any )?(available|open) (appointment )?(times|appointments)"
+        r"|(when is|whats) the (next|first) available (appointment|time)"
+    ),
+    (AVAILABLE_TIMES, "es"): (
+        r"(que|cuales) (horarios|citas) (hay )?(disponibles|libres)"
+        r"|(hay )?(horarios|citas) disponibles"
+        r"|cuando (hay|tienen) (citas|horarios)( disponibles| libres)?"
+    ),
+    (END_INTAKE, "en"): r"end intake|done|thats all|that is all",
+    (END_INTAKE, "es"): r"listo|eso es todo|terminar|ya termine",
+    (ACCEPT_OFFER, "en"): r"(yes )?(ill take it|take it|book it)",
+    (ACCEPT_OFFER, "es"): r"(si )?(la quiero|la tomo|acepto|reservela)",
+    (YES, "en"): r"yes",
+    (YES, "es"): r"si",
+}
+
+REPLIES: Dict[Tuple[str, str], str] = {
+    (RESET, "en"): "Your intake has been restarted. Let's begin again: what is your full name?",
+    (RESET, "es"): (
+        "Su formulario se reinició. Empecemos de nuevo: ¿cuál es su nombre completo?"
+    ),
+    (EXIT, "en"): "Your intake has been cancelled. Send a message any time to start again.",
+    (EXIT, "es"): (
+        "Su formulario se canceló. Envíe un mensaje cuando quiera para empezar de nuevo."
+    ),
+    ("confirm_reset", "en"): (
+        'This will erase the answers you have given so far. Send "restart" again to '
+        "confirm, or just keep answering."
+    ),
+    ("confirm_reset", "es"): (
+        'Esto borrará las respuestas que ha dado hasta ahora. Envíe "reiniciar" de nuevo '
+        "para confirmar, o siga respondiendo."
+    ),
+    ("confirm_exit", "en"): (
+        'This will cancel your intake and erase your answers. Send "exit" again to '
+        "confirm, or just keep answering."
+    ),
+    ("confirm_exit", "es"): (
+        'Esto cancelará su formulario y borrará sus respuestas. Envíe "salir" de nuevo '
+        "para confirmar, o siga respondiendo."
+    ),
+    (STATUS, "en"): (
+        "Your intake is in progress: you have answered {answered} question(s) so far. "
+        'Reply to the last question to continue, or say "done" when you have nothing to add.'
+    ),
+    (STATUS, "es"): (
+        "Su formulario está en curso: ha respondido {answered} pregunta(s) hasta ahora. "
+        'Responda la última pregunta para continuar o diga "listo" cuando termine.'
+    ),
+    ("no_intake", "en"): "You have not started an intake yet. Say hi to begin.",
+    ("no_intake", "es"): "Todavía no ha comenzado un formulario. Salude para empezar.",
+    ("submitted", "en"): "Your intake (reference {intake_id}) has been received.",
+    ("submitted", "es"): "Recibimos su formulario (referencia {intake_id}).",
+    ("pdf_ready", "en"): "Your intake form: {path}",
+    ("pdf_ready", "es"): "Su formulario: {path}",
+    ("pdf_pending", "en"): (
+        "Your intake form is still being generated. Please ask again shortly."
+    ),
+    ("pdf_pending", "es"): (
+        "Su formulario todavía se está generando. Pregunte de nuevo en un momento."
+    ),
+    ("no_pdf", "en"): "There is no completed intake form for this number yet.",
+    ("no_pdf", "es"): "Todavía no hay un formulario completo para este número.",
+    (CLINIC_LOCATION, "en"): "{name} is at {address}.",
+    (CLINIC_LOCATION, "es"): "{name} está en {address}.",
+    (END_INTAKE, "en"): "There is no intake in progress to finish. Say hi to begin one.",
+    (END_INTAKE, "es"): (
+        "No hay un formulario en curso para terminar. Salude para empezar uno."
+    ),
+    (ACCEPT_OFFER, "en"): "Done! Your appointment on {start:%A %d %B at %H:%M} is booked.",
+    (ACCEPT_OFFER, "es"): "¡Listo! Su cita del {start:%d/%m/%Y a las %H:%M} quedó reservada.",
+}
+
+# Replies after which the chat history starts over
+_HISTORY_RESETS = frozenset(
+    REPLIES[intent, language] for intent in (RESET, EXIT) for language in ("en", "es")
+)
+
+# Replies asking to repeat a reset or exit before the history is cleared
+_CONFIRMATIONS = {
+    intent: frozenset(REPLIES[f"confirm_{intent}", language] for language in ("en", "es"))
+    for intent in (RESET, EXIT)
+}
+
+# Text every waitlist offer starts with, before its time is filled in
+_OFFER_PREFIX = TEMPLATES["waitlist_offer"].split("{")[0]
+
+_GROUPS = {f"{intent}__{language}": (intent, language) for intent, language in PATTERNS}
+_MATCHER = re.compile(
+    "|".join(f"(?P<{group}>{PATTERNS[key]})" for group, key in _GROUPS.items())
+)
+_FILLER = re.compile(r"\b(please|pls|por favor)\b")
+
+
+def match_intent(query: str) -> Optional[Tuple[str, str]]:
+    """``(intent, language)`` of a message that is only a known command or question."""
+    words = " ".join(word for word in normalize(query) if word.isalnum())
+    words = " ".join(_FILLER.sub(" ", words).split())
+    if not words or len(words) > 60:
+        return None
+    match = _MATCHER.fullmatch(words)
+    if match is None:
+        return None
+    return _GROUPS[match.lastgroup]
+
+
+def resets_history(response: str) -> bool:
+    """Whether a stored reply ended the intake it belonged to."""
+    return response in _HISTORY_RESETS
+
+
+def asks_confirmation(response: str) -> bool:
+    """Whether a reply asks the patient to repeat a reset or exit."""
+    return any(response in replies for replies in _CONFIRMATIONS.values())
+
+
+def _pdf_ready(job: FinalizationJob) -> bool:
+    pdf = job.stages.get("pdf")
+    return pdf is not None and pdf.state == DONE
+
+
+def _job_status(job: FinalizationJob, language: str) -> str:
+    reply = REPLIES["submitted", language].format(intake_id=job.intake_id)
+    if _pdf_ready(job):
+        reply += " " + REPLIES["pdf_ready", language].format(path=job.pdf_path)
+    return reply
+
+
+def _resend_pdf(user_id: str, language: str) -> str:
+    job = finalization_pipeline.latest(user_id)
+    if job is None:
+        try:
+            intake_id = latest_intake_id(user_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Error looking up the latest intake: {e}")
+            intake_id = None
+        if intake_id is None:
+            return REPLIES["no_pdf", language]
+        path = FinalizationJob(str(intake_id), user_id, {}).pdf_path
+        if not path.exists():
+            return REPLIES["pdf_pending", language]
+        return REPLIES["pdf_ready", language].format(path=path)
+    if _pdf_ready(job):
+        return REPLIES["pdf_ready", language].format(path=job.pdf_path)
+    # A rendering that gave up is tried again now that the patient asks for it
+    finalization_pipeline.retry(job.intake_id)
+    return REPLIES["pdf_pending", language]
+
+
+def _clinic_location(language: str) -> Optional[str]:
+    try:
+        found = [clinic for clinic in clinics() if clinic.address]
+    except SQLAlchemyError as e:
+        logger.error(f"Error loading clinic details: {e}")
+        return None
+    if not found:
+        return None
+    return " ".join(
+        REPLIES[CLINIC_LOCATION, language].format(name=c.name, address=c.address) for c in found
+    )
+
+
+def _accept_offer(user_id: str, language: str) -> Optional[str]:
+    try:
+        booked = accept_offer(user_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Error accepting a waitlist offer: {e}")
+        return None
+    if booked is None:
+        # No open offer: the model handles the message
+        return None
+    _appointment_id, start = booked
+    return REPLIES[ACCEPT_OFFER, language].format(start=start.astimezone(CLINIC_TIMEZONE))
+
+
+def _offered_last(history: List[Any]) -> bool:
+    """Whether a bare "yes" can only be the answer to a waitlist offer.
+
+    Offers go out through the notification outbox, so one is the last thing
+    the bot said when the history has no open question of the model's, or
+    when the offer text itself was recorded as the last AI message.
+    """
+    last = next((m.get("content") for m in reversed(history) if m.get("role") == "ai"), None)
+    return last is None or last.startswith(_OFFER_PREFIX)
+
+
+def answer_intent(
+    intent: str, language: str, user_id: str, history: List[Any]
+) -> Optional[str]:
+    """Reply to a matched intent, or ``None`` if the model should handle it.
+
+    ``history`` is the sender's chat history. A reset or exit clears it, but
+    only once the patient repeated it after being asked to confirm: a bare
+    "stop" or "quit" may be an answer, and the intake would be lost.
+    """
+    if intent in (RESET, EXIT):
+        last = history[-1].get("content") if history else None
+        if history and last not in _CONFIRMATIONS[intent]:
+            return REPLIES[f"confirm_{intent}", language]
+        history.clear()
+        return REPLIES[intent, language]
+    if intent == STATUS:
+        if history:
+            answered = sum(1 for message in history if message.get("role") == "human")
+            return REPLIES[STATUS, language].format(answered=answered)
+        job = finalization_pipeline.latest(user_id)
+        if job is not None:
+            return _job_status(job, language)
+        return REPLIES["no_intake", language]
+    if intent == RESEND_PDF:
+        return _resend_pdf(user_id, language)
+    if intent == CLINIC_LOCATION:
+        return _clinic_location(language)
+    if intent == AVAILABLE_TIMES:
+        return offer_times(language=language)
+    if intent == END_INTAKE and not history:
+        return REPLIES[END_INTAKE, language]
+    if intent == ACCEPT_OFFER:
+        return _accept_offer(user_id, language)
+    if intent == YES and _offered_last(history):
+        return _accept_offer(user_id, language)
+    # Finishing an intake in progress needs the model to extract the answers
+    return None
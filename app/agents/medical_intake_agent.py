@@ -1,20 +1,32 @@
-import json
 import os
-from datetime import date
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List
 
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import ChatOpenAI
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.config import config
+from app.services import metrics
+from app.services.conversation_history import recent_turns
+from app.services.deadline import Deadline
+from app.services.faq import faq_index
+from app.services.finalization import finalization_pipeline
 from app.services.models.models import SessionLocal
-from app.services.secure_storage import store_patient
 from app.services.utils.utils import logger
 
-from .schemas.patient_form_EN import PatientHistory
-from .tools_agent.pdf_filler_EN import fill_pdf
+from .intents import answer_intent, asks_confirmation, match_intent, resets_history
+from .model_router import FINAL_EXTRACTION, ModelRouter, classify_turn
+from .question_planner import draft_from_history, filled_fields, instructions, plan_questions
+from .structured_output import (
+    STRUCTURED_OUTPUT_INSTRUCTIONS,
+    IntakeValidationError,
+    bind_patient_history,
+    complete_intake,
+    is_submission,
+    looks_like_json,
+)
 
 # Global dictionary to store conversation history by user ID
 user_conversations: Dict[str, List[Any]] = {}
@@ -25,6 +37,30 @@ except Exception as e:  # pragma: no cover - tested via fallback
     print(f"Error loading OPENAI_API_KEY from ..env file: {e}")
     OPENAI_API_KEY = ""
 
+# Constrain the final answer with the PatientHistory schema via function calling
+STRUCTURED_OUTPUT = config("INTAKE_STRUCTURED_OUTPUT", default=True, cast=bool)
+# Extra model calls allowed per turn to repair an invalid submission
+MAX_REPAIRS = config("INTAKE_MAX_REPAIRS", default=2, cast=int)
+# Turns reloaded from the database for a sender unknown to this process
+REHYDRATE_TURNS = config("INTAKE_REHYDRATE_TURNS", default=20, cast=int)
+# Answer confident clinic FAQ matches locally (app/services/faq.py)
+FAQ_ANSWERS = config("FAQ_ANSWERS", default=True, cast=bool)
+# Tell the model which fields are missing and which to ask together
+PLANNER = config("INTAKE_PLANNER", default=True, cast=bool)
+PLANNER_BUNDLES = config("INTAKE_PLANNER_BUNDLES", default=1, cast=int)
+
+INTAKE_COMPLETED = "Patient intake form completed and validated:"
+
+_router: ModelRouter | None = None
+
+
+def get_router() -> ModelRouter:
+    """Return the shared model router (clients are reused across turns)."""
+    global _router
+    if _router is None:
+        _router = ModelRouter(OPENAI_API_KEY)
+    return _router
+
 
 def get_db():
     try:
@@ -34,29 +70,9 @@ def get_db():
         db.close()
 
 
-def intake_agent(query: str, user_id: str = "default_user") -> str:
-    """
-    Medical intake agent that collects patient information and validates it against the PatientHistory schema.
-
-    Args:
-        query: The patient's input message
-        user_id: Unique identifier for the user (e.g., phone number)
-
-    Returns:
-        A response message from the agent, or validated patient data in JSON format when completed
-    """
-    if not OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not configured")
-
-    llm = ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0.0,
-        openai_api_key=OPENAI_API_KEY,
-    )
-
-    # Bind the PDF generation tool for the final step
-    llm.bind_tools([fill_pdf])
-
+@lru_cache(maxsize=1)
+def _intake_prompt() -> ChatPromptTemplate:
+    """Build the intake chat prompt once; the template file does not change at runtime."""
     # Get the directory of the current file (medical_intake_agent.py)
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -65,9 +81,11 @@ def intake_agent(query: str, user_id: str = "default_user") -> str:
 
     # Load the system prompt template
     system_text = Path(templates_path).read_text(encoding="utf-8")
+    if STRUCTURED_OUTPUT:
+        system_text += STRUCTURED_OUTPUT_INSTRUCTIONS
 
     # Create a chat prompt template
-    prompt = ChatPromptTemplate.from_messages(
+    return ChatPromptTemplate.from_messages(
         [
             ("system", system_text),
             MessagesPlaceholder(variable_name="chat_history"),
@@ -75,84 +93,234 @@ def intake_agent(query: str, user_id: str = "default_user") -> str:
         ]
     )
 
-    # Initialize or get existing chat history for this user
+
+def _rehydrate(user_id: str) -> List[Any]:
+    """Chat history of an intake in progress, rebuilt from stored turns.
+
+    Used after a restart or when another worker handled the earlier turns.
+    Turns up to the last completed, restarted or cancelled intake are left
+    out, matching the history being cleared at that point.
+    """
+    try:
+        turns = recent_turns(user_id, REHYDRATE_TURNS)
+    except SQLAlchemyError as e:
+        logger.error(f"Error loading conversation history: {e}")
+        return []
+    history: List[Any] = []
+    for turn in turns:
+        if turn.response and (
+            turn.response.startswith(INTAKE_COMPLETED) or resets_history(turn.response)
+        ):
+            history = []
+            continue
+        history.append({"role": "human", "content": turn.message})
+        history.append({"role": "ai", "content": turn.response or ""})
+    return history
+
+
+def _short_circuit(query: str, user_id: str) -> str | None:
+    """Reply without the model to a command, a well-defined question or a clinic FAQ."""
+    matched = match_intent(query)
+    if matched is not None:
+        if user_id not in user_conversations:
+            user_conversations[user_id] = _rehydrate(user_id)
+        intent, language = matched
+        reply = answer_intent(intent, language, user_id, user_conversations[user_id])
+        if reply is not None and asks_confirmation(reply):
+            # Kept in the history: the confirmation is the repeated command
+            user_conversations[user_id].append({"role": "human", "content": query})
+            user_conversations[user_id].append({"role": "ai", "content": reply})
+        if reply is not None:
+            metrics.increment("llm_calls_saved")
+            metrics.increment(f"intent_replies.{intent}")
+            return reply
+    faq = faq_index.lookup(query) if FAQ_ANSWERS else None
+    if faq is None:
+        return None
     if user_id not in user_conversations:
-        user_conversations[user_id] = []
+        user_conversations[user_id] = _rehydrate(user_id)
+    # Keep the exchange in the history so the model sees it on the next turn
+    user_conversations[user_id].append({"role": "human", "content": query})
+    user_conversations[user_id].append({"role": "ai", "content": faq.entry.answer})
+    metrics.increment("llm_calls_saved")
+    return faq.entry.answer
 
-    # Process the input
-    chain = prompt | llm
 
-    result = chain.invoke({"input": query, "chat_history": user_conversations[user_id]})
+def _prepare_turn(query: str, user_id: str):
+    """Return the route, prompt messages and tool binding for one turn."""
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not configured")
 
-    # Update conversation history for this user
-    user_conversations[user_id].append({"role": "human", "content": query})
-    user_conversations[user_id].append({"role": "ai", "content": result.content})
+    # Initialize or get existing chat history for this user
+    if user_id not in user_conversations:
+        user_conversations[user_id] = _rehydrate(user_id)
 
+    end_requested = "**END INTAKE**" in query
+    messages = _intake_prompt().format_messages(
+        input=query, chat_history=user_conversations[user_id]
+    )
+    if PLANNER and not end_requested:
+        # This message answers the last question, so it counts towards the draft
+        draft = draft_from_history(
+            user_conversations[user_id] + [{"role": "human", "content": query}]
+        )
+        plan = plan_questions(draft, PLANNER_BUNDLES)
+        messages.insert(-1, SystemMessage(content=instructions(plan, draft)))
+        metrics.increment("intake_planned_turns")
+
+    # Cheap turns go to a small model; the final extraction to a stronger one
+    route = classify_turn(query, user_conversations[user_id])
+
+    # In structured mode the PatientHistory schema is bound as a tool so the
+    # final answer arrives as validated function-call arguments.
+    bind = partial(bind_patient_history, force=end_requested) if STRUCTURED_OUTPUT else None
+    return route, messages, end_requested, bind
+
+
+def _finish_turn(
+    query: str,
+    user_id: str,
+    result: AIMessage,
+    messages: List[BaseMessage],
+    end_requested: bool,
+    deadline: Deadline | None,
+) -> str:
+    """Finalize the intake if the model submitted it, else record the turn."""
     output = result.content
 
-    # Check if this looks like the final JSON output (when patient says "done" or "END INTAKE")
-    if "**END INTAKE**" in query or (
-        output.strip().startswith("{") and output.strip().endswith("}")
-    ):
+    # Check if this is the final output (tool submission, JSON reply or "END INTAKE")
+    if end_requested or is_submission(result) or looks_like_json(output):
         try:
-            # Try to parse the output as JSON
-            # First, extract JSON if there's any text before or after it
-            if "{" in output and "}" in output:
-                json_start = output.find("{")
-                json_end = output.rfind("}") + 1
-                json_str = output[json_start:json_end]
-            else:
-                json_str = output
-
-            # Parse the JSON to a dictionary
-            patient_data_dict = json.loads(json_str)
-
-            # Handle date field conversions (dob and signature_date)
-            if "dob" in patient_data_dict and patient_data_dict["dob"]:
-                patient_data_dict["dob"] = date.fromisoformat(patient_data_dict["dob"])
-
-            if (
-                "signature_date" in patient_data_dict
-                and patient_data_dict["signature_date"]
-            ):
-                patient_data_dict["signature_date"] = date.fromisoformat(
-                    patient_data_dict["signature_date"]
-                )
-
-            # Validate against PatientHistory model
-            patient_data = PatientHistory(**patient_data_dict)
+            patient_data = complete_intake(
+                get_router().llm(
+                    FINAL_EXTRACTION,
+                    bind=partial(bind_patient_history, force=True),
+                    deadline=deadline,
+                ),
+                messages,
+                result,
+                max_repairs=MAX_REPAIRS if STRUCTURED_OUTPUT else 0,
+            )
+        except IntakeValidationError as e:
+            # Repairs were exhausted within this turn; keep the history so the
+            # patient can correct the data on the next message.
+            user_conversations[user_id].append({"role": "human", "content": query})
+            user_conversations[user_id].append({"role": "ai", "content": e.raw_output})
+            print(f"Error validating patient data: {e}")
+            return f"Patient provided this information, but validation failed: {e}\n\n{e.raw_output}"
 
+        try:
             # Convert back to JSON string for output
             validated_json = patient_data.model_dump_json(indent=2)
             print("Successfully validated patient data against schema")
 
-            # Insert patient's information into database table
+            # Storing the intake and rendering the PDF run in the background;
+            # the patient is answered right away
+            job = finalization_pipeline.submit(user_id, patient_data)
+            logger.info("intake_submitted", intake_id=job.intake_id)
 
-            try:
-                patient_row_id = store_patient(
-                    #         patient_id=uuid.UUID(patient_data_dict["patient_id"]),
-                    full_name=patient_data_dict["full_name"],
-                    date_of_birth=patient_data_dict["dob"],
-                    phone_e164=patient_data_dict["phone_e164"],
-                    email=patient_data_dict.get("email"),
-                    address_json=patient_data_dict.get("address"),
-                )
-
-                logger.info(f"Conversation #{patient_row_id} stored in database")
-            except SQLAlchemyError as e:
-                logger.error(f"Error storing conversation in database: {e}")
+            # Intake efficiency: model turns per intake and fields per turn
+            turns = 1 + sum(
+                1 for message in user_conversations[user_id] if message.get("role") == "human"
+            )
+            metrics.observe("intake_turns", turns)
+            metrics.observe("intake_fields_per_turn", filled_fields(patient_data) / turns)
 
             # Clear the conversation history after successful completion
             user_conversations[user_id] = []
 
-            # After successfully validating:
-            pdf_path = fill_pdf(patient_data)
-            return f"Patient intake form completed and validated:\n{validated_json}\n\nPDF form generated at: {pdf_path}"
+            return (
+                f"{INTAKE_COMPLETED}\n{validated_json}\n\n"
+                f"Intake reference: {job.intake_id}\n"
+                f"PDF form is being generated at: {job.pdf_path}"
+            )
 
         except Exception as e:
-            # If validation fails, return error and original output
+            # If finalization fails, return error and the validated data
             print(f"Error validating patient data: {e}")
-            return f"Patient provided this information, but validation failed: {e}\n\n{output}"
+            return f"Patient provided this information, but validation failed: {e}\n\n{patient_data.model_dump_json()}"
+
+    # Update conversation history for this user
+    user_conversations[user_id].append({"role": "human", "content": query})
+    user_conversations[user_id].append({"role": "ai", "content": output})
 
     # For normal conversation turns, just return the agent's response
     return output
+
+
+def intake_agent(
+    query: str, user_id: str = "default_user", deadline: Deadline | None = None
+) -> str:
+    """
+    Medical intake agent that collects patient information and validates it against the PatientHistory schema.
+
+    Args:
+        query: The patient's input message
+        user_id: Unique identifier for the user (e.g., phone number)
+        deadline: Optional time budget for every model call made in this turn
+
+    Returns:
+        A response message from the agent, or validated patient data in JSON format when completed
+
+    Raises:
+        DeadlineExceeded: If ``deadline`` expires before the model answers
+    """
+    reply = _short_circuit(query, user_id)
+    if reply is not None:
+        return reply
+    route, messages, end_requested, bind = _prepare_turn(query, user_id)
+    result = get_router().invoke(route, messages, bind=bind, deadline=deadline)
+    return _finish_turn(query, user_id, result, messages, end_requested, deadline)
+
+
+def intake_agent_stream(
+    query: str, user_id: str = "default_user", deadline: Deadline | None = None
+) -> Iterator[str]:
+    """
+    Streaming variant of :func:`intake_agent` that yields the reply as it is generated.
+
+    Conversational replies are yielded token by token. Replies that turn out to
+    be the final intake (a tool submission or a JSON object) are not streamed
+    raw; the completion message is yielded once finalization has been queued,
+    after a blank line if the model already streamed some prose before it.
+
+    Args:
+        query: The patient's input message
+        user_id: Unique identifier for the user (e.g., phone number)
+        deadline: Optional time budget for every model call made in this turn
+
+    Yields:
+        Pieces of the reply text
+
+    Raises:
+        DeadlineExceeded: If ``deadline`` expires before the model finishes
+    """
+    reply = _short_circuit(query, user_id)
+    if reply is not None:
+        yield reply
+        return
+    route, messages, end_requested, bind = _prepare_turn(query, user_id)
+    result: AIMessageChunk | None = None
+    # Hold back leading output until it is clear the reply is not raw JSON
+    held = ""
+    streaming = False
+    for chunk in get_router().stream(route, messages, bind=bind, deadline=deadline):
+        result = chunk if result is None else result + chunk
+        if not isinstance(chunk.content, str) or not chunk.content:
+            continue
+        held += chunk.content
+        if streaming:
+            yield chunk.content
+        elif held.strip() and not held.lstrip().startswith("{"):
+            streaming = True
+            yield held
+
+    if result is None:
+        result = AIMessageChunk(content="")
+    reply = _finish_turn(query, user_id, result, messages, end_requested, deadline)
+    if not streaming:
+        yield reply
+    elif reply != held:
+        # The prose ended in a tool call: the completion (or validation
+        # error) still has to reach the patient
+        yield f"\n\n{reply}"
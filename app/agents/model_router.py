@@ -0,0 +1,470 @@
+"""
+Tiered model routing for the intake agent.
+
+Each turn is classified into a route (small talk, clarification, final
+extraction or red-flag triage) and every route maps to a model, a timeout and an
+optional fallback model. Cheap conversational turns stay on a small fast model
+while the final structured extraction and urgent symptom triage can use a
+stronger one. Routes are configured with the ``LLM_ROUTING_RULES`` JSON setting
+and per-model prices with ``LLM_MODEL_PRICES``; latency, token usage and cost
+are reported per route through :mod:`app.services.metrics`.
+
+Calls can carry a :class:`~app.services.deadline.Deadline`. When a call is
+slower than the configured latency percentile of its model, a hedged duplicate
+request is sent if the scheduler has a slot to spare, and whichever answers
+first wins; the slower one is dropped. Every request is admitted by the shared
+:data:`~app.services.llm_scheduler.llm_scheduler` at its route's priority.
+"""
+
+import json
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from app.config import config
+from app.services import metrics
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.llm_scheduler import (
+    CallSlot,
+    LLMScheduler,
+    Priority,
+    SchedulerRejected,
+    is_rate_limited,
+    llm_scheduler,
+    shared_http_client,
+)
+from app.services.utils.utils import logger
+
+from .intents import END_INTAKE, match_intent
+from .red_flags import screen
+
+SMALL_TALK = "small_talk"
+CLARIFICATION = "clarification"
+FINAL_EXTRACTION = "final_extraction"
+RED_FLAG_TRIAGE = "red_flag_triage"
+
+ROUTE_NAMES = (SMALL_TALK, CLARIFICATION, FINAL_EXTRACTION, RED_FLAG_TRIAGE)
+
+
+@dataclass(frozen=True)
+class Route:
+    """Model assignment for one turn type."""
+
+    name: str
+    model: str
+    timeout: float
+    fallback_model: Optional[str] = None
+    # Average latency (seconds) above which the fallback model is preferred
+    latency_budget: Optional[float] = None
+    max_retries: int = 1
+    temperature: float = 0.0
+    # Queue priority in the shared LLM scheduler (lower runs first)
+    priority: int = Priority.CLARIFICATION
+
+
+DEFAULT_ROUTES: Dict[str, Route] = {
+    SMALL_TALK: Route(SMALL_TALK, "gpt-4o-mini", timeout=10, priority=Priority.GREETING),
+    CLARIFICATION: Route(CLARIFICATION, "gpt-4o-mini", timeout=15),
+    FINAL_EXTRACTION: Route(
+        FINAL_EXTRACTION,
+        "gpt-4o",
+        timeout=45,
+        fallback_model="gpt-4o-mini",
+        latency_budget=20,
+        priority=Priority.FINALIZATION,
+    ),
+    RED_FLAG_TRIAGE: Route(
+        RED_FLAG_TRIAGE,
+        "gpt-4o",
+        timeout=15,
+        fallback_model="gpt-4o-mini",
+        latency_budget=8,
+        priority=Priority.RED_FLAG,
+    ),
+}
+
+# USD per 1K (input, output) tokens
+DEFAULT_MODEL_PRICES: Dict[str, tuple] = {
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+}
+
+_GREETING = re.compile(
+    r"^\s*(hi|hello|hey|hola|buenas|buenos dias|good (morning|afternoon|evening)|thanks|thank you|gracias|ok|okay)\W*$",
+    re.IGNORECASE,
+)
+
+# Smoothing factor for the per-model latency moving average
+_EWMA_ALPHA = 0.2
+# While a primary model is over budget, still probe it every N calls
+_PROBE_EVERY = 20
+
+# Send a hedged duplicate once a call is slower than this latency percentile
+# of its model (0 disables hedging) ...
+HEDGE_PERCENTILE = config("LLM_HEDGE_PERCENTILE", default=95, cast=float)
+# ... but only once enough latency samples exist to make the percentile useful
+HEDGE_MIN_SAMPLES = config("LLM_HEDGE_MIN_SAMPLES", default=20, cast=int)
+
+# Worker threads for deadline-bound and hedged calls. A losing request cannot
+# be interrupted mid-flight, so its thread finishes and the result is dropped.
+# Calls take their scheduler slot before they are submitted, so one worker per
+# slot the scheduler can ever grant means nothing waits in the pool's own
+# FIFO queue; waiting happens in the scheduler, by priority.
+_executor = ThreadPoolExecutor(
+    max_workers=int(llm_scheduler.max_limit),
+    thread_name_prefix="llm",
+)
+
+
+def load_routes() -> Dict[str, Route]:
+    """Return the default routes overridden by ``LLM_ROUTING_RULES``.
+
+    Example: ``LLM_ROUTING_RULES={"final_extraction": {"model": "gpt-4o", "timeout": 30}}``
+    """
+    routes = dict(DEFAULT_ROUTES)
+    raw = config("LLM_ROUTING_RULES", default="")
+    if not raw:
+        return routes
+    overrides = json.loads(raw)
+    for name, values in overrides.items():
+        if name not in routes:
+            raise ValueError(f"Unknown LLM route {name!r}; expected one of {ROUTE_NAMES}")
+        routes[name] = replace(routes[name], **values)
+    return routes
+
+
+def load_model_prices() -> Dict[str, tuple]:
+    """Return per-1K-token prices overridden by ``LLM_MODEL_PRICES``."""
+    prices = dict(DEFAULT_MODEL_PRICES)
+    raw = config("LLM_MODEL_PRICES", default="")
+    if raw:
+        prices.update({model: tuple(value) for model, value in json.loads(raw).items()})
+    return prices
+
+
+def classify_turn(query: str, history: Sequence[Any] = ()) -> str:
+    """Pick the route for a patient message."""
+    if screen(query):
+        return RED_FLAG_TRIAGE
+    # Only a message that is nothing but "done", "that's all", ... ends the
+    # intake; "I'm done with antibiotics" is an answer like any other
+    matched = match_intent(query)
+    if "**END INTAKE**" in query or (matched is not None and matched[0] == END_INTAKE):
+        return FINAL_EXTRACTION
+    if not history or _GREETING.match(query):
+        return SMALL_TALK
+    return CLARIFICATION
+
+
+class RoutedLLM:
+    """Runnable-like wrapper so callers can ``invoke`` a route directly."""
+
+    def __init__(
+        self,
+        router: "ModelRouter",
+        route: str,
+        bind: Optional[Callable[[Any], Any]] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        self.router = router
+        self.route = route
+        self.bind = bind
+        self.deadline = deadline
+
+    def invoke(self, messages: Sequence[BaseMessage]) -> AIMessage:
+        return self.router.invoke(self.route, messages, bind=self.bind, deadline=self.deadline)
+
+
+class ModelRouter:
+    """Send each turn to the model configured for its route."""
+
+    def __init__(
+        self,
+        api_key: str,
+        routes: Optional[Dict[str, Route]] = None,
+        prices: Optional[Dict[str, tuple]] = None,
+        llm_factory: Optional[Callable[..., Any]] = None,
+        scheduler: Optional[LLMScheduler] = None,
+    ) -> None:
+        self._http_client = None
+        if llm_factory is None:
+            from langchain_openai import ChatOpenAI
+
+            llm_factory = ChatOpenAI
+            self._http_client = shared_http_client()
+        self.api_key = api_key
+        self.scheduler = scheduler if scheduler is not None else llm_scheduler
+        self.routes = routes if routes is not None else load_routes()
+        self.prices = prices if prices is not None else load_model_prices()
+        self._llm_factory = llm_factory
+        self._clients: Dict[tuple, Any] = {}
+        self._latency: Dict[str, float] = {}
+        self._calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def client(self, route: Route, model: str) -> Any:
+        """Return the cached chat model for ``model`` with ``route`` limits."""
+        key = (model, route.timeout, route.max_retries, route.temperature)
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is None:
+                kwargs = (
+                    {"http_client": self._http_client, "stream_usage": True}
+                    if self._http_client
+                    else {}
+                )
+                llm = self._llm_factory(
+                    model=model,
+                    temperature=route.temperature,
+                    openai_api_key=self.api_key,
+                    timeout=route.timeout,
+                    max_retries=route.max_retries,
+                    **kwargs,
+                )
+                self._clients[key] = llm
+        return llm
+
+    def llm(
+        self,
+        route: str,
+        bind: Optional[Callable[[Any], Any]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> RoutedLLM:
+        """Return an object whose ``invoke`` runs on ``route``."""
+        return RoutedLLM(self, route, bind, deadline)
+
+    def candidates(self, route: Route) -> List[str]:
+        """Models to try for ``route`` in order, honouring the latency budget."""
+        if not route.fallback_model:
+            return [route.model]
+        order = [route.model, route.fallback_model]
+        with self._lock:
+            average = self._latency.get(route.model)
+            calls = self._calls.get(route.name, 0)
+        over_budget = (
+            route.latency_budget is not None
+            and average is not None
+            and average > route.latency_budget
+        )
+        if over_budget and calls % _PROBE_EVERY:
+            order.reverse()
+        return order
+
+    def invoke(
+        self,
+        route_name: str,
+        messages: Sequence[BaseMessage],
+        bind: Optional[Callable[[Any], Any]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> AIMessage:
+        """Invoke the model for ``route_name`` and fall back on errors or timeouts.
+
+        Raises:
+            DeadlineExceeded: If ``deadline`` expires before any model answers
+            SchedulerRejected: If the shared LLM call queue is full
+        """
+        route = self.routes[route_name]
+        with self._lock:
+            self._calls[route.name] = self._calls.get(route.name, 0) + 1
+        models = self.candidates(route)
+        for index, model in enumerate(models):
+            if deadline is not None:
+                deadline.check()
+            llm = self.client(route, model)
+            runnable = bind(llm) if bind else llm
+            start = time.perf_counter()
+            try:
+                result = self._call(route, model, runnable, messages, deadline)
+            except DeadlineExceeded:
+                metrics.increment(f"llm_deadline_exceeded.{route.name}")
+                raise
+            except SchedulerRejected:
+                # Every model shares the same queue, so falling back cannot help.
+                raise
+            except Exception as exc:
+                metrics.increment(f"llm_route_errors.{route.name}")
+                if index == len(models) - 1:
+                    raise
+                metrics.increment(f"llm_route_fallbacks.{route.name}")
+                logger.warning("llm_route_fallback", route=route.name, model=model, error=str(exc))
+                self._record_latency(model, time.perf_counter() - start)
+                continue
+            self._record(route, model, result, time.perf_counter() - start)
+            return result
+        raise RuntimeError(f"No model configured for route {route_name!r}")  # pragma: no cover
+
+    def stream(
+        self,
+        route_name: str,
+        messages: Sequence[BaseMessage],
+        bind: Optional[Callable[[Any], Any]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[AIMessageChunk]:
+        """Stream the reply of ``route_name`` chunk by chunk.
+
+        Streams are neither hedged nor retried on the fallback model once the
+        first chunk has been produced; the scheduler slot is held until the
+        stream is exhausted or closed.
+        """
+        route = self.routes[route_name]
+        with self._lock:
+            self._calls[route.name] = self._calls.get(route.name, 0) + 1
+        model = self.candidates(route)[0]
+        llm = self.client(route, model)
+        runnable = bind(llm) if bind else llm
+        merged: Optional[AIMessageChunk] = None
+        start = time.perf_counter()
+        with self.scheduler.slot(route.priority, deadline) as slot:
+            try:
+                for chunk in runnable.stream(messages):
+                    if merged is None:
+                        metrics.observe(
+                            f"llm_route_first_token_seconds.{route.name}",
+                            time.perf_counter() - start,
+                        )
+                    merged = chunk if merged is None else merged + chunk
+                    if deadline is not None:
+                        deadline.check()
+                    yield chunk
+            except DeadlineExceeded:
+                metrics.increment(f"llm_deadline_exceeded.{route.name}")
+                raise
+            except Exception as exc:
+                slot.throttled = is_rate_limited(exc)
+                metrics.increment(f"llm_route_errors.{route.name}")
+                raise
+        if merged is not None:
+            self._record(route, model, merged, time.perf_counter() - start)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds after which a hedged request is sent, or ``None``."""
+        if HEDGE_PERCENTILE <= 0:
+            return None
+        name = f"llm_model_latency_seconds.{model}"
+        if metrics.sample_count(name) < HEDGE_MIN_SAMPLES:
+            return None
+        return metrics.percentile(name, HEDGE_PERCENTILE)
+
+    def _call(
+        self,
+        route: Route,
+        model: str,
+        runnable: Any,
+        messages: Sequence[BaseMessage],
+        deadline: Optional[Deadline],
+    ) -> AIMessage:
+        """Run one model call, hedging it and bounding it by ``deadline``."""
+        hedge_after = self.hedge_delay(model)
+        if hedge_after is None and deadline is None:
+            return self._scheduled(route, runnable, messages, deadline)
+
+        self.scheduler.acquire(route.priority, deadline)
+        primary = self._submit(runnable, messages)
+        pending: List[Future] = [primary]
+        if hedge_after is not None:
+            wait_for = hedge_after if deadline is None else min(hedge_after, deadline.remaining())
+            done, _ = wait(pending, timeout=wait_for)
+            if not done and (deadline is None or not deadline.expired):
+                # A hedge only uses spare capacity; it never queues behind other turns
+                if self.scheduler.try_acquire():
+                    pending.append(self._submit(runnable, messages))
+                    metrics.increment(f"llm_hedges_sent.{route.name}")
+                else:
+                    metrics.increment(f"llm_hedges_skipped.{route.name}")
+
+        error: Optional[BaseException] = None
+        while pending:
+            timeout = deadline.remaining() if deadline is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {model}")
+            for future in done:
+                pending.remove(future)
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # First answer wins; the slower request is cancelled or ignored.
+                for other in pending:
+                    other.cancel()
+                if future is not primary:
+                    metrics.increment(f"llm_hedges_won.{route.name}")
+                return future.result()
+        raise error  # every attempt failed
+
+    def _submit(self, runnable: Any, messages: Sequence[BaseMessage]) -> Future:
+        """Run an admitted call on the worker pool; its slot is released when it ends.
+
+        The caller must already hold the scheduler slot. The slot is also
+        released if the call is cancelled before a worker picks it up.
+        """
+        slot = CallSlot()
+        start = time.perf_counter()
+
+        def release() -> None:
+            self.scheduler.release(time.perf_counter() - start, slot.throttled)
+
+        def run() -> AIMessage:
+            try:
+                return runnable.invoke(messages)
+            except Exception as exc:
+                slot.throttled = is_rate_limited(exc)
+                raise
+            finally:
+                release()
+
+        future = _executor.submit(run)
+        future.add_done_callback(lambda f: f.cancelled() and release())
+        return future
+
+    def _scheduled(
+        self,
+        route: Route,
+        runnable: Any,
+        messages: Sequence[BaseMessage],
+        deadline: Optional[Deadline],
+    ) -> AIMessage:
+        """Invoke ``runnable`` once the shared scheduler admits the call."""
+        with self.scheduler.slot(route.priority, deadline) as slot:
+            try:
+                return runnable.invoke(messages)
+            except Exception as exc:
+                slot.throttled = is_rate_limited(exc)
+                raise
+
+    def _record_latency(self, model: str, elapsed: float) -> None:
+        with self._lock:
+            previous = self._latency.get(model)
+            self._latency[model] = (
+                elapsed if previous is None else _EWMA_ALPHA * elapsed + (1 - _EWMA_ALPHA) * previous
+            )
+
+    def _record(self, route: Route, model: str, result: AIMessage, elapsed: float) -> None:
+        self._record_latency(model, elapsed)
+        usage = getattr(result, "usage_metadata", None) or {}
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        input_price, output_price = self.prices.get(model, (0.0, 0.0))
+        cost = input_tokens / 1000 * input_price + output_tokens / 1000 * output_price
+
+        metrics.observe(f"llm_route_latency_seconds.{route.name}", elapsed)
+        metrics.observe(f"llm_model_latency_seconds.{model}", elapsed)
+        metrics.increment(f"llm_route_calls.{route.name}")
+        metrics.increment(f"llm_route_input_tokens.{route.name}", input_tokens)
+        metrics.increment(f"llm_route_output_tokens.{route.name}", output_tokens)
+        metrics.increment(f"llm_route_cost_usd.{route.name}", cost)
+        logger.info(
+            "llm_route_call",
+            route=route.name,
+            model=model,
+            latency_ms=round(elapsed * 1000),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost_usd=round(cost, 6),
+        )
@@ -0,0 +1,325 @@
+"""
+Question planning for the intake conversation.
+
+``PatientHistory`` has about fifty fields, and a model left to the system
+prompt alone tends to ask for them one per turn. The planner reads the
+partial draft of the form, works out from the Pydantic field metadata which
+fields are still missing, and groups related fields into bundles that can be
+asked in one message: every ``ReviewOfSystems`` symptom as one checklist, the
+``LifestyleInfo`` block as one question, the ``family_history_*`` fields
+together, and so on. Bundles holding a required field come first.
+
+The model keeps its draft to itself, so the planner builds one from the chat
+history: a bundle counts as covered once the model asked about it (its cue
+words appear in a sentence of an assistant message that ends in a question
+mark) and the patient answered. Cues alone never fill a required field: the
+answer must also look like one (a date for the date of birth, a phone
+number, ...). Phone numbers and email addresses the patient volunteers fill
+their fields directly. The plan reaches the model as a short system note
+before the patient's message; the model still phrases the questions.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, get_args
+
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+from .red_flags import normalize
+from .schemas.patient_form_EN import PatientHistory
+
+# Optional in the schema, but the clinic does not accept an intake without them
+INTAKE_REQUIRED = ("phone_number", "reason_for_visit")
+
+# Filled in by staff or the model, never asked of the patient
+NOT_ASKED = ("red_flags", "signature", "signature_date")
+
+# Bundles in the order they are asked, with the top-level fields of each.
+# ``None`` takes every field with the bundle's name as prefix.
+_GROUPS: Tuple[Tuple[str, Optional[Tuple[str, ...]]], ...] = (
+    ("identity", ("name", "dob", "sex")),
+    ("contact", ("phone_number", "email_address", "address")),
+    ("visit", ("reason_for_visit", "duration_of_concern", "symptoms_description")),
+    ("emergency_contact", ("emergency_contact", "primary_care_physician")),
+    (
+        "medical_history",
+        (
+            "pre_conditions",
+            "surgeries_or_hospitalizations",
+            "serious_injuries_or_accidents",
+            "infectious_diseases",
+        ),
+    ),
+    ("allergies", None),
+    ("medications", ("prescriptions", "supplements", "alternative_medicine")),
+    ("family_history", None),
+    ("lifestyle", ("lifestyle",)),
+    ("review_of_systems", ("review_of_systems",)),
+    ("preventive_care", ("last_physical_exam", "last_blood_test", "last_vaccination")),
+    ("women_health", ("woman_health",)),
+    ("additional_comments", ("additional_comments",)),
+)
+
+# Words (normalized, EN and ES) showing the model asked about a bundle
+CUES: Dict[str, str] = {
+    "identity": r"full name|date of birth|birth ?date|born|nombre completo|fecha de nacimiento",
+    "contact": r"phone|email|e mail|home address|telefono|correo|direccion",
+    "visit": r"reason|brings you|concern|motivo|le trae|consulta de hoy",
+    "emergency_contact": (
+        r"emergency contact|primary care|contacto de emergencia|medico de cabecera"
+    ),
+    "medical_history": (
+        r"chronic|medical condition|surger|hospitali|injur|infectious"
+        r"|cronic|enfermedad|cirugi|hospitaliz|lesion|infeccios"
+    ),
+    "allergies": r"allerg|alergi",
+    "medications": r"medication|medicine|prescri|supplement|vitamin|medicament|suplement",
+    "family_history": r"family|relatives|parents|familia|familiares|padres",
+    "lifestyle": r"smok|tobacco|alcohol|drink|recreational|exercise|diet|fuma|tabaco|ejercicio",
+    "review_of_systems": (
+        r"fever|chills|fatigue|dizz|rash|nausea|shortness of breath"
+        r"|fiebre|escalofrio|cansancio|mareo|sarpullido|falta de aire"
+    ),
+    "preventive_care": (
+        r"physical exam|checkup|blood test|vaccin"
+        r"|examen fisico|chequeo|analisis de sangre|vacuna"
+    ),
+    "women_health": r"menstrua|pregnan|mammogram|pap smear|embaraz|mamografia",
+    "additional_comments": r"anything else|else you|algo mas|otra cosa",
+}
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Ten or more digits, so dates such as 1990-01-01 do not count
+_PHONE = re.compile(r"(?<![\w-])\+?\(?\d(?:[\s().-]{0,2}\d){9,14}(?![\w-])")
+_SENTENCE = re.compile(r"[^.!?\n]+[.!?]*")
+
+# What an answer must contain before it fills a required field (lowercased,
+# accents kept). Fields without an entry only need their bundle asked.
+_MONTH = r"[^\W\d_]{3,}\.?"
+EVIDENCE: Dict[str, "re.Pattern[str]"] = {
+    # First and last name
+    "name": re.compile(r"[^\W\d_]{2,}[\s,]+[^\W\d_]{2,}"),
+    "dob": re.compile(
+        r"\b\d{4}-\d{1,2}-\d{1,2}\b"
+        r"|\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"
+        rf"|\b\d{{1,2}}(st|nd|rd|th)?\s+(de\s+|of\s+)?{_MONTH},?\s+(de\s+)?\d{{4}}\b"
+        rf"|\b{_MONTH}\s+\d{{1,2}}(st|nd|rd|th)?,?\s+\d{{4}}\b"
+    ),
+    "phone_number": _PHONE,
+    # Something other than a bare yes/no
+    "reason_for_visit": re.compile(r"\b(?!(yes|no|si|ok|okay|nope|nothing|nada)\b)[^\W\d_]{3,}"),
+}
+# "I'd rather not say" names no field even though it has words in it
+_REFUSAL = re.compile(r"\b(rather not|prefer not|prefiero no|no quiero|dont want|don't want)\b")
+
+
+@dataclass(frozen=True)
+class Bundle:
+    """Related fields asked about in one message."""
+
+    name: str
+    fields: Tuple[str, ...]
+
+    @property
+    def title(self) -> str:
+        return self.name.replace("_", " ").capitalize()
+
+
+@dataclass(frozen=True)
+class Plan:
+    missing_required: List[str]
+    next_bundles: List[Bundle]
+    remaining_bundles: int
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing_required and not self.next_bundles
+
+
+def _nested_model(info: FieldInfo) -> Optional[type]:
+    """The ``BaseModel`` class of a (possibly ``Optional``) nested field."""
+    for candidate in (info.annotation, *get_args(info.annotation)):
+        if isinstance(candidate, type) and issubclass(candidate, BaseModel):
+            return candidate
+    return None
+
+
+def _label(name: str, info: FieldInfo) -> str:
+    return (info.description or name.replace("_", " ")).rstrip("?").lower()
+
+
+def _is_checklist(bundle: Bundle) -> bool:
+    """Whether most items of ``bundle`` are yes/no, like the review of systems."""
+    leaves: List[FieldInfo] = []
+    for name in bundle.fields:
+        info = PatientHistory.model_fields[name]
+        nested = _nested_model(info)
+        leaves.extend(nested.model_fields.values() if nested is not None else [info])
+    yes_no = sum(1 for i in leaves if bool in (i.annotation, *get_args(i.annotation)))
+    return yes_no * 2 > len(leaves)
+
+
+def _build_bundles() -> List[Bundle]:
+    fields = [name for name in PatientHistory.model_fields if name not in NOT_ASKED]
+    bundles = []
+    for name, members in _GROUPS:
+        if members is None:
+            members = tuple(f for f in fields if f.startswith(name))
+        bundles.append(Bundle(name, tuple(f for f in members if f in fields)))
+    # Fields added to the schema later are still asked, one bundle each
+    grouped = {f for bundle in bundles for f in bundle.fields}
+    bundles.extend(Bundle(f, (f,)) for f in fields if f not in grouped)
+    return bundles
+
+
+BUNDLES = _build_bundles()
+
+REQUIRED_FIELDS = tuple(
+    name for name, info in PatientHistory.model_fields.items() if info.is_required()
+) + INTAKE_REQUIRED
+
+_CUE_PATTERNS = {name: re.compile(rf"\b({pattern})") for name, pattern in CUES.items()}
+
+
+def _is_missing(name: str, value: Any) -> bool:
+    if value is None or value == "" or value == [] or value == {}:
+        return True
+    nested = _nested_model(PatientHistory.model_fields[name])
+    if nested is not None and isinstance(value, Mapping):
+        return any(
+            sub not in value for sub, info in nested.model_fields.items() if info.is_required()
+        )
+    return False
+
+
+def missing_fields(draft: Mapping[str, Any]) -> List[str]:
+    """Fields of ``draft`` (a partial ``PatientHistory`` dict) still to be asked."""
+    return [
+        name
+        for bundle in BUNDLES
+        for name in bundle.fields
+        if _is_missing(name, draft.get(name))
+    ]
+
+
+def field_labels(name: str, draft: Mapping[str, Any] | None = None) -> List[str]:
+    """Plain-language items to ask for ``name``; sub-fields for a nested block."""
+    info = PatientHistory.model_fields[name]
+    nested = _nested_model(info)
+    if nested is None:
+        return [_label(name, info)]
+    known = (draft or {}).get(name)
+    known = known if isinstance(known, Mapping) else {}
+    return [_label(sub, i) for sub, i in nested.model_fields.items() if sub not in known]
+
+
+def plan_questions(draft: Mapping[str, Any], max_bundles: int = 1) -> Plan:
+    """The next bundles to ask about, required fields first."""
+    missing = set(missing_fields(draft))
+    open_bundles = [b for b in BUNDLES if missing.intersection(b.fields)]
+    required = [f for f in REQUIRED_FIELDS if f in missing]
+    open_bundles.sort(key=lambda b: not any(f in required for f in b.fields))
+    return Plan(
+        missing_required=required,
+        next_bundles=open_bundles[:max_bundles],
+        remaining_bundles=len(open_bundles),
+    )
+
+
+def covered_bundles(text: str) -> List[Bundle]:
+    """Bundles an assistant message asks about in a question.
+
+    Only sentences ending in ``?`` count, so "we need your name, date of
+    birth and reason for visit." in a greeting does not cover the visit.
+    """
+    questions = [
+        " ".join(normalize(sentence))
+        for sentence in _SENTENCE.findall(text)
+        if sentence.rstrip().endswith("?")
+    ]
+    return [
+        bundle
+        for bundle in BUNDLES
+        if any(_CUE_PATTERNS[bundle.name].search(question) for question in questions)
+    ]
+
+
+def _answers(name: str, answer: str) -> bool:
+    """Whether ``answer`` can fill ``name`` after the patient was asked about it."""
+    if name not in REQUIRED_FIELDS:
+        return True
+    evidence = EVIDENCE.get(name)
+    answer = answer.lower()
+    return evidence is not None and not _REFUSAL.search(answer) and bool(evidence.search(answer))
+
+
+def draft_from_history(history: Sequence[Mapping[str, Any]]) -> Dict[str, Any]:
+    """Partial ``PatientHistory`` dict as far as the chat history shows.
+
+    Fields of a bundle the patient answered are set to ``True``; the answer
+    itself stays with the model.
+    """
+    draft: Dict[str, Any] = {}
+    asked: List[Bundle] = []
+    for message in history:
+        content = message.get("content") or ""
+        if message.get("role") == "ai":
+            asked = covered_bundles(content)
+            continue
+        for bundle in asked:
+            for name in bundle.fields:
+                if _answers(name, content):
+                    draft.setdefault(name, True)
+        asked = []
+        email = _EMAIL.search(content)
+        if email:
+            draft["email_address"] = email.group()
+        phone = _PHONE.search(content)
+        if phone:
+            draft["phone_number"] = phone.group()
+    return draft
+
+
+def instructions(plan: Plan, draft: Mapping[str, Any] | None = None) -> str:
+    """The plan as a system note for the model."""
+    lines = ["INTAKE PLAN (worked out from the answers so far; never mention it to the patient)"]
+    if plan.missing_required:
+        required = ", ".join(
+            _label(f, PatientHistory.model_fields[f]) for f in plan.missing_required
+        )
+        lines.append(f"• Still required before the intake can be submitted: {required}.")
+    if not plan.next_bundles:
+        lines.append(
+            "• Every topic has been covered. Ask if there is anything else, then finish "
+            "the intake."
+        )
+        return "\n".join(lines)
+    lines.append(
+        "• Ask about the following together in one short, natural message rather than one "
+        "item per turn:"
+    )
+    for bundle in plan.next_bundles:
+        items = [label for name in bundle.fields for label in field_labels(name, draft)]
+        hint = " (as a checklist: ask which ones apply)" if _is_checklist(bundle) else ""
+        lines.append(f"  – {bundle.title}{hint}: {'; '.join(items)}.")
+    later = plan.remaining_bundles - len(plan.next_bundles)
+    if later and not plan.missing_required:
+        lines.append(
+            f"• {later} optional topic(s) left after this; remind the patient they can stop "
+            "at any time."
+        )
+    return "\n".join(lines)
+
+
+def filled_fields(patient: BaseModel) -> int:
+    """Number of leaf values in ``patient`` that differ from the defaults."""
+
+    def count(value: Any) -> int:
+        if isinstance(value, dict):
+            return sum(count(v) for v in value.values())
+        if isinstance(value, list):
+            return sum(count(v) for v in value) if any(isinstance(v, dict) for v in value) else 1
+        return 1
+
+    return count(patient.model_dump(exclude_defaults=True))
@@ -0,0 +1,323 @@
+"""
+Rule-based red-flag pre-screen for inbound patient messages (EN/ES).
+
+Every message is checked against :data:`LEXICON` before any model is called,
+so urgent symptoms can be escalated at once instead of after an LLM round
+trip. The text is normalized first: accents are stripped, case is folded and
+apostrophes are dropped, so ``"Dolor de PECHO"``, ``"dolor de pecho"`` and
+``"can’t breathe"`` / ``"cant breathe"`` all match. The result is then
+split into words and punctuation.
+
+All phrases are compiled into one Aho-Corasick automaton over words, so a
+message is scanned in a single pass however many phrases there are. Phrases
+only match whole words: ``"stroke"`` is found in "I think it's a stroke" but
+not in "heatstroke". A match is ignored if a negation cue (``no``,
+``without``, ``sin``, ...) appears shortly before it in the same clause, as
+in "no chest pain".
+
+The intake itself asks for family and past medical history, so a match is
+also ignored when its clause is about someone else ("my father had a
+stroke") or about the past ("I had chest pain last year", "infarto hace dos
+años"). A first-person word between the relative and the match ("my wife
+says I can't breathe") keeps the match.
+"""
+
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+from app.config import config
+
+EMERGENCY_NUMBER = config("EMERGENCY_NUMBER", default="911")
+
+# language -> category -> phrases (written as patients type them)
+LEXICON: Dict[str, Dict[str, Sequence[str]]] = {
+    "en": {
+        "cardiac": (
+            "chest pain",
+            "chest pains",
+            "chest pressure",
+            "chest tightness",
+            "tight chest",
+            "pain in my chest",
+            "pain in the chest",
+            "heart attack",
+        ),
+        "respiratory": (
+            "can't breathe",
+            "cannot breathe",
+            "can not breathe",
+            "unable to breathe",
+            "hard to breathe",
+            "shortness of breath",
+            "short of breath",
+            "difficulty breathing",
+            "trouble breathing",
+            "choking",
+        ),
+        "neurological": (
+            "stroke",
+            "face drooping",
+            "slurred speech",
+            "sudden numbness",
+            "sudden weakness",
+            "worst headache of my life",
+            "seizure",
+            "seizures",
+        ),
+        "consciousness": ("unconscious", "passed out", "fainted", "unresponsive"),
+        "bleeding": (
+            "severe bleeding",
+            "bleeding heavily",
+            "won't stop bleeding",
+            "vomiting blood",
+            "coughing up blood",
+        ),
+        "self_harm": (
+            "suicide",
+            "suicidal",
+            "kill myself",
+            "end my life",
+            "want to die",
+            "hurt myself",
+            "self harm",
+        ),
+        "allergic_reaction": (
+            "anaphylaxis",
+            "throat closing",
+            "throat is closing",
+            "swollen throat",
+            "tongue swelling",
+        ),
+        "overdose": ("overdose", "overdosed"),
+    },
+    "es": {
+        "cardiac": (
+            "dolor de pecho",
+            "dolor en el pecho",
+            "opresión en el pecho",
+            "presión en el pecho",
+            "ataque al corazón",
+            "infarto",
+        ),
+        "respiratory": (
+            "no puedo respirar",
+            "falta de aire",
+            "me falta el aire",
+            "dificultad para respirar",
+            "me ahogo",
+            "ahogándome",
+        ),
+        "neurological": (
+            "derrame cerebral",
+            "accidente cerebrovascular",
+            "convulsión",
+            "convulsiones",
+            "no puedo hablar",
+            "entumecimiento repentino",
+            "peor dolor de cabeza",
+        ),
+        "consciousness": ("inconsciente", "me desmayé", "se desmayó", "desmayo"),
+        "bleeding": (
+            "sangrado abundante",
+            "sangrado fuerte",
+            "vomitando sangre",
+            "vómito con sangre",
+            "tosiendo sangre",
+        ),
+        "self_harm": (
+            "suicidio",
+            "suicida",
+            "suicidarme",
+            "matarme",
+            "quitarme la vida",
+            "quiero morir",
+            "hacerme daño",
+        ),
+        "allergic_reaction": (
+            "anafilaxia",
+            "se me cierra la garganta",
+            "garganta cerrada",
+            "lengua hinchada",
+        ),
+        "overdose": ("sobredosis",),
+    },
+}
+
+# Words that negate a phrase following within NEGATION_WINDOW words. "never",
+# "nunca" and "jamas" are left out on purpose: "I have never had chest pain
+# like this" is a reason to escalate, and the screen errs toward escalating.
+NEGATION_CUES = frozenset(
+    (
+        "no not without denies deny dont doesnt didnt havent hasnt isnt "
+        "sin niego tampoco ni"
+    ).split()
+)
+NEGATION_WINDOW = 3
+# Relatives a match is about when one of them opens its clause ("son" is left
+# out: in Spanish it is "they are", as in "mis sintomas son dolor de pecho")
+THIRD_PARTY_CUES = frozenset(
+    (
+        "father dad mother mom mum moms dads mums parents parent brother sister "
+        "grandfather grandmother grandpa grandma uncle aunt daughter cousin family wife "
+        "husband padre papa madre mama padres hermano hermana abuelo abuela tio tia hijo "
+        "hija primo prima esposo esposa familia familiar familiares"
+    ).split()
+)
+# ... unless the patient speaks about themselves in between
+FIRST_PERSON = frozenset("i im ive me myself yo tengo siento estoy".split())
+# Word sequences after a match that place it in the past
+PAST_MARKERS = (
+    ("years", "ago"),
+    ("year", "ago"),
+    ("months", "ago"),
+    ("last", "year"),
+    ("as", "a", "child"),
+    ("when", "i", "was"),
+    ("anos",),
+    ("ano", "pasado"),
+    ("de", "nino"),
+    ("de", "nina"),
+)
+_YEAR = re.compile(r"(19|20)\d\d")
+CONTEXT_WINDOW = 6
+# A negation does not reach across these
+_CLAUSE_BREAKS = frozenset(". , ; : ! ? but however although pero aunque sino".split())
+
+ESCALATION_MESSAGES = {
+    "en": (
+        f"What you describe may need urgent care. If this is an emergency, call "
+        f"{EMERGENCY_NUMBER} or go to the nearest emergency room now. Your message "
+        "has been flagged as urgent for our team."
+    ),
+    "es": (
+        f"Lo que describe puede requerir atención urgente. Si es una emergencia, "
+        f"llame al {EMERGENCY_NUMBER} o acuda ahora a la sala de emergencias más "
+        "cercana. Su mensaje se marcó como urgente para nuestro equipo."
+    ),
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+|[.,;:!?]")
+
+
+@dataclass(frozen=True)
+class RedFlag:
+    """One lexicon phrase found in a message."""
+
+    term: str
+    category: str
+    language: str
+
+
+def normalize(text: str) -> List[str]:
+    """Words and punctuation of ``text`` without accents, case or apostrophes."""
+    folded = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return _TOKEN.findall(folded.lower().replace("'", ""))
+
+
+class RedFlagScreen:
+    """Aho-Corasick automaton over words for a red-flag lexicon."""
+
+    def __init__(self, lexicon: Dict[str, Dict[str, Sequence[str]]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        # Per state: (phrase length in words, flag) of every phrase ending there
+        self._out: List[List[Tuple[int, RedFlag]]] = [[]]
+        for language, categories in lexicon.items():
+            for category, terms in categories.items():
+                for term in terms:
+                    self._add(normalize(term), RedFlag(term, category, language))
+        self._fail = self._link()
+
+    def _add(self, words: List[str], flag: RedFlag) -> None:
+        state = 0
+        for word in words:
+            nxt = self._goto[state].get(word)
+            if nxt is None:
+                nxt = self._goto[state][word] = len(self._goto)
+                self._goto.append({})
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(words), flag))
+
+    def _link(self) -> List[int]:
+        """Failure links (breadth first); outputs of suffix states are merged in."""
+        fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in self._goto[state].items():
+                queue.append(nxt)
+                back = fail[state]
+                while back and word not in self._goto[back]:
+                    back = fail[back]
+                fail[nxt] = self._goto[back].get(word, 0)
+                self._out[nxt] = self._out[nxt] + self._out[fail[nxt]]
+        return fail
+
+    def scan(self, text: str) -> List[RedFlag]:
+        """Red flags in ``text`` that are not negated, each reported once."""
+        goto, fail, out = self._goto, self._fail, self._out
+        words = normalize(text)
+        found: Dict[RedFlag, None] = {}
+        state = 0
+        for i, word in enumerate(words):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for length, flag in out[state]:
+                start = i - length + 1
+                if not (
+                    _negated(words, start)
+                    or _about_someone_else(words, start)
+                    or _in_the_past(words, i + 1)
+                ):
+                    found[flag] = None
+        return list(found)
+
+
+def _negated(words: List[str], start: int) -> bool:
+    for word in reversed(words[max(0, start - NEGATION_WINDOW) : start]):
+        if word in _CLAUSE_BREAKS:
+            return False
+        if word in NEGATION_CUES:
+            return True
+    return False
+
+
+def _about_someone_else(words: List[str], start: int) -> bool:
+    for word in reversed(words[max(0, start - CONTEXT_WINDOW) : start]):
+        if word in _CLAUSE_BREAKS or word in FIRST_PERSON:
+            return False
+        if word in THIRD_PARTY_CUES:
+            return True
+    return False
+
+
+def _in_the_past(words: List[str], end: int) -> bool:
+    following = []
+    for word in words[end : end + CONTEXT_WINDOW]:
+        if word in _CLAUSE_BREAKS:
+            break
+        following.append(word)
+    for i, word in enumerate(following):
+        if _YEAR.fullmatch(word):
+            return True
+        if any(tuple(following[i : i + len(m)]) == m for m in PAST_MARKERS):
+            return True
+    return False
+
+
+red_flag_screen = RedFlagScreen(LEXICON)
+
+
+def screen(text: str) -> List[RedFlag]:
+    """Red flags in a patient message, using the built-in lexicon."""
+    return red_flag_screen.scan(text)
+
+
+def escalation_message(flags: Sequence[RedFlag]) -> str:
+    """Urgent-care reply in the language of the matched phrases."""
+    spanish = any(flag.language == "es" for flag in flags)
+    return ESCALATION_MESSAGES["es" if spanish else "en"]
@@ -0,0 +1,142 @@
+"""
+Structured ``PatientHistory`` extraction through OpenAI function calling.
+
+Instead of searching the model's free text for braces, the schema is bound as a
+tool so the final answer arrives as function-call arguments constrained by the
+``PatientHistory`` JSON schema. The raw arguments are validated in one pass with
+``model_validate_json`` and, when validation fails, the error details are sent
+back to the model as a tool result inside the same turn so the patient never
+sees a "validation failed" reply for a repairable mistake.
+"""
+
+from typing import Any, List, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from pydantic import ValidationError
+
+from app.services import metrics
+from app.services.utils.utils import logger
+
+from .schemas.patient_form_EN import PatientHistory
+
+TOOL_NAME = PatientHistory.__name__
+
+# Appended to the system prompt when structured output is enabled.
+STRUCTURED_OUTPUT_INSTRUCTIONS = (
+    "\n\nSUBMITTING THE INTAKE\n"
+    f"• When the intake is complete, call the `{TOOL_NAME}` function with the final JSON object "
+    "instead of writing the JSON in your reply.\n"
+    "• Dates must use the ISO-8601 format YYYY-MM-DD."
+)
+
+
+class IntakeValidationError(Exception):
+    """Raised when the model could not produce a valid ``PatientHistory``."""
+
+    def __init__(self, message: str, raw_output: str = "") -> None:
+        super().__init__(message)
+        self.raw_output = raw_output
+
+
+def bind_patient_history(llm: Any, force: bool = False) -> Any:
+    """Bind the ``PatientHistory`` schema as a tool, optionally forcing the call."""
+    return llm.bind_tools([PatientHistory], tool_choice=TOOL_NAME if force else "auto")
+
+
+def extract_json_block(text: str) -> str | None:
+    """Return the outermost ``{...}`` block of ``text`` or ``None``."""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    return text[start : end + 1]
+
+
+def looks_like_json(text: str) -> bool:
+    """Whether a free-text reply is (legacy) final JSON output."""
+    stripped = text.strip()
+    return stripped.startswith("{") and stripped.endswith("}")
+
+
+def submission_calls(message: AIMessage) -> List[dict]:
+    """Return the raw ``PatientHistory`` tool calls of ``message``."""
+    return [
+        call
+        for call in message.additional_kwargs.get("tool_calls", [])
+        if call.get("function", {}).get("name") == TOOL_NAME
+    ]
+
+
+def is_submission(message: AIMessage) -> bool:
+    """Whether the model submitted the intake through the tool."""
+    return bool(submission_calls(message))
+
+
+def _raw_submission(message: AIMessage) -> str | None:
+    calls = submission_calls(message)
+    if calls:
+        return calls[0]["function"].get("arguments") or ""
+    return extract_json_block(message.content or "")
+
+
+def _repair_messages(message: AIMessage, error: str) -> List[BaseMessage]:
+    """Build the follow-up messages that hand a validation error back to the model."""
+    feedback = (
+        f"The {TOOL_NAME} data is invalid. Fix these errors and call {TOOL_NAME} again "
+        f"with the complete corrected object:\n{error}"
+    )
+    calls = message.additional_kwargs.get("tool_calls", [])
+    if not calls:
+        return [message, HumanMessage(content=feedback)]
+    # Every tool call of an assistant message must be answered by a tool result.
+    return [message] + [ToolMessage(content=feedback, tool_call_id=call["id"]) for call in calls]
+
+
+def complete_intake(
+    forced_llm: Any,
+    messages: Sequence[BaseMessage],
+    result: AIMessage,
+    max_repairs: int = 2,
+) -> PatientHistory:
+    """
+    Validate the model's submission, repairing it in-turn when possible.
+
+    Args:
+        forced_llm: LLM bound with a forced ``PatientHistory`` tool call
+        messages: Prompt messages that produced ``result``
+        result: The model's reply that ends the intake
+        max_repairs: How many extra model calls may be spent fixing errors
+
+    Returns:
+        The validated ``PatientHistory``
+
+    Raises:
+        IntakeValidationError: If the data is still invalid after ``max_repairs``
+    """
+    conversation = list(messages)
+    attempt = 0
+    while True:
+        raw = _raw_submission(result)
+        if raw is None:
+            error = f"No JSON object was provided. Call {TOOL_NAME} with the collected data."
+        else:
+            try:
+                patient_data = PatientHistory.model_validate_json(raw)
+            except ValidationError as exc:
+                error = str(exc)
+            else:
+                if attempt:
+                    # Each in-turn repair saves the patient a full round trip.
+                    metrics.increment("intake_validation_retries_avoided")
+                    logger.info("intake_validation_repaired", attempts=attempt)
+                return patient_data
+
+        if attempt >= max_repairs:
+            metrics.increment("intake_validation_failures")
+            raise IntakeValidationError(error, raw_output=raw or result.content or "")
+
+        attempt += 1
+        metrics.increment("intake_validation_repair_calls")
+        logger.info("intake_validation_retry", attempt=attempt)
+        conversation.extend(_repair_messages(result, error))
+        result = forced_llm.invoke(conversation)
@@ -0,0 +1,64 @@
+"""
+Appointment-time offers for the chat flow.
+
+The ``available_times`` intent (:mod:`app.agents.intents`) answers "what
+times are available?" with :func:`offer_times`. Answers come from the in-memory :data:`~app.services.scheduler.slot_index`,
+which is refreshed from the database at most every few seconds rather than on
+every chat turn.
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.services.models.models import SessionLocal
+from app.services.reminders import CLINIC_TIMEZONE
+from app.services.scheduler import FreeSlot, slot_index
+
+MESSAGES = {
+    "en": (
+        "These appointment times are available:",
+        "Sorry, there are no open appointment times right now.",
+    ),
+    "es": (
+        "Estos horarios de cita están disponibles:",
+        "Lo sentimos, ahora mismo no hay horarios de cita disponibles.",
+    ),
+}
+
+
+def next_free_slots(
+    limit: int = 3,
+    after: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    provider_id: Optional[str] = None,
+    service_type: Optional[str] = None,
+    min_minutes: Optional[int] = None,
+) -> List[FreeSlot]:
+    """Return the next ``limit`` free slots matching the filters."""
+    slot_index.ensure_fresh(SessionLocal)
+    return slot_index.next_free(
+        limit,
+        after=after,
+        before=before,
+        provider_id=provider_id,
+        service_type=service_type,
+        min_duration=timedelta(minutes=min_minutes) if min_minutes else None,
+    )
+
+
+def format_slots(slots: List[FreeSlot], language: str = "en") -> str:
+    """Render slots as a numbered list for a chat reply."""
+    heading, none_open = MESSAGES[language]
+    if not slots:
+        return none_open
+    lines = [heading]
+    for number, slot in enumerate(slots, 1):
+        start = slot.start_time.astimezone(CLINIC_TIMEZONE)
+        when = f"{start:%d/%m/%Y %H:%M}" if language == "es" else f"{start:%A %d %B, %H:%M}"
+        lines.append(f"{number}. {when}")
+    return "\n".join(lines)
+
+
+def offer_times(limit: int = 3, language: str = "en", **filters) -> str:
+    """Reply text offering the next free appointment times."""
+    return format_slots(next_free_slots(limit, **filters), language)
@@ -1,21 +1,134 @@
 # Third-party imports
+import asyncio
+import hmac
+import json
 import sys
+import threading
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Iterator
 
 # Internal imports
-from .agents.medical_intake_agent import intake_agent
-from fastapi import Depends, FastAPI, Form, HTTPException, Request, Response
+from .agents.medical_intake_agent import intake_agent, intake_agent_stream
+from .agents.red_flags import escalation_message, screen as screen_red_flags
+from fastapi import Depends, FastAPI, Form, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from .services import metrics
+from .services.conversation_history import conversation_page
+from .services.deadline import Deadline, DeadlineExceeded
+from .services.delivery_status import close_writers, latency_histograms, record_statuses
+from .services.export import MEDIA_TYPES, check_export, file_suffix, iter_export
+from .services.finalization import finalization_pipeline
+from .services.llm_scheduler import SchedulerRejected
+from .services.phi_vault import PHI_VAULT, close_vault, compact_vault
+from .services.reminders import reminder_service
+from .services.retention import MAINTENANCE_INTERVAL_SECONDS, run_retention
+from .services.scheduler import REFRESH_SECONDS, slot_index
+from .services.slot_generator import run_slot_generation
+from .services.waitlist import release_expired_holds, waitlist_matcher
+from .services.facebook_service import chunk_reply
+from .services.idempotency import claim_message, prune_processed_messages, release_message
+from .services.webhook_payload import (
+    WebhookKind,
+    classify,
+    iter_messages,
+    iter_statuses,
+    parse_webhook,
+)
 from .services.facebook_service import send_message as fb_send_message
 
 # Relative imports since main.py is in the same directory as services
 from .services.models.models import SessionLocal
 from .services.secure_storage import store_conversation
 from .services.utils.utils import logger
+from pydantic import ValidationError
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from app.config import config
 
-app = FastAPI()
+# Poll for freed slots and offer them to waitlisted patients
+WAITLIST_MATCHER = config("WAITLIST_MATCHER", default=True, cast=bool)
+# Plan appointment reminders and send due WhatsApp outbox messages
+REMINDERS = config("REMINDERS", default=True, cast=bool)
+# Create upcoming conversation partitions and archive expired ones
+CONVERSATION_MAINTENANCE = config("CONVERSATION_MAINTENANCE", default=True, cast=bool)
+# Staff endpoints that return patient data require this in the X-API-Key header
+STAFF_API_KEY = config("STAFF_API_KEY", default="")
+
+
+async def _watch_slots() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        # Expired offers free their slots, which the refresh hands to the waitlist
+        await loop.run_in_executor(None, release_expired_holds)
+        await loop.run_in_executor(None, slot_index.ensure_fresh, SessionLocal)
+        await asyncio.sleep(REFRESH_SECONDS)
+
+
+async def _maintain_conversations() -> None:
+    loop = asyncio.get_running_loop()
+    steps = [run_retention, prune_processed_messages, run_slot_generation]
+    if PHI_VAULT:
+        steps.append(compact_vault)
+    while True:
+        for step in steps:
+            try:
+                await loop.run_in_executor(None, step)
+            except Exception as e:
+                # A failed step must not end maintenance (and partition creation) for good
+                metrics.increment("maintenance_errors")
+                logger.error(f"Error in maintenance step {step.__name__}: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    watcher = maintenance = None
+    if WAITLIST_MATCHER:
+        slot_index.listeners.append(waitlist_matcher.on_slots_freed)
+        watcher = asyncio.create_task(_watch_slots())
+    if REMINDERS:
+        reminder_service.start()
+    if CONVERSATION_MAINTENANCE:
+        maintenance = asyncio.create_task(_maintain_conversations())
+    # Resume intakes whose storage or PDF had not finished before a restart
+    finalization_pipeline.recover()
+    yield
+    if maintenance is not None:
+        maintenance.cancel()
+    if watcher is not None:
+        watcher.cancel()
+        slot_index.listeners.remove(waitlist_matcher.on_slots_freed)
+    reminder_service.close()
+    finalization_pipeline.close()
+    close_vault()
+    # Write buffered delivery rows before the process exits
+    close_writers()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Hard limit for all model calls made while answering one message
+TURN_DEADLINE_SECONDS = config("TURN_DEADLINE_SECONDS", default=60, cast=float)
+# After this long the patient gets a holding message and the reply follows later
+TURN_REPLY_BUDGET_SECONDS = config("TURN_REPLY_BUDGET_SECONDS", default=10, cast=float)
+# Send long WhatsApp replies as chunked messages while they are generated
+STREAM_REPLIES = config("FB_STREAM_REPLIES", default=False, cast=bool)
+# Answer messages with urgent symptoms at once, before the model replies
+RED_FLAG_ESCALATION = config("RED_FLAG_ESCALATION", default=True, cast=bool)
+
+STILL_WORKING_MESSAGE = "Thanks! I'm still working on your answer and will reply in a moment."
+DEADLINE_EXCEEDED_MESSAGE = (
+    "Sorry, this is taking longer than expected. Please send your last message again."
+)
+BUSY_MESSAGE = (
+    "We're receiving a lot of messages right now. Please try again in a few minutes."
+)
+ERROR_MESSAGE = "Sorry, something went wrong while answering. Please send your last message again."
+
+# Keep references to late replies so they are not garbage collected mid-flight
+_late_replies: set = set()
 
 
 # Dependency
@@ -27,6 +140,212 @@ def get_db():
         db.close()
 
 
+def require_staff(x_api_key: str | None = Header(None)) -> None:
+    """Reject requests without the staff API key; patient data is behind it."""
+    if not STAFF_API_KEY:
+        raise HTTPException(status_code=503, detail="STAFF_API_KEY is not configured")
+    if x_api_key is None or not hmac.compare_digest(x_api_key, STAFF_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+
+def _store_and_send(sender: str, text: str, response: str, db: Session | None = None) -> None:
+    """Persist one conversation turn and send the reply over WhatsApp."""
+    try:
+        conversation_id = store_conversation(sender, text, response, db)
+        logger.info(f"Conversation #{conversation_id} stored in database")
+    except SQLAlchemyError as e:
+        logger.error(f"Error storing conversation in database: {e}")
+    fb_send_message(sender, response)
+
+
+async def _finish_late_reply(sender: str, text: str, pending: asyncio.Future) -> None:
+    """Deliver the real reply of a turn that overran its reply budget."""
+    try:
+        response = await pending
+    except DeadlineExceeded:
+        response = DEADLINE_EXCEEDED_MESSAGE
+    except SchedulerRejected:
+        response = BUSY_MESSAGE
+    except Exception as e:
+        # Nobody awaits this task, so the patient would wait for a reply forever
+        logger.error(f"Error finishing a late reply: {e}")
+        metrics.increment("turn_late_reply_errors")
+        response = ERROR_MESSAGE
+    # The request's DB session is closed by now, so store with a fresh one
+    await asyncio.get_running_loop().run_in_executor(
+        None, _store_and_send, sender, text, response
+    )
+    metrics.increment("turn_late_replies")
+
+
+def _stream_agent(sender: str, text: str, deadline: Deadline) -> Iterator[str]:
+    """Yield the agent's reply pieces, ending with a notice if the turn fails."""
+    streamed = False
+    try:
+        for piece in intake_agent_stream(text, sender, deadline=deadline):
+            streamed = True
+            yield piece
+    except DeadlineExceeded:
+        yield DEADLINE_EXCEEDED_MESSAGE
+    except SchedulerRejected:
+        yield BUSY_MESSAGE
+    except Exception as e:
+        # Runs in an executor nobody awaits; end the reply so it is still sent and stored
+        logger.error(f"Error streaming a reply: {e}")
+        metrics.increment("turn_stream_errors")
+        yield f"\n\n{ERROR_MESSAGE}" if streamed else ERROR_MESSAGE
+
+
+def _stream_and_send(
+    sender: str, text: str, deadline: Deadline, first_sent: threading.Event
+) -> None:
+    """Send the streamed reply as chunked WhatsApp messages, then persist the turn."""
+    pieces = []
+
+    def record() -> Iterator[str]:
+        for piece in _stream_agent(sender, text, deadline):
+            pieces.append(piece)
+            yield piece
+
+    try:
+        for message in chunk_reply(record()):
+            fb_send_message(sender, message)
+            first_sent.set()
+    finally:
+        first_sent.set()
+    try:
+        conversation_id = store_conversation(sender, text, "".join(pieces))
+        logger.info(f"Conversation #{conversation_id} stored in database")
+    except SQLAlchemyError as e:
+        logger.error(f"Error storing conversation in database: {e}")
+
+
+async def _stream_within_budget(sender: str, text: str) -> None:
+    """Stream the reply in chunks; send a holding message if none arrives in time."""
+    deadline = Deadline.after(TURN_DEADLINE_SECONDS)
+    first_sent = threading.Event()
+    loop = asyncio.get_running_loop()
+    task = loop.run_in_executor(None, _stream_and_send, sender, text, deadline, first_sent)
+    _late_replies.add(task)
+    task.add_done_callback(_late_replies.discard)
+    in_time = await loop.run_in_executor(None, first_sent.wait, TURN_REPLY_BUDGET_SECONDS)
+    if not in_time:
+        metrics.increment("turn_reply_budget_exceeded")
+        fb_send_message(sender, STILL_WORKING_MESSAGE)
+
+
+def _escalate_red_flags(sender: str, text: str) -> None:
+    """Send the urgent-care reply if ``text`` mentions a red-flag symptom."""
+    flags = screen_red_flags(text)
+    if not flags:
+        return
+    for category in {flag.category for flag in flags}:
+        metrics.increment(f"red_flag_escalations.{category}")
+    logger.warning(
+        "red_flag_escalation", terms=[flag.term for flag in flags], to=f"{sender[:2]}***"
+    )
+    fb_send_message(sender, escalation_message(flags))
+
+
+async def _reply_within_budget(sender: str, text: str, db: Session) -> None:
+    """Run the agent under a deadline and answer within the reply budget.
+
+    If the agent is still running when ``TURN_REPLY_BUDGET_SECONDS`` elapse the
+    patient gets a holding message and the real reply is sent once it is ready.
+    A message with red-flag symptoms is answered with urgent-care advice first;
+    its model turn then runs on the high-priority triage route.
+    """
+    if RED_FLAG_ESCALATION:
+        _escalate_red_flags(sender, text)
+    if STREAM_REPLIES:
+        await _stream_within_budget(sender, text)
+        return
+    deadline = Deadline.after(TURN_DEADLINE_SECONDS)
+    loop = asyncio.get_running_loop()
+    pending = loop.run_in_executor(
+        None, partial(intake_agent, text, sender, deadline=deadline)
+    )
+    try:
+        response = await asyncio.wait_for(
+            asyncio.shield(pending), timeout=TURN_REPLY_BUDGET_SECONDS
+        )
+    except asyncio.TimeoutError:
+        metrics.increment("turn_reply_budget_exceeded")
+        fb_send_message(sender, STILL_WORKING_MESSAGE)
+        task = asyncio.create_task(_finish_late_reply(sender, text, pending))
+        _late_replies.add(task)
+        task.add_done_callback(_late_replies.discard)
+        return
+    except DeadlineExceeded:
+        response = DEADLINE_EXCEEDED_MESSAGE
+    except SchedulerRejected:
+        response = BUSY_MESSAGE
+    _store_and_send(sender, text, response, db)
+
+
+@app.get("/metrics")
+async def get_metrics() -> dict:
+    """Expose the in-process counters, gauges and latency histograms."""
+    return metrics.snapshot()
+
+
+@app.get("/metrics/delivery")
+async def get_delivery_metrics(db: Session = Depends(get_db)) -> dict:
+    """Send→delivered and send→read latency histograms for the last 24 hours."""
+    return latency_histograms(db)
+
+
+@app.get("/conversations/{sender}", dependencies=[Depends(require_staff)])
+async def get_conversations(
+    sender: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+) -> dict:
+    """One newest-first page of a sender's chat log; pass ``next_cursor`` back for more."""
+    try:
+        turns, next_cursor = conversation_page(sender, limit, cursor, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+    return {
+        "items": [
+            {
+                "id": turn.id,
+                "created_at": turn.created_at.isoformat(),
+                "message": turn.message,
+                "response": turn.response,
+            }
+            for turn in turns
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.get("/export/{table}", dependencies=[Depends(require_staff)])
+async def export(
+    table: str,
+    format: str = "jsonl",
+    gzip: bool = False,
+    after_id: int = Query(0, ge=0),
+) -> StreamingResponse:
+    """Stream ``conversations`` or ``patients`` as CSV, JSON Lines or Parquet.
+
+    ``after_id`` resumes a conversations export after the last ``id`` received.
+    """
+    try:
+        check_export(table, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    compress = gzip and format != "parquet"
+    filename = f"{table}{file_suffix(format, compress)}"
+    return StreamingResponse(
+        # Opens its own session: the request's one is closed before streaming ends
+        iter_export(table, format, gzip, after_id),
+        media_type="application/gzip" if compress else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.get("/facebook/webhook")
 async def facebook_verify(request: Request) -> Response:
     """Verify the Facebook webhook challenge."""
@@ -41,27 +360,36 @@ async def facebook_verify(request: Request) -> Response:
 @app.post("/facebook/webhook")
 async def facebook_webhook(request: Request, db: Session = Depends(get_db)):
     """Handle incoming Facebook WhatsApp messages."""
-    data = await request.json()
-    for entry in data.get("entry", []):
-        for change in entry.get("changes", []):
-            value = change.get("value", {})
-            for message in value.get("messages", []):
-                whatsapp_number = message.get("from")
-                text = message.get("text", {}).get("body", "")
-                if not whatsapp_number or not text:
-                    continue
-                langchain_response = intake_agent(text)
-                try:
-                    conversation_id = store_conversation(
-                        whatsapp_number,
-                        text,
-                        langchain_response,
-                        db,
-                    )
-                    logger.info(f"Conversation #{conversation_id} stored in database")
-                except SQLAlchemyError as e:
-                    logger.error(f"Error storing conversation in database: {e}")
-                fb_send_message(whatsapp_number, langchain_response)
+    body = await request.body()
+    kind = classify(body)
+    metrics.increment(f"webhook_events.{kind.value}")
+    if kind is WebhookKind.OTHER:
+        return ""
+    try:
+        envelope = parse_webhook(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload") from e
+    # Delivery/read callbacks need no agent work; buffer them for bulk insert
+    record_statuses(iter_statuses(envelope))
+    if kind is WebhookKind.STATUS:
+        return ""
+    for message in iter_messages(envelope):
+        whatsapp_number = message["from"]
+        text = message.get("text", {}).get("body", "")
+        if not whatsapp_number or not text:
+            continue
+        # Meta redelivers slow webhooks; answer each message ID once
+        message_id = message.get("id")
+        if message_id and not claim_message(message_id, db):
+            logger.info("webhook_duplicate_ignored", message_id=message_id)
+            continue
+        try:
+            await _reply_within_budget(whatsapp_number, text, db)
+        except Exception:
+            # Let Meta's redelivery of this message be processed again
+            if message_id:
+                release_message(message_id, db)
+            raise
     return ""
 
 
@@ -77,15 +405,7 @@ async def reply(
     whatsapp_number = From.split("whatsapp:")[-1]
     masked_number = f"{whatsapp_number[:2]}***"
     logger.info("send_response", to=masked_number)
-    langchain_response = intake_agent(Body)
-    try:
-        conversation_id = store_conversation(
-            whatsapp_number, Body, langchain_response, db
-        )
-        logger.info(f"Conversation #{conversation_id} stored in database")
-    except SQLAlchemyError as e:  # pragma: no cover - DB issues are unlikely
-        logger.error(f"Error storing conversation in database: {e}")
-    fb_send_message(whatsapp_number, langchain_response)
+    await _reply_within_budget(whatsapp_number, Body, db)
     return ""
 
 
@@ -100,7 +420,15 @@ async def local_test(
     test_number = "test_user_local"
     logger.info("Local test request received", message=message)
 
-    langchain_response = intake_agent(message)
+    deadline = Deadline.after(TURN_DEADLINE_SECONDS)
+    try:
+        langchain_response = await asyncio.get_running_loop().run_in_executor(
+            None, partial(intake_agent, message, test_number, deadline=deadline)
+        )
+    except DeadlineExceeded:
+        langchain_response = DEADLINE_EXCEEDED_MESSAGE
+    except SchedulerRejected:
+        langchain_response = BUSY_MESSAGE
     try:
         conversation_id = store_conversation(
             test_number, message, langchain_response, db
@@ -112,6 +440,41 @@ async def local_test(
     return {"response": langchain_response}
 
 
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/local_test/stream")
+async def local_test_stream(message: str = Form(...)) -> StreamingResponse:
+    """Streaming variant of ``/local_test`` that emits the reply as Server-Sent Events.
+
+    Each reply piece is sent as a ``token`` event; a final ``done`` event carries
+    the full reply once the conversation has been persisted.
+    """
+    test_number = "test_user_local"
+    logger.info("Local test stream request received", message=message)
+    deadline = Deadline.after(TURN_DEADLINE_SECONDS)
+
+    def events() -> Iterator[str]:
+        pieces = []
+        for piece in _stream_agent(test_number, message, deadline):
+            pieces.append(piece)
+            yield _sse("token", piece)
+        response = "".join(pieces)
+        try:
+            conversation_id = store_conversation(test_number, message, response)
+            logger.info(f"Local test conversation #{conversation_id} stored in database")
+        except SQLAlchemyError as e:
+            logger.error(f"Error storing local test conversation in database: {e}")
+        yield _sse("done", response)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # CLI function for running the chatbot in terminal
 def run_cli_chat():
     """Run a command-line interface for the chatbot."""
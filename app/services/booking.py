@@ -0,0 +1,250 @@
+"""
+Contention-safe appointment booking.
+
+A booking is one statement: it locks the first still-free candidate slot with
+``FOR UPDATE SKIP LOCKED``, flips it to ``busy`` and inserts the appointment,
+all in a single round trip. Concurrent bookers never wait on each other's row
+locks. A slot another transaction is holding is skipped, and a slot it has
+already taken fails the ``status = 'free'`` re-check. Each statement locks at
+most one slot, so bookings cannot deadlock. The ``appointment.slot_id`` unique
+constraint is the last line of defence against double booking.
+
+:func:`book_next_free` picks candidates from the in-memory slot index and
+retries onto alternates when they were taken. Its last attempt searches the
+table itself so a stale index never turns a free slot into a failed booking.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .models.models import SessionLocal
+from .scheduler import slot_index
+from .utils.utils import logger
+
+CANDIDATES_PER_ATTEMPT = config("BOOKING_CANDIDATES", default=5, cast=int)
+MAX_ATTEMPTS = config("BOOKING_MAX_ATTEMPTS", default=3, cast=int)
+
+
+@dataclass(frozen=True)
+class Booking:
+    appointment_id: str
+    slot_id: str
+
+
+# A cancelled appointment keeps its slot_id (UNIQUE), so re-booking the freed
+# slot reuses that row. The slot lock already guarantees exclusivity.
+_CLAIM_AND_BOOK = """
+    WITH candidate AS (
+        SELECT s.slot_id
+        FROM slot s
+        JOIN schedule sc ON sc.schedule_id = s.schedule_id
+        WHERE s.status = 'free' AND sc.is_active AND {match}
+        ORDER BY {order}
+        LIMIT 1
+        FOR UPDATE OF s SKIP LOCKED
+    ), claimed AS (
+        UPDATE slot s
+        SET status = 'busy'
+        FROM candidate c
+        WHERE s.slot_id = c.slot_id
+        RETURNING s.slot_id
+    ), booked AS (
+        INSERT INTO appointment (slot_id, patient_id, reason_code)
+        SELECT slot_id, CAST(:patient_id AS uuid), :reason_code FROM claimed
+        ON CONFLICT (slot_id) DO UPDATE
+        SET patient_id = EXCLUDED.patient_id,
+            reason_code = EXCLUDED.reason_code,
+            status = 'booked',
+            updated_at = now()
+        WHERE appointment.status = 'cancelled'
+        RETURNING appointment_id, slot_id
+    )
+    SELECT c.slot_id::text, b.appointment_id::text
+    FROM claimed c
+    LEFT JOIN booked b ON b.slot_id = c.slot_id
+"""
+
+_BOOK_CANDIDATES_SQL = text(
+    _CLAIM_AND_BOOK.format(
+        match="s.slot_id = ANY(CAST(:slot_ids AS uuid[]))",
+        order="array_position(CAST(:slot_ids AS uuid[]), s.slot_id)",
+    )
+)
+_BOOK_FIRST_FREE_SQL = text(
+    _CLAIM_AND_BOOK.format(
+        match="""s.start_time >= :after
+            AND (CAST(:provider_id AS uuid) IS NULL OR sc.provider_id = CAST(:provider_id AS uuid))
+            AND (CAST(:service_type AS text) IS NULL
+                 OR COALESCE(s.service_type, sc.service_type) = :service_type)""",
+        order="s.start_time",
+    )
+)
+
+_CANCEL_SQL = text(
+    """
+    WITH cancelled AS (
+        UPDATE appointment
+        SET status = 'cancelled', updated_at = now()
+        WHERE appointment_id = CAST(:appointment_id AS uuid) AND status = 'booked'
+        RETURNING slot_id
+    )
+    UPDATE slot s
+    SET status = 'free'
+    FROM cancelled c
+    WHERE s.slot_id = c.slot_id
+    RETURNING s.slot_id::text
+    """
+)
+
+
+def _execute(db: Session | None, statement, params: dict) -> Optional[tuple]:
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+    try:
+        row = db.execute(statement, params).first()
+        if row is not None and row[1] is None:
+            # Slot was free but already had a live appointment: inconsistent
+            # data, so undo the claim rather than leave the slot half-booked.
+            db.rollback()
+            logger.error(f"Slot {row[0]} is free but has an active appointment")
+            return row
+        db.commit()
+        return row
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if created_session:
+            db.close()
+
+
+def book_slot(
+    patient_id: str,
+    slot_ids: Sequence[str],
+    reason_code: Optional[str] = None,
+    db: Session | None = None,
+) -> Optional[Booking]:
+    """Book the first of ``slot_ids`` (in order) that is still free.
+
+    Returns:
+        The booking, or ``None`` if every candidate was taken
+    """
+    if not slot_ids:
+        return None
+    row = _execute(
+        db,
+        _BOOK_CANDIDATES_SQL,
+        {"slot_ids": list(slot_ids), "patient_id": patient_id, "reason_code": reason_code},
+    )
+    return _booked(row, slot_ids)
+
+
+def book_first_free(
+    patient_id: str,
+    after: Optional[datetime] = None,
+    provider_id: Optional[str] = None,
+    service_type: Optional[str] = None,
+    reason_code: Optional[str] = None,
+    db: Session | None = None,
+) -> Optional[Booking]:
+    """Book the earliest free slot matching the filters, searched in the database."""
+    row = _execute(
+        db,
+        _BOOK_FIRST_FREE_SQL,
+        {
+            "after": after or datetime.now(timezone.utc),
+            "provider_id": provider_id,
+            "service_type": service_type,
+            "patient_id": patient_id,
+            "reason_code": reason_code,
+        },
+    )
+    return _booked(row, ())
+
+
+def book_next_free(
+    patient_id: str,
+    preferred: Optional[str] = None,
+    after: Optional[datetime] = None,
+    provider_id: Optional[str] = None,
+    service_type: Optional[str] = None,
+    reason_code: Optional[str] = None,
+    db: Session | None = None,
+) -> Optional[Booking]:
+    """Book ``preferred`` or, if it was taken, the next free alternative.
+
+    Candidates come from the in-memory slot index in batches of
+    ``BOOKING_CANDIDATES``. Taken candidates are dropped from the index before
+    the next attempt, and the final attempt searches the database directly.
+    """
+    for attempt in range(MAX_ATTEMPTS - 1):
+        candidates = [preferred] if preferred and attempt == 0 else []
+        candidates += [
+            slot.slot_id
+            for slot in slot_index.next_free(
+                CANDIDATES_PER_ATTEMPT,
+                after=after,
+                provider_id=provider_id,
+                service_type=service_type,
+            )
+            if slot.slot_id != preferred
+        ]
+        if not candidates:
+            break
+        booking = book_slot(patient_id, candidates, reason_code, db)
+        if booking is not None:
+            return booking
+        metrics.increment("booking_retries")
+    booking = book_first_free(patient_id, after, provider_id, service_type, reason_code, db)
+    if booking is None:
+        metrics.increment("booking_no_slot")
+    return booking
+
+
+def _booked(row: Optional[tuple], candidates: Sequence[str]) -> Optional[Booking]:
+    if row is None or row[1] is None:
+        # Every candidate is taken; keep the index from offering them again
+        for slot_id in candidates:
+            slot_index.remove(slot_id)
+        metrics.increment("booking_conflicts")
+        return None
+    slot_id, appointment_id = row
+    for slot_id_ in candidates:
+        if slot_id_ == slot_id:
+            break
+        slot_index.remove(slot_id_)
+    slot_index.remove(slot_id)
+    metrics.increment("bookings")
+    return Booking(appointment_id=appointment_id, slot_id=slot_id)
+
+
+def cancel_appointment(appointment_id: str, db: Session | None = None) -> Optional[str]:
+    """Cancel a booked appointment and free its slot.
+
+    Returns:
+        The freed slot ID, or ``None`` if the appointment was not booked
+    """
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+    try:
+        row = db.execute(_CANCEL_SQL, {"appointment_id": appointment_id}).first()
+        db.commit()
+        return row[0] if row else None
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if created_session:
+            db.close()
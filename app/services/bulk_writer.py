@@ -0,0 +1,118 @@
+"""
+Buffered bulk inserts for high-volume, loss-tolerant rows.
+
+Rows are appended to an in-memory buffer and written by a background thread in
+one multi-row ``INSERT`` per batch, either when ``flush_size`` rows are waiting
+or ``flush_interval`` seconds after the first buffered row. Request handlers
+only pay for a list append, and the database sees one statement per batch
+instead of one per row.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import TableClause
+
+from . import metrics
+from .utils.utils import logger
+
+
+class BulkWriter:
+    """Batch rows for ``table`` and insert them from a background thread."""
+
+    def __init__(
+        self,
+        table: TableClause,
+        session_factory: Callable[[], Session],
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 50_000,
+    ) -> None:
+        self.table = table
+        self.session_factory = session_factory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Dict[str, Any]] = []
+        self._first_buffered: Optional[float] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._metric = f"bulk_writer.{table.name}"
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Queue one row; never blocks on the database."""
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                # The database is not keeping up; shed load instead of growing.
+                metrics.increment(f"{self._metric}.dropped")
+                return
+            first = not self._buffer
+            if first:
+                self._first_buffered = time.monotonic()
+            self._buffer.append(row)
+            self._ensure_thread()
+            # The first row arms the interval timer of a writer waiting on an
+            # empty buffer; a full batch makes it flush now
+            if first or len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """Write everything buffered now and return the number of rows written."""
+        with self._cond:
+            rows, self._buffer = self._buffer, []
+            self._first_buffered = None
+        if not rows:
+            return 0
+        db = self.session_factory()
+        try:
+            db.execute(insert(self.table), rows)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            metrics.increment(f"{self._metric}.failed", len(rows))
+            logger.error(f"Error bulk inserting into {self.table.name}: {e}")
+            return 0
+        finally:
+            db.close()
+        metrics.increment(f"{self._metric}.rows", len(rows))
+        metrics.increment(f"{self._metric}.batches")
+        return len(rows)
+
+    def close(self) -> None:
+        """Stop the background thread after a final flush."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(
+                target=self._run, name=f"bulk-{self.table.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _due_in(self) -> Optional[float]:
+        if len(self._buffer) >= self.flush_size:
+            return 0.0
+        if self._first_buffered is None:
+            return None
+        return max(0.0, self._first_buffered + self.flush_interval - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                due = self._due_in()
+                while not self._closed and (due is None or due > 0):
+                    self._cond.wait(due)
+                    due = self._due_in()
+                if self._closed:
+                    return
+            self.flush()
@@ -0,0 +1,96 @@
+"""
+Clinic details answered to patients without a model call.
+
+The ``clinic`` table rarely changes, so its rows are cached in memory for
+``CLINIC_INFO_TTL_SECONDS``.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from .models.models import SessionLocal
+
+TTL_SECONDS = config("CLINIC_INFO_TTL_SECONDS", default=300, cast=float)
+
+# address_json keys in the order they are written out
+_ADDRESS_KEYS = (
+    "line",
+    "line1",
+    "line2",
+    "street",
+    "city",
+    "state",
+    "postal_code",
+    "zip",
+    "country",
+)
+
+_CLINICS_SQL = text("SELECT name, address_json FROM clinic ORDER BY created_at, clinic_id")
+
+
+@dataclass(frozen=True)
+class Clinic:
+    name: str
+    address: str
+
+
+def format_address(address: Any) -> str:
+    """One-line address from a FHIR-like ``address_json`` value."""
+    if not address:
+        return ""
+    if isinstance(address, str):
+        return address
+    if isinstance(address, list):
+        return format_address(address[0])
+    if address.get("text"):
+        return address["text"]
+    parts = []
+    for key in _ADDRESS_KEYS:
+        value = address.get(key)
+        if isinstance(value, list):
+            parts.extend(str(v) for v in value if v)
+        elif value:
+            parts.append(str(value))
+    return ", ".join(parts)
+
+
+_lock = threading.Lock()
+_cached: Optional[List[Clinic]] = None
+_loaded_at = 0.0
+
+
+def clinics(db: Session | None = None) -> List[Clinic]:
+    """Every clinic with its address, at most ``CLINIC_INFO_TTL_SECONDS`` old."""
+    global _cached, _loaded_at
+    with _lock:
+        if _cached is not None and time.monotonic() - _loaded_at < TTL_SECONDS:
+            return _cached
+
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        rows = db.execute(_CLINICS_SQL).all()
+    finally:
+        if created_session:
+            db.close()
+    loaded = [Clinic(name, format_address(address)) for name, address in rows]
+    with _lock:
+        _cached, _loaded_at = loaded, time.monotonic()
+    return loaded
+
+
+def invalidate() -> None:
+    """Drop the cached clinics so the next call reads the table again."""
+    global _cached
+    with _lock:
+        _cached = None
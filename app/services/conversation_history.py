@@ -0,0 +1,114 @@
+"""
+Reading a sender's conversation history.
+
+Pages are fetched with keyset pagination on
+``idx_conversations_sender_recent (sender, created_at DESC, id DESC)``. The
+cursor is the ``(created_at, id)`` of the last row on the previous page, so a
+page is one index range scan of ``limit`` rows however deep it is, where an
+``OFFSET`` would read and discard every row before it. The upper bound on
+``created_at`` also lets Postgres skip the monthly partitions newer than the
+cursor.
+"""
+
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .models.models import SessionLocal
+from .phi_vault import reveal
+
+MAX_PAGE_SIZE = 200
+
+
+@dataclass(frozen=True)
+class Turn:
+    id: int
+    created_at: datetime
+    message: str
+    response: Optional[str]
+
+
+_FIRST_PAGE_SQL = text(
+    """
+    SELECT id, created_at, message, response FROM conversations
+    WHERE sender = :sender
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+    """
+)
+
+_NEXT_PAGE_SQL = text(
+    """
+    SELECT id, created_at, message, response FROM conversations
+    WHERE sender = :sender
+      AND created_at <= :created_at
+      AND (created_at, id) < (:created_at, :id)
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+    """
+)
+
+
+def encode_cursor(turn: Turn) -> str:
+    """Opaque cursor pointing just past ``turn``."""
+    raw = f"{turn.created_at.isoformat()}|{turn.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """``(created_at, id)`` of a cursor; ``ValueError`` if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, id_ = raw.split("|")
+        return datetime.fromisoformat(created_at), int(id_)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def conversation_page(
+    sender: str,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    db: Session | None = None,
+) -> Tuple[List[Turn], Optional[str]]:
+    """Newest-first page of ``sender``'s turns and the cursor of the next page.
+
+    The next cursor is ``None`` once the oldest turn has been returned.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    params = {"sender": sender, "limit": limit + 1}
+    if cursor is None:
+        sql = _FIRST_PAGE_SQL
+    else:
+        sql = _NEXT_PAGE_SQL
+        params["created_at"], params["id"] = decode_cursor(cursor)
+
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        turns = [
+            Turn(id_, created_at, *reveal(message, response))
+            for id_, created_at, message, response in db.execute(sql, params).all()
+        ]
+    finally:
+        if created_session:
+            db.close()
+    if len(turns) > limit:
+        turns = turns[:limit]
+        return turns, encode_cursor(turns[-1])
+    return turns, None
+
+
+def recent_turns(sender: str, count: int, db: Session | None = None) -> List[Turn]:
+    """The last ``count`` turns of ``sender`` in chronological order."""
+    if count <= 0:
+        return []
+    turns, _ = conversation_page(sender, limit=count, db=db)
+    return turns[::-1]
@@ -0,0 +1,33 @@
+"""Per-turn deadline budgets propagated from the webhooks into the agent."""
+
+import time
+from dataclasses import dataclass
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a turn runs out of its time budget."""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """Absolute point in (monotonic) time by which a turn must finish."""
+
+    expires_at: float
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        """Return a deadline ``seconds`` from now."""
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self) -> None:
+        """Raise :class:`DeadlineExceeded` if the budget is spent."""
+        if self.expired:
+            raise DeadlineExceeded("Turn deadline exceeded")
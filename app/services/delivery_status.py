@@ -0,0 +1,114 @@
+"""
+Send/delivery/read tracking for outbound WhatsApp messages.
+
+``send_message`` records every message ID it gets back from the Cloud API and
+the webhook records the status callbacks Meta sends for them. Both go through a
+:class:`~app.services.bulk_writer.BulkWriter`, so status traffic (several
+callbacks per reply) costs one insert per batch rather than per row. Joining
+the two tables on ``message_id`` gives send→delivered→read latency histograms.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import column, table, text
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from .bulk_writer import BulkWriter
+from .models.models import SessionLocal
+from .webhook_payload import StatusEvent
+
+_FLUSH_SIZE = config("STATUS_FLUSH_SIZE", default=500, cast=int)
+_FLUSH_INTERVAL = config("STATUS_FLUSH_INTERVAL_SECONDS", default=1.0, cast=float)
+
+outbound_message = table("outbound_message", column("message_id"), column("sent_at"))
+message_status = table(
+    "message_status",
+    column("message_id"),
+    column("status"),
+    column("status_at"),
+)
+
+sent_writer = BulkWriter(outbound_message, SessionLocal, _FLUSH_SIZE, _FLUSH_INTERVAL)
+status_writer = BulkWriter(message_status, SessionLocal, _FLUSH_SIZE, _FLUSH_INTERVAL)
+
+# Upper bucket edges (seconds) of the latency histograms
+DEFAULT_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def record_sent(message_id: str, sent_at: Optional[datetime] = None) -> None:
+    """Buffer the send time of an outbound message."""
+    sent_writer.add({"message_id": message_id, "sent_at": sent_at or datetime.now(timezone.utc)})
+
+
+def record_statuses(statuses: Iterable[StatusEvent]) -> int:
+    """Buffer delivery/read status callbacks and return how many were queued."""
+    count = 0
+    for status in statuses:
+        timestamp = status.get("timestamp")
+        status_at = (
+            datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+            if timestamp
+            else datetime.now(timezone.utc)
+        )
+        status_writer.add(
+            {"message_id": status["id"], "status": status["status"], "status_at": status_at}
+        )
+        count += 1
+    return count
+
+
+def close_writers() -> None:
+    """Flush buffered rows (called on application shutdown)."""
+    sent_writer.close()
+    status_writer.close()
+
+
+_HISTOGRAM_SQL = text(
+    """
+    SELECT s.status,
+           width_bucket(
+               EXTRACT(EPOCH FROM s.status_at - o.sent_at)::float8,
+               CAST(:edges AS float8[])
+           ) AS bucket,
+           count(*) AS messages
+    FROM outbound_message o
+    JOIN LATERAL (
+        SELECT status, min(status_at) AS status_at
+        FROM message_status
+        WHERE message_id = o.message_id AND status IN ('delivered', 'read')
+        GROUP BY status
+    ) s ON true
+    WHERE o.sent_at >= :since
+    GROUP BY s.status, bucket
+    """
+)
+
+
+def latency_histograms(
+    db: Session,
+    since: Optional[datetime] = None,
+    buckets: Iterable[float] = DEFAULT_BUCKETS,
+) -> Dict[str, Dict[str, int]]:
+    """Return send→delivered and send→read latency histograms.
+
+    Args:
+        db: Database session
+        since: Only messages sent after this time (default: the last 24 hours)
+        buckets: Ascending upper bucket edges in seconds
+
+    Returns:
+        ``{"delivered": {"<=1s": n, ..., ">3600s": n}, "read": {...}}``
+    """
+    edges: List[float] = sorted(buckets)
+    labels = [f"<{edges[0]}s"]
+    labels += [f"{low}-{high}s" for low, high in zip(edges, edges[1:])]
+    labels += [f">={edges[-1]}s"]
+    result = {status: {label: 0 for label in labels} for status in ("delivered", "read")}
+    since = since or datetime.now(timezone.utc) - timedelta(days=1)
+    rows = db.execute(_HISTOGRAM_SQL, {"edges": edges, "since": since})
+    for status, bucket, messages in rows:
+        result[status][labels[bucket]] = messages
+    return result
@@ -0,0 +1,321 @@
+"""
+Streaming bulk export of conversations and patients.
+
+Rows are read through a server-side cursor (``yield_per``) in batches of
+``EXPORT_BATCH_SIZE`` and encoded batch by batch as CSV, JSON Lines or
+Parquet, optionally gzip-compressed. The whole export is never held in
+memory. :func:`iter_export` yields the encoded bytes; the HTTP endpoint
+streams them as they come and :func:`export_to_dir` writes them to a file.
+
+Conversations are exported in ``id`` order. An export can start after an
+``id`` high-water mark, and :func:`export_to_dir` keeps that mark in a
+checkpoint file next to the exports, so each nightly run only picks up the
+turns added since the last finished one. Patients are always exported in
+full. Their encrypted ``full_name`` is never exported.
+
+Parquet needs the optional ``pyarrow`` dependency.
+
+Run it by hand with::
+
+    python -m app.services.export conversations --format jsonl --gzip --out exports/
+"""
+
+import argparse
+import csv
+import gzip
+import importlib.util
+import io
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .models.models import SessionLocal
+from .utils.utils import logger
+
+BATCH_SIZE = config("EXPORT_BATCH_SIZE", default=5000, cast=int)
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+_QUERIES = {
+    "conversations": text(
+        """
+        SELECT id, patient_id, sender, message, response, created_at
+        FROM conversations
+        WHERE id > :after_id
+        ORDER BY id
+        """
+    ),
+    # full_name is encrypted PHI and stays in the database
+    "patients": text(
+        """
+        SELECT patient_id, date_of_birth, phone_e164, email, address_json, created_at
+        FROM patient
+        ORDER BY created_at, patient_id
+        """
+    ),
+}
+TABLES = tuple(_QUERIES)
+
+CHECKPOINT_FILE = ".export_checkpoint.json"
+
+
+@dataclass
+class ExportResult:
+    """Filled in while an export streams."""
+
+    rows: int = 0
+    last_id: Optional[int] = None  # highest conversations.id exported
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out whatever was written since the last drain."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def _text(value: Any) -> Any:
+    return str(value) if isinstance(value, UUID) else value
+
+
+class _TextEncoder:
+    """CSV or JSON Lines, one ``encode`` call per batch."""
+
+    def __init__(self, fmt: str, columns: Sequence[str]) -> None:
+        self.fmt = fmt
+        self.columns = list(columns)
+        self.header = fmt == "csv"
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        out = io.StringIO()
+        if self.fmt == "jsonl":
+            for row in rows:
+                out.write(json.dumps(dict(zip(self.columns, map(_plain, row)))))
+                out.write("\n")
+        else:
+            writer = csv.writer(out)
+            if self.header:
+                writer.writerow(self.columns)
+                self.header = False
+            writer.writerows(
+                [json.dumps(v) if isinstance(v, (dict, list)) else _plain(v) for v in row]
+                for row in rows
+            )
+        return out.getvalue().encode()
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _ParquetEncoder:
+    """One Parquet row group per batch."""
+
+    def __init__(self, columns: Sequence[str], compress: bool) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.columns = list(columns)
+        self.compression = "gzip" if compress else "snappy"
+        # Fixed types, so a batch where a column is all NULL still fits the schema
+        types = {
+            "id": pa.int64(),
+            "date_of_birth": pa.date32(),
+            "created_at": pa.timestamp("us", tz="UTC"),
+        }
+        self.schema = pa.schema([(name, types.get(name, pa.string())) for name in self.columns])
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression=self.compression)
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        data = [
+            [json.dumps(v) if isinstance(v, (dict, list)) else _text(v) for v in values]
+            for values in zip(*rows)
+        ]
+        self.writer.write_table(self._pa.table(data, schema=self.schema))
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+def check_export(table: str, fmt: str) -> None:
+    """Raise ``ValueError`` for an export that cannot be produced."""
+    if table not in _QUERIES:
+        raise ValueError(f"Unknown export table: {table}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError("Parquet export requires the optional 'pyarrow' package")
+
+
+def iter_export(
+    table: str,
+    fmt: str = "jsonl",
+    compress: bool = False,
+    after_id: int = 0,
+    result: Optional[ExportResult] = None,
+    db: Session | None = None,
+) -> Iterator[bytes]:
+    """Yield ``table`` encoded as ``fmt``, one chunk per batch of rows.
+
+    ``after_id`` skips conversations up to that ``id``. Progress is recorded in
+    ``result`` as the rows go out.
+    """
+    check_export(table, fmt)
+    result = result if result is not None else ExportResult()
+
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    gzip_sink = gzip_file = None
+    try:
+        rows = db.execute(
+            _QUERIES[table].execution_options(yield_per=BATCH_SIZE), {"after_id": after_id}
+        )
+        columns = list(rows.keys())
+        if fmt == "parquet":
+            encoder = _ParquetEncoder(columns, compress)
+        else:
+            encoder = _TextEncoder(fmt, columns)
+            if compress:
+                gzip_sink = _ChunkSink()
+                gzip_file = gzip.GzipFile(fileobj=gzip_sink, mode="wb")
+
+        def emit(data: bytes) -> bytes:
+            if gzip_file is None:
+                return data
+            gzip_file.write(data)
+            return gzip_sink.drain()
+
+        for batch in rows.partitions(BATCH_SIZE):
+            chunk = emit(encoder.encode(batch))
+            result.rows += len(batch)
+            if table == "conversations":
+                result.last_id = batch[-1][0]
+            if chunk:
+                yield chunk
+        chunk = emit(encoder.close())
+        if gzip_file is not None:
+            gzip_file.close()
+            chunk += gzip_sink.drain()
+        if chunk:
+            yield chunk
+        metrics.increment(f"export_rows.{table}", result.rows)
+    finally:
+        if created_session:
+            db.close()
+
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def file_suffix(fmt: str, compress: bool) -> str:
+    return f".{fmt}.gz" if compress and fmt != "parquet" else f".{fmt}"
+
+
+def _read_checkpoint(directory: Path) -> Dict[str, int]:
+    path = directory / CHECKPOINT_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def _write_checkpoint(directory: Path, checkpoint: Dict[str, int]) -> None:
+    path = directory / CHECKPOINT_FILE
+    partial = path.with_name(path.name + ".partial")
+    partial.write_text(json.dumps(checkpoint))
+    partial.replace(path)
+
+
+def export_to_dir(
+    table: str,
+    directory: Path,
+    fmt: str = "jsonl",
+    compress: bool = False,
+    resume: bool = True,
+) -> Optional[Path]:
+    """Write one export file of ``table`` into ``directory`` and return its path.
+
+    With ``resume`` a conversations export starts after the checkpointed
+    ``id``, and the checkpoint only advances once the file is complete.
+    Returns ``None`` if there was nothing new to export.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    checkpoint = _read_checkpoint(directory) if resume else {}
+    after_id = checkpoint.get(table, 0)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = directory / f"{table}_{stamp}{file_suffix(fmt, compress)}"
+    partial = path.with_name(path.name + ".partial")
+    result = ExportResult()
+    with open(partial, "wb") as out:
+        for chunk in iter_export(table, fmt, compress, after_id, result):
+            out.write(chunk)
+    if not result.rows:
+        partial.unlink()
+        return None
+    partial.replace(path)
+    if table == "conversations" and resume:
+        checkpoint[table] = result.last_id
+        _write_checkpoint(directory, checkpoint)
+    logger.info("export_written", table=table, rows=result.rows, path=str(path))
+    return path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export conversations or patients.")
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--gzip", action="store_true", help="compress the export")
+    parser.add_argument("--out", type=Path, default=Path("exports"))
+    parser.add_argument(
+        "--full", action="store_true", help="ignore the checkpoint and export everything"
+    )
+    args = parser.parse_args(argv)
+    path = export_to_dir(args.table, args.out, args.format, args.gzip, resume=not args.full)
+    print(path or "Nothing new to export")
+
+
+if __name__ == "__main__":
+    main()
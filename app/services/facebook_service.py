@@ -1,16 +1,31 @@
+from typing import Iterable, Iterator, Optional
+
 import requests
 import structlog
 
 from app.config import config
 
+from .delivery_status import record_sent
+
 logger = structlog.get_logger()
 
 ACCESS_TOKEN = config("FB_ACCESS_TOKEN", default="")
 PHONE_NUMBER_ID = config("FB_PHONE_NUMBER_ID", default="")
 
+# WhatsApp rejects text bodies longer than this
+MAX_MESSAGE_CHARS = 4096
+# Streamed replies are flushed as a message once this much text is buffered
+CHUNK_MIN_CHARS = config("FB_CHUNK_MIN_CHARS", default=280, cast=int)
+
+_BREAKS = ("\n\n", "\n", ". ", "? ", "! ")
+
+
+def send_message(to_number: str, body_text: str) -> Optional[str]:
+    """Send a WhatsApp message through Facebook's Cloud API.
 
-def send_message(to_number: str, body_text: str) -> None:
-    """Send a WhatsApp message through Facebook's Cloud API."""
+    Returns:
+        The WhatsApp message ID, or ``None`` if sending failed
+    """
     url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
     headers = {
         "Authorization": f"Bearer {ACCESS_TOKEN}",
@@ -31,5 +46,42 @@ def send_message(to_number: str, body_text: str) -> None:
         if isinstance(data, dict):
             message_id = data.get("messages", [{}])[0].get("id")
         logger.info("fb_message_sent", to=masked_to, message_id=message_id)
+        if message_id:
+            record_sent(message_id)
+        return message_id
     except Exception as exc:  # pragma: no cover - network failures are not tested
         logger.error("fb_send_failed", to=masked_to, error=str(exc))
+        return None
+
+
+def _break_point(text: str, min_chars: int, max_chars: int) -> Optional[int]:
+    """Return where to split ``text`` into a message, or ``None`` to keep buffering."""
+    window = text[:max_chars]
+    for separator in _BREAKS:
+        index = window.rfind(separator, min_chars)
+        if index != -1:
+            return index + len(separator)
+    if len(text) <= max_chars:
+        return None
+    space = window.rfind(" ", min_chars)
+    return space + 1 if space != -1 else max_chars
+
+
+def chunk_reply(
+    pieces: Iterable[str],
+    min_chars: int = CHUNK_MIN_CHARS,
+    max_chars: int = MAX_MESSAGE_CHARS,
+) -> Iterator[str]:
+    """Group streamed text into WhatsApp-sized messages split at natural breaks."""
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) > min_chars:
+            cut = _break_point(buffer, min_chars, max_chars)
+            if cut is None:
+                break
+            message, buffer = buffer[:cut].strip(), buffer[cut:]
+            if message:
+                yield message
+    if buffer.strip():
+        yield buffer.strip()
@@ -0,0 +1,339 @@
+"""
+Local FAQ retrieval: clinic questions answered without an LLM call.
+
+Entries come from the ``clinic_faq`` table and are generated from the
+``clinic``, ``provider`` and ``schedule`` tables (address, opening hours,
+providers), in English and Spanish. Each language has its own in-memory BM25
+index over the entries' questions and answers.
+
+A message is looked up only if it reads as a question (a question mark or a
+leading interrogative), so intake answers such as "I don't have insurance"
+keep going to the model. The best entry is used only when it covers at least
+``FAQ_MIN_CONFIDENCE`` of the query's IDF weight. Query words the index has
+never seen count against it. Everything else falls through.
+
+The index is rebuilt lazily. At most every ``FAQ_REFRESH_SECONDS`` one query
+fingerprints the source tables, and the entries are reloaded only if the
+fingerprint changed. Lookups report ``faq_lookups``, ``faq_hits``, the
+``faq_hit_rate`` gauge and the ``faq_lookup_seconds`` histogram.
+"""
+
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.agents.red_flags import normalize
+from app.config import config
+
+from . import metrics
+from .clinic_info import format_address
+from .models.models import SessionLocal
+from .utils.utils import logger
+
+MIN_CONFIDENCE = config("FAQ_MIN_CONFIDENCE", default=0.6, cast=float)
+REFRESH_SECONDS = config("FAQ_REFRESH_SECONDS", default=60, cast=float)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+LANGUAGES = ("en", "es")
+
+STOPWORDS = {
+    "en": frozenset(
+        "a an the is are am was be do does did can could i you we my your our me "
+        "to of in on at for with and or it this that there any have has please "
+        "what where when how which who".split()
+    ),
+    "es": frozenset(
+        "el la los las un una unos unas es son esta estan ser de del a al en con "
+        "por para y o que mi mis su sus tu tus yo usted ustedes me se le lo hay "
+        "tiene tienen favor donde cuando como cual cuales quien".split()
+    ),
+}
+_INTERROGATIVES = frozenset(
+    "what where when how which who do does is are can could will "
+    "que donde cuando como cual cuales quien hay aceptan tienen puedo".split()
+)
+
+_FINGERPRINT_SQL = text(
+    """
+    SELECT md5(concat_ws('|',
+        (SELECT string_agg(clinic_id::text || name || address_json::text, ','
+                           ORDER BY clinic_id) FROM clinic),
+        (SELECT string_agg(provider_id::text || display_name || coalesce(specialty, ''), ','
+                           ORDER BY provider_id) FROM provider),
+        (SELECT count(*) || max(updated_at)::text FROM schedule),
+        (SELECT count(*) || max(updated_at)::text FROM clinic_faq)))
+    """
+)
+_FAQ_SQL = text("SELECT language, question, answer FROM clinic_faq ORDER BY created_at")
+_CLINIC_SQL = text("SELECT clinic_id, name, address_json FROM clinic ORDER BY created_at")
+_PROVIDER_SQL = text(
+    "SELECT clinic_id, display_name, specialty FROM provider ORDER BY display_name"
+)
+_HOURS_SQL = text(
+    """
+    SELECT DISTINCT p.clinic_id, s.working_days, s.day_start, s.day_end, s.time_zone
+    FROM schedule s JOIN provider p ON p.provider_id = s.provider_id
+    WHERE s.is_active AND s.period_end > now()
+    ORDER BY 1, 3
+    """
+)
+
+_DAY_NAMES = {
+    "en": ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"),
+    "es": ("lun", "mar", "mié", "jue", "vie", "sáb", "dom"),
+}
+
+# (question, answer) templates per language for entries built from the tables
+_TEMPLATES = {
+    "en": {
+        "address": (
+            "Where is the clinic located? What is the clinic address? Directions",
+            "{name} is at {address}.",
+        ),
+        "hours": (
+            "What are the clinic hours? When are you open? Opening hours schedule",
+            "{name} is open {hours}.",
+        ),
+        "providers": (
+            "Which doctors work at the clinic? Who are the providers and specialists?",
+            "Our providers at {name}: {providers}.",
+        ),
+    },
+    "es": {
+        "address": (
+            "¿Dónde está la clínica? ¿Cuál es la dirección de la clínica? Ubicación",
+            "{name} está en {address}.",
+        ),
+        "hours": (
+            "¿Cuál es el horario de la clínica? ¿A qué hora abren? Horario de atención",
+            "{name} atiende {hours}.",
+        ),
+        "providers": (
+            "¿Qué doctores trabajan en la clínica? ¿Quiénes son los médicos y "
+            "especialistas?",
+            "Nuestros médicos en {name}: {providers}.",
+        ),
+    },
+}
+
+
+@dataclass(frozen=True)
+class FaqEntry:
+    language: str
+    question: str
+    answer: str
+
+
+@dataclass(frozen=True)
+class FaqMatch:
+    entry: FaqEntry
+    score: float
+    confidence: float
+
+
+def _terms(text_: str, language: str) -> List[str]:
+    """Content words of ``text_``, folded and crudely singularized."""
+    stop = STOPWORDS[language]
+    terms = []
+    for word in normalize(text_):
+        if not word.isalnum() or word in stop:
+            continue
+        if len(word) > 4 and word.endswith("es") and language == "es":
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def detect_language(text_: str) -> str:
+    """``"es"`` if the message has more Spanish than English function words."""
+    words = normalize(text_)
+    if any(mark in text_ for mark in "¿¡"):
+        return "es"
+    scores = {lang: sum(word in STOPWORDS[lang] for word in words) for lang in LANGUAGES}
+    return "es" if scores["es"] > scores["en"] else "en"
+
+
+def looks_like_question(text_: str) -> bool:
+    words = normalize(text_)
+    return "?" in text_ or bool(words and words[0] in _INTERROGATIVES)
+
+
+class Bm25Index:
+    """Okapi BM25 over the entries of one language."""
+
+    def __init__(self, entries: Sequence[FaqEntry], language: str) -> None:
+        self.language = language
+        self.entries = list(entries)
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        for doc, entry in enumerate(self.entries):
+            counts = Counter(_terms(f"{entry.question} {entry.answer}", language))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings[term].append((doc, tf))
+        count = len(self.entries)
+        self._average = sum(self._lengths) / count if count else 0.0
+        self._idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self._postings.items()
+        }
+        # A word no entry contains weighs as much as the rarest indexed word
+        self._unknown_idf = math.log(1 + (count + 0.5) / 0.5)
+
+    def search(self, query: str) -> Optional[FaqMatch]:
+        """Best entry for ``query`` with its BM25 score and confidence."""
+        terms = set(_terms(query, self.language))
+        if not terms or not self.entries:
+            return None
+        scores: Dict[int, float] = defaultdict(float)
+        matched: Dict[int, float] = defaultdict(float)
+        for term in terms:
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for doc, tf in self._postings[term]:
+                norm = K1 * (1 - B + B * self._lengths[doc] / self._average)
+                scores[doc] += idf * tf * (K1 + 1) / (tf + norm)
+                matched[doc] += idf
+        if not scores:
+            return None
+        best = max(scores, key=scores.__getitem__)
+        total = sum(self._idf.get(term, self._unknown_idf) for term in terms)
+        return FaqMatch(self.entries[best], scores[best], matched[best] / total)
+
+
+def _weekdays(days: Iterable[int], language: str) -> str:
+    """``[1, 2, 3, 4, 5]`` -> ``"Mon–Fri"``; ISO weekdays."""
+    names = _DAY_NAMES[language]
+    days = sorted(set(days))
+    runs: List[List[int]] = []
+    for day in days:
+        if runs and day == runs[-1][-1] + 1:
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return ", ".join(
+        names[run[0] - 1] if len(run) == 1 else f"{names[run[0] - 1]}–{names[run[-1] - 1]}"
+        for run in runs
+    )
+
+
+def load_entries(db: Session) -> List[FaqEntry]:
+    """FAQ rows plus the entries generated from the clinic tables."""
+    entries = [FaqEntry(*row) for row in db.execute(_FAQ_SQL).all()]
+    providers: Dict[object, List[str]] = defaultdict(list)
+    for clinic_id, display_name, specialty in db.execute(_PROVIDER_SQL).all():
+        providers[clinic_id].append(f"{display_name} ({specialty})" if specialty else display_name)
+    hours: Dict[object, List[tuple]] = defaultdict(list)
+    for clinic_id, *row in db.execute(_HOURS_SQL).all():
+        hours[clinic_id].append(tuple(row))
+
+    for clinic_id, name, address_json in db.execute(_CLINIC_SQL).all():
+        for language in LANGUAGES:
+            templates = _TEMPLATES[language]
+            facts = {
+                "address": format_address(address_json),
+                "hours": "; ".join(
+                    f"{_weekdays(days, language)} {start:%H:%M}–{end:%H:%M} ({zone})"
+                    for days, start, end, zone in hours[clinic_id]
+                ),
+                "providers": ", ".join(providers[clinic_id]),
+            }
+            for topic, value in facts.items():
+                if value:
+                    question, answer = templates[topic]
+                    entries.append(
+                        FaqEntry(language, question, answer.format(name=name, **{topic: value}))
+                    )
+    return entries
+
+
+class FaqIndex:
+    """Per-language BM25 indexes that follow the clinic tables."""
+
+    def __init__(
+        self,
+        min_confidence: float = MIN_CONFIDENCE,
+        refresh_seconds: float = REFRESH_SECONDS,
+    ) -> None:
+        self.min_confidence = min_confidence
+        self.refresh_seconds = refresh_seconds
+        self._indexes: Dict[str, Bm25Index] = {}
+        self._fingerprint: Optional[str] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def build(self, entries: Sequence[FaqEntry]) -> None:
+        by_language: Dict[str, List[FaqEntry]] = defaultdict(list)
+        for entry in entries:
+            by_language[entry.language].append(entry)
+        indexes = {lang: Bm25Index(by_language[lang], lang) for lang in LANGUAGES}
+        with self._lock:
+            self._indexes = indexes
+
+    def refresh(self, db: Session | None = None) -> bool:
+        """Rebuild if the source tables changed; return whether it did."""
+        created_session = False
+        if db is None:
+            db = SessionLocal()
+            created_session = True
+
+        try:
+            fingerprint = db.execute(_FINGERPRINT_SQL).scalar()
+            self._checked_at = time.monotonic()
+            if fingerprint == self._fingerprint:
+                return False
+            self.build(load_entries(db))
+            self._fingerprint = fingerprint
+            metrics.increment("faq_index_rebuilds")
+            return True
+        finally:
+            if created_session:
+                db.close()
+
+    def _maybe_refresh(self) -> None:
+        if time.monotonic() - self._checked_at < self.refresh_seconds:
+            return
+        with self._lock:
+            # Only one thread checks; the others keep using the current index
+            if time.monotonic() - self._checked_at < self.refresh_seconds:
+                return
+            self._checked_at = time.monotonic()
+        try:
+            self.refresh()
+        except SQLAlchemyError as e:
+            logger.error(f"Error refreshing the FAQ index: {e}")
+
+    def lookup(self, query: str) -> Optional[FaqMatch]:
+        """Confident match for a patient question, or ``None`` to fall through."""
+        if not looks_like_question(query):
+            return None
+        self._maybe_refresh()
+        started = time.perf_counter()
+        index = self._indexes.get(detect_language(query))
+        match = index.search(query) if index is not None else None
+        if match is not None and match.confidence < self.min_confidence:
+            match = None
+        metrics.observe("faq_lookup_seconds", time.perf_counter() - started)
+        metrics.increment("faq_lookups")
+        if match is not None:
+            metrics.increment("faq_hits")
+        metrics.set_gauge(
+            "faq_hit_rate", metrics.counter("faq_hits") / metrics.counter("faq_lookups")
+        )
+        return match
+
+
+faq_index = FaqIndex()
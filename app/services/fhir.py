@@ -0,0 +1,244 @@
+"""
+FHIR R4 resources for patients, appointments and completed intakes.
+
+A completed intake becomes a ``QuestionnaireResponse`` whose items mirror the
+``PatientHistory`` schema. Nested models become groups, list fields become
+repeated answers, and each answer type comes from the field's annotation. The
+field walk happens once: :func:`compile_items` turns the schema into a list of
+small item builders, and every response is then serialized by running them
+over its answers without touching Pydantic again.
+
+These functions are pure (no database access) so they can run in worker
+processes; see :mod:`app.services.fhir_export`.
+"""
+
+import json
+import types
+import typing
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from app.agents.schemas.patient_form_EN import PatientHistory
+from app.config import config
+
+QUESTIONNAIRE_URL = config(
+    "FHIR_QUESTIONNAIRE_URL", default="urn:medbot:questionnaire:patient-history"
+)
+
+# PatientHistory fields kept on the patient row instead of the intake answers
+IDENTITY_FIELDS = {"name", "signature"}
+
+# appointment.status -> FHIR Appointment.status
+APPOINTMENT_STATUS = {
+    "booked": "booked",
+    "checked_in": "checked-in",
+    "fulfilled": "fulfilled",
+    "no_show": "noshow",
+    "cancelled": "cancelled",
+}
+
+ItemBuilder = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def _unwrap(annotation: Any) -> Tuple[Any, bool]:
+    """``(inner type, is_list)`` of an annotation, with ``Optional`` removed."""
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, types.UnionType):
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        return _unwrap(args[0]) if len(args) == 1 else (str, False)
+    if origin in (list, List):
+        inner, _ = _unwrap(typing.get_args(annotation)[0])
+        return inner, True
+    return annotation, False
+
+
+def _value_key(kind: Any) -> str:
+    if kind is bool:
+        return "valueBoolean"
+    if kind is int:
+        return "valueInteger"
+    if kind is float:
+        return "valueDecimal"
+    if kind is date:
+        return "valueDate"
+    if kind is datetime:
+        return "valueDateTime"
+    return "valueString"
+
+
+def _leaf(link_id: str, text: str, key: str, name: str, many: bool) -> ItemBuilder:
+    def build(answers: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        value = answers.get(name)
+        if value is None or value == "" or value == []:
+            return None
+        values = value if many else [value]
+        return {
+            "linkId": link_id,
+            "text": text,
+            "answer": [{key: v} for v in values],
+        }
+
+    return build
+
+
+def _flatten(items: List[Any]) -> List[Dict[str, Any]]:
+    flat = []
+    for item in items:
+        if isinstance(item, list):
+            flat.extend(item)
+        elif item is not None:
+            flat.append(item)
+    return flat
+
+
+def _group(
+    link_id: str, text: str, name: str, many: bool, children: List[ItemBuilder]
+) -> ItemBuilder:
+    def build_one(value: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        items = _flatten([child(value) for child in children])
+        return {"linkId": link_id, "text": text, "item": items} if items else None
+
+    def build(answers: Dict[str, Any]) -> Any:
+        value = answers.get(name)
+        if not value:
+            return None
+        if not many:
+            return build_one(value)
+        return _flatten([build_one(v) for v in value]) or None
+
+    return build
+
+
+def _compile(
+    model: Type[BaseModel], prefix: str = "", skip: frozenset = frozenset()
+) -> List[ItemBuilder]:
+    builders: List[ItemBuilder] = []
+    for name, field in model.model_fields.items():
+        if name in skip:
+            continue
+        link_id = f"{prefix}{name}"
+        text = field.description or name.replace("_", " ").capitalize()
+        kind, many = _unwrap(field.annotation)
+        if isinstance(kind, type) and issubclass(kind, BaseModel):
+            children = _compile(kind, f"{link_id}.")
+            builders.append(_group(link_id, text, name, many, children))
+        else:
+            builders.append(_leaf(link_id, text, _value_key(kind), name, many))
+    return builders
+
+
+@lru_cache(maxsize=None)
+def compile_items(model: Type[BaseModel] = PatientHistory) -> Tuple[ItemBuilder, ...]:
+    """Item builders for ``model``, one per top-level field (identity fields excluded)."""
+    return tuple(_compile(model, skip=frozenset(IDENTITY_FIELDS)))
+
+
+def _iso(value: Any) -> Optional[str]:
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _address(value: Any) -> Optional[List[Dict[str, Any]]]:
+    if not value:
+        return None
+    if isinstance(value, str):
+        return [{"text": value}]
+    return [value]
+
+
+def patient_resource(
+    patient_id: Any,
+    date_of_birth: Optional[date],
+    phone_e164: Optional[str],
+    email: Optional[str],
+    address_json: Any,
+) -> Dict[str, Any]:
+    """FHIR ``Patient``; the encrypted name is not exported."""
+    resource: Dict[str, Any] = {"resourceType": "Patient", "id": str(patient_id)}
+    telecom = []
+    if phone_e164:
+        telecom.append({"system": "phone", "value": phone_e164, "use": "mobile"})
+    if email:
+        telecom.append({"system": "email", "value": email})
+    if telecom:
+        resource["telecom"] = telecom
+    if date_of_birth:
+        resource["birthDate"] = _iso(date_of_birth)
+    address = _address(address_json)
+    if address:
+        resource["address"] = address
+    return resource
+
+
+def appointment_resource(
+    appointment_id: Any,
+    status: str,
+    reason_code: Optional[str],
+    patient_id: Any,
+    slot_id: Any,
+    provider_id: Any,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    created_at: Optional[datetime],
+) -> Dict[str, Any]:
+    """FHIR ``Appointment`` for an appointment row joined with its slot."""
+    participant = []
+    if patient_id:
+        participant.append(
+            {"actor": {"reference": f"Patient/{patient_id}"}, "status": "accepted"}
+        )
+    if provider_id:
+        participant.append(
+            {"actor": {"reference": f"Practitioner/{provider_id}"}, "status": "accepted"}
+        )
+    resource: Dict[str, Any] = {
+        "resourceType": "Appointment",
+        "id": str(appointment_id),
+        "status": APPOINTMENT_STATUS.get(status, "entered-in-error"),
+        "participant": participant,
+    }
+    if reason_code:
+        resource["reasonCode"] = [{"text": reason_code}]
+    if slot_id:
+        resource["slot"] = [{"reference": f"Slot/{slot_id}"}]
+    if start_time and end_time:
+        resource["start"] = _iso(start_time)
+        resource["end"] = _iso(end_time)
+    if created_at:
+        resource["created"] = _iso(created_at)
+    return resource
+
+
+def questionnaire_response(
+    intake_id: Any,
+    patient_id: Any,
+    answers: Dict[str, Any] | str,
+    completed_at: Optional[datetime],
+) -> Dict[str, Any]:
+    """FHIR ``QuestionnaireResponse`` for a completed ``PatientHistory`` intake.
+
+    ``answers`` may also be given as JSON text.
+    """
+    if isinstance(answers, str):
+        answers = json.loads(answers)
+    resource: Dict[str, Any] = {
+        "resourceType": "QuestionnaireResponse",
+        "id": str(intake_id),
+        "questionnaire": QUESTIONNAIRE_URL,
+        "status": "completed",
+    }
+    if patient_id:
+        resource["subject"] = {"reference": f"Patient/{patient_id}"}
+    if completed_at:
+        resource["authored"] = _iso(completed_at)
+    resource["item"] = _flatten([build(answers) for build in compile_items()])
+    return resource
+
+
+RESOURCES = {
+    "Patient": patient_resource,
+    "Appointment": appointment_resource,
+    "QuestionnaireResponse": questionnaire_response,
+}
@@ -0,0 +1,133 @@
+"""
+FHIR R4 bulk-data export (NDJSON) of patients, appointments and intakes.
+
+Each resource type is written to ``<out>/<ResourceType>.ndjson``, one resource
+per line, as in the FHIR Bulk Data Access specification. The parent process
+streams rows from a server-side cursor in batches of ``FHIR_EXPORT_BATCH_SIZE``
+and hands each batch to a process pool. The workers build the resources with
+:mod:`app.services.fhir` and return the encoded NDJSON, which is written in
+order. At most ``2 * FHIR_EXPORT_WORKERS`` batches are in flight, so memory
+stays bounded however many rows there are.
+
+Run it by hand with::
+
+    python -m app.services.fhir_export --out fhir/
+"""
+
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+
+from app.config import config
+
+from . import metrics
+from .fhir import RESOURCES
+from .models.models import SessionLocal
+from .utils.utils import logger
+
+WORKERS = config("FHIR_EXPORT_WORKERS", default=os.cpu_count() or 1, cast=int)
+BATCH_SIZE = config("FHIR_EXPORT_BATCH_SIZE", default=2000, cast=int)
+
+_QUERIES = {
+    "Patient": text(
+        """
+        SELECT patient_id, date_of_birth, phone_e164, email, address_json
+        FROM patient
+        """
+    ),
+    "Appointment": text(
+        """
+        SELECT a.appointment_id, a.status, a.reason_code, a.patient_id, a.slot_id,
+               sc.provider_id, s.start_time, s.end_time, a.created_at
+        FROM appointment a
+        LEFT JOIN slot s ON s.slot_id = a.slot_id
+        LEFT JOIN schedule sc ON sc.schedule_id = s.schedule_id
+        """
+    ),
+    # answers stay JSON text so the workers, not the parent, parse them
+    "QuestionnaireResponse": text(
+        """
+        SELECT intake_id, patient_id, answers::text, completed_at
+        FROM intake_response
+        """
+    ),
+}
+
+
+def serialize_batch(resource_type: str, rows: List[Sequence[Any]]) -> bytes:
+    """NDJSON for one batch of rows; runs in a worker process."""
+    build = RESOURCES[resource_type]
+    lines = [json.dumps(build(*row), separators=(",", ":")) for row in rows]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def export_resource(
+    resource_type: str, path: Path, pool: Executor, max_in_flight: int
+) -> int:
+    """Write every ``resource_type`` row to ``path``; return the number written."""
+    db = SessionLocal()
+    count = 0
+    pending: Deque[Future] = deque()
+    partial = path.with_name(path.name + ".partial")
+    try:
+        result = db.execute(
+            _QUERIES[resource_type].execution_options(yield_per=BATCH_SIZE)
+        )
+        with open(partial, "wb") as out:
+            for batch in result.partitions(BATCH_SIZE):
+                # Plain tuples pickle much faster than Row objects
+                rows = [tuple(row) for row in batch]
+                pending.append(pool.submit(serialize_batch, resource_type, rows))
+                count += len(batch)
+                if len(pending) >= max_in_flight:
+                    out.write(pending.popleft().result())
+            while pending:
+                out.write(pending.popleft().result())
+    finally:
+        for future in pending:
+            future.cancel()
+        db.close()
+    partial.replace(path)
+    metrics.increment(f"fhir_export.{resource_type}", count)
+    return count
+
+
+def export_bulk(
+    out_dir: Path,
+    resource_types: Optional[Sequence[str]] = None,
+    workers: int = WORKERS,
+) -> Dict[str, int]:
+    """Export the given resource types (default: all) and return counts per type."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for resource_type in resource_types or RESOURCES:
+            path = out_dir / f"{resource_type}.ndjson"
+            counts[resource_type] = export_resource(resource_type, path, pool, 2 * workers)
+            logger.info(
+                "fhir_export_written",
+                resource_type=resource_type,
+                count=counts[resource_type],
+                path=str(path),
+            )
+    return counts
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export FHIR R4 bulk-data NDJSON files.")
+    parser.add_argument("--out", type=Path, default=Path("fhir_export"))
+    parser.add_argument("--type", action="append", choices=list(RESOURCES), dest="types")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args(argv)
+    for resource_type, count in export_bulk(args.out, args.types, args.workers).items():
+        print(f"{resource_type}: {count}")
+
+
+if __name__ == "__main__":
+    main()
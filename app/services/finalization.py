@@ -0,0 +1,302 @@
+"""
+Background finalization of completed intakes.
+
+Once an intake validates, the patient is answered straight away and
+:meth:`FinalizationPipeline.submit` takes over. Two stages run concurrently
+on a small thread pool:
+
+``persist``
+    :func:`~app.services.secure_storage.finalize_intake` (patient upsert,
+    conversation backfill, intake answers).
+``pdf``
+    the filled intake form, written to ``intake_<intake_id>.pdf``.
+
+The job is journaled to ``FINALIZATION_SPOOL_DIR`` before any stage runs, and
+the journal is rewritten whenever a stage changes state. It is removed once
+every stage is done. The journal never holds the intake itself: with
+``PHI_VAULT`` on, the intake is put in the encrypted PHI vault under the
+intake ID and the journal keeps that reference; without the vault it stays in
+memory only, so a job interrupted by a crash cannot be resumed.
+
+A failed stage is retried with exponential backoff, up to
+``FINALIZATION_MAX_ATTEMPTS`` times. Jobs still in the spool when the app
+starts are resumed by :meth:`FinalizationPipeline.recover`. Both stages are
+idempotent (the intake ID is fixed when the job is created and the PDF is
+replaced atomically), so a stage can be rerun after a crash without asking
+the patient again.
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from app.agents.schemas.patient_form_EN import PatientHistory
+from app.agents.tools_agent.pdf_filler_EN import fill_pdf
+from app.config import config
+
+from . import metrics
+from .phi_vault import PHI_VAULT, PhiVault, get_vault
+from .secure_storage import finalize_intake
+from .utils.utils import logger
+
+_DATA_DIR = Path(__file__).resolve().parent / "database"
+
+WORKERS = config("FINALIZATION_WORKERS", default=4, cast=int)
+MAX_ATTEMPTS = config("FINALIZATION_MAX_ATTEMPTS", default=5, cast=int)
+RETRY_SECONDS = config("FINALIZATION_RETRY_SECONDS", default=5.0, cast=float)
+SPOOL_DIR = Path(config("FINALIZATION_SPOOL_DIR", default=str(_DATA_DIR / "finalization")))
+PDF_DIR = Path(config("INTAKE_PDF_DIR", default=str(_DATA_DIR / "data")))
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+STAGES = ("persist", "pdf")
+# Completed jobs remembered for status lookups
+RECENT_JOBS = 1000
+
+
+@dataclass
+class StageStatus:
+    state: str = PENDING
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class FinalizationJob:
+    intake_id: str
+    sender: str
+    history: Optional[dict]
+    # Vault reference of the history; the journal on disk carries only this
+    history_ref: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    stages: Dict[str, StageStatus] = field(
+        default_factory=lambda: {name: StageStatus() for name in STAGES}
+    )
+
+    @property
+    def done(self) -> bool:
+        return all(stage.state == DONE for stage in self.stages.values())
+
+    @property
+    def pdf_path(self) -> Path:
+        return PDF_DIR / f"intake_{self.intake_id}.pdf"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FinalizationJob":
+        stages = {name: StageStatus(**status) for name, status in data.pop("stages").items()}
+        return cls(stages=stages, **data)
+
+
+def _persist(job: FinalizationJob) -> None:
+    history = PatientHistory.model_validate(job.history)
+    finalize_intake(job.sender, history, intake_id=job.intake_id)
+
+
+def _render_pdf(job: FinalizationJob) -> None:
+    path = job.pdf_path
+    partial = path.with_name(path.name + ".partial")
+    fill_pdf(PatientHistory.model_validate(job.history), output_path=partial)
+    partial.replace(path)
+
+
+class FinalizationPipeline:
+    """Runs the finalization stages of completed intakes in the background."""
+
+    def __init__(
+        self,
+        spool_dir: Path = SPOOL_DIR,
+        stages: Optional[Dict[str, Callable[[FinalizationJob], None]]] = None,
+        workers: int = WORKERS,
+        max_attempts: int = MAX_ATTEMPTS,
+        retry_seconds: float = RETRY_SECONDS,
+        vault: Optional[Callable[[], PhiVault]] = get_vault if PHI_VAULT else None,
+    ) -> None:
+        self.spool_dir = spool_dir
+        self.vault = vault
+        self.stages = stages or {"persist": _persist, "pdf": _render_pdf}
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._jobs: "OrderedDict[str, FinalizationJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._timers: Dict[tuple, threading.Timer] = {}
+
+    def submit(self, sender: str, history: PatientHistory) -> FinalizationJob:
+        """Journal a validated intake and start its stages; return the job."""
+        job = FinalizationJob(
+            intake_id=str(uuid.uuid4()),
+            sender=sender,
+            history=history.model_dump(mode="json"),
+            stages={name: StageStatus() for name in self.stages},
+        )
+        if self.vault is not None:
+            try:
+                job.history_ref = self.vault().put(job.history, ref=job.intake_id)
+            except Exception as e:  # finalize anyway, just not crash-safe
+                logger.error(f"Error storing intake {job.intake_id} in the PHI vault: {e}")
+        with self._lock:
+            self._jobs[job.intake_id] = job
+            self._save(job)
+        metrics.increment("finalization_jobs")
+        for name in self.stages:
+            self._schedule(job, name)
+        return job
+
+    def status(self, intake_id: str) -> Optional[FinalizationJob]:
+        with self._lock:
+            return self._jobs.get(intake_id)
+
+    def latest(self, sender: str) -> Optional[FinalizationJob]:
+        """The most recent job of ``sender`` still known to this process."""
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.sender == sender:
+                    return job
+        return None
+
+    def recover(self) -> int:
+        """Resume the unfinished jobs found in the spool; return how many."""
+        if not self.spool_dir.exists():
+            return 0
+        resumed = 0
+        for path in sorted(self.spool_dir.glob("*.json")):
+            try:
+                job = FinalizationJob.from_dict(json.loads(path.read_text()))
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Unreadable finalization journal {path.name}: {e}")
+                continue
+            job.history = self._load_history(job)
+            if job.history is None:
+                continue
+            with self._lock:
+                if job.intake_id in self._jobs:
+                    continue
+                self._jobs[job.intake_id] = job
+            for name, stage in job.stages.items():
+                if stage.state != DONE:
+                    # Give jobs that had run out of attempts another round
+                    stage.state, stage.attempts = PENDING, 0
+                    self._schedule(job, name)
+            resumed += 1
+        if resumed:
+            logger.info("finalization_jobs_recovered", jobs=resumed)
+        return resumed
+
+    def retry(self, intake_id: str) -> bool:
+        """Rerun the failed stages of a job; ``False`` if there is nothing to retry."""
+        job = self.status(intake_id)
+        if job is None:
+            return False
+        failed = [name for name, stage in job.stages.items() if stage.state == FAILED]
+        for name in failed:
+            with self._lock:
+                job.stages[name] = StageStatus()
+                self._save(job)
+            self._schedule(job, name)
+        return bool(failed)
+
+    def close(self) -> None:
+        """Stop scheduling retries and wait for running stages."""
+        with self._lock:
+            timers, self._timers = list(self._timers.values()), {}
+            executor, self._executor = self._executor, None
+        for timer in timers:
+            timer.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _schedule(self, job: FinalizationJob, name: str, delay: float = 0.0) -> None:
+        if delay > 0:
+            timer = threading.Timer(delay, self._schedule, args=(job, name))
+            timer.daemon = True
+            with self._lock:
+                self._timers[(job.intake_id, name)] = timer
+            timer.start()
+            return
+        with self._lock:
+            self._timers.pop((job.intake_id, name), None)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="finalize"
+                )
+            self._executor.submit(self._run_stage, job, name)
+
+    def _run_stage(self, job: FinalizationJob, name: str) -> None:
+        with self._lock:
+            stage = job.stages[name]
+            if stage.state in (RUNNING, DONE):
+                return
+            stage.state = RUNNING
+            stage.attempts += 1
+        started = time.perf_counter()
+        try:
+            self.stages[name](job)
+        except Exception as e:  # any failure is retried
+            with self._lock:
+                retry = stage.attempts < self.max_attempts
+                stage.state = PENDING if retry else FAILED
+                stage.error = str(e)
+                self._save(job)
+            metrics.increment(f"finalization_stage_failures.{name}")
+            logger.error(
+                f"Finalization stage {name} failed for intake {job.intake_id} "
+                f"(attempt {stage.attempts}): {e}"
+            )
+            if retry:
+                self._schedule(job, name, self.retry_seconds * 2 ** (stage.attempts - 1))
+            return
+        metrics.observe(f"finalization_stage_seconds.{name}", time.perf_counter() - started)
+        with self._lock:
+            stage.state, stage.error = DONE, None
+            finished = job.done
+            if finished:
+                self._forget(job)
+                metrics.observe("finalization_seconds", time.time() - job.created_at)
+            else:
+                self._save(job)
+        if finished and job.history_ref is not None and self.vault is not None:
+            try:
+                self.vault().delete(job.history_ref)
+            except Exception as e:
+                logger.error(f"Error deleting intake {job.intake_id} from the PHI vault: {e}")
+
+    def _load_history(self, job: FinalizationJob) -> Optional[Dict[str, Any]]:
+        """The intake of a journaled job, read back from the vault."""
+        if job.history_ref is None or self.vault is None:
+            logger.error(f"Intake {job.intake_id} was not stored and cannot be resumed")
+            return None
+        try:
+            history = self.vault().get(job.history_ref)
+        except Exception as e:
+            logger.error(f"Error reading intake {job.intake_id} from the PHI vault: {e}")
+            return None
+        if history is None:
+            logger.error(f"Intake {job.intake_id} is missing from the PHI vault")
+        return history
+
+    # The helpers below are called with self._lock held
+
+    def _save(self, job: FinalizationJob) -> None:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"{job.intake_id}.json"
+        partial = path.with_name(path.name + ".partial")
+        # The intake stays out of the spool; see the module docstring
+        partial.write_text(json.dumps(dict(asdict(job), history=None)))
+        partial.replace(path)
+
+    def _forget(self, job: FinalizationJob) -> None:
+        (self.spool_dir / f"{job.intake_id}.json").unlink(missing_ok=True)
+        while len(self._jobs) > RECENT_JOBS:
+            oldest = next(iter(self._jobs.values()))
+            if not oldest.done:
+                break
+            self._jobs.popitem(last=False)
+
+
+finalization_pipeline = FinalizationPipeline()
@@ -0,0 +1,159 @@
+"""
+Deduplication of redelivered WhatsApp webhook messages.
+
+Meta retries a webhook when it does not get a timely response, which would
+otherwise re-run the LLM, store a duplicate conversation and send a duplicate
+reply. Each message ID is claimed once: a bounded, time-windowed in-memory cache
+answers repeats in O(1) without touching the database, and the
+``processed_message`` primary key keeps the claim correct across workers.
+
+A message is claimed before it is processed. If processing fails the claim is
+given back with :func:`release_message`, so Meta's redelivery is processed
+instead of dropped. Claims older than ``WEBHOOK_DEDUP_RETENTION_DAYS`` (Meta
+stops redelivering well before that) are deleted by
+:func:`prune_processed_messages`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .models.models import SessionLocal
+from .utils.utils import logger
+
+
+class RecentIds:
+    """LRU set of IDs seen within the last ``ttl`` seconds, capped at ``max_size``."""
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 86_400) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._expiry: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires = self._expiry.get(key)
+            if expires is None:
+                return False
+            if expires < now:
+                del self._expiry[key]
+                return False
+            return True
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def add(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._expiry[key] = now + self.ttl
+            self._expiry.move_to_end(key)
+            # Entries are kept in insertion order, so expired ones sit at the front.
+            while self._expiry and (
+                len(self._expiry) > self.max_size or next(iter(self._expiry.values())) < now
+            ):
+                self._expiry.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._expiry.pop(key, None)
+
+
+recent_messages = RecentIds(
+    max_size=config("WEBHOOK_DEDUP_CACHE_SIZE", default=10_000, cast=int),
+    ttl=config("WEBHOOK_DEDUP_TTL_SECONDS", default=86_400, cast=float),
+)
+RETENTION_DAYS = config("WEBHOOK_DEDUP_RETENTION_DAYS", default=7, cast=int)
+
+_CLAIM_SQL = text(
+    """
+    INSERT INTO processed_message (message_id)
+    VALUES (:message_id)
+    ON CONFLICT (message_id) DO NOTHING
+    RETURNING message_id
+    """
+)
+
+_RELEASE_SQL = text("DELETE FROM processed_message WHERE message_id = :message_id")
+
+_PRUNE_SQL = text(
+    """
+    DELETE FROM processed_message
+    WHERE received_at < now() - make_interval(days => :days)
+    """
+)
+
+
+def claim_message(message_id: str, db: Session) -> bool:
+    """Claim ``message_id`` for processing.
+
+    Returns:
+        ``True`` if this is the first delivery, ``False`` for a duplicate
+    """
+    if message_id in recent_messages:
+        metrics.increment("webhook_duplicates_absorbed")
+        metrics.increment("webhook_duplicates_absorbed_cache")
+        return False
+
+    try:
+        claimed = db.execute(_CLAIM_SQL, {"message_id": message_id}).first()
+        db.commit()
+    except SQLAlchemyError as e:
+        # Fall back to the in-memory window rather than dropping the message.
+        db.rollback()
+        logger.error(f"Error claiming webhook message: {e}")
+        claimed = True
+
+    recent_messages.add(message_id)
+    if not claimed:
+        metrics.increment("webhook_duplicates_absorbed")
+        metrics.increment("webhook_duplicates_absorbed_db")
+        return False
+    return True
+
+
+def release_message(message_id: str, db: Session) -> None:
+    """Give back the claim on ``message_id`` after its processing failed."""
+    recent_messages.discard(message_id)
+    try:
+        # The failed turn may have left the session inside a broken transaction
+        db.rollback()
+        db.execute(_RELEASE_SQL, {"message_id": message_id})
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Error releasing webhook message claim: {e}")
+        return
+    metrics.increment("webhook_claims_released")
+
+
+def prune_processed_messages(days: int = RETENTION_DAYS, db: Session | None = None) -> int:
+    """Delete claims older than ``days``; return how many were deleted."""
+
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        deleted = db.execute(_PRUNE_SQL, {"days": days}).rowcount
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Error pruning processed webhook messages: {e}")
+        return 0
+    finally:
+        if created_session:
+            db.close()
+    if deleted:
+        logger.info("processed_messages_pruned", rows=deleted)
+    return deleted
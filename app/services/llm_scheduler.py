@@ -0,0 +1,216 @@
+"""
+Shared scheduler for outbound LLM calls.
+
+Every model call made by the agent passes through one :class:`LLMScheduler`
+that bounds how many requests are in flight at once. The bound adapts with
+AIMD (additive increase, multiplicative decrease): it grows by roughly one slot
+per window of successful calls and is cut in half when OpenAI answers 429 or
+when latency climbs above the target. Callers that cannot start immediately
+wait in a priority queue so red-flag and finalization turns overtake greetings,
+and the queue is bounded so bursts are rejected instead of piling up.
+
+All calls also share one keep-alive HTTP transport (:func:`shared_http_client`)
+so TLS connections to the API are reused rather than re-established per turn.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Iterator, List, Optional
+
+from app.config import config
+from app.services import metrics
+from app.services.deadline import Deadline, DeadlineExceeded
+
+
+class Priority(IntEnum):
+    """Queue priority of an LLM call (lower runs first)."""
+
+    RED_FLAG = 0
+    FINALIZATION = 1
+    CLARIFICATION = 2
+    GREETING = 3
+
+
+class SchedulerRejected(RuntimeError):
+    """Raised when the wait queue is full."""
+
+
+class _Waiter:
+    __slots__ = ("granted", "cancelled")
+
+    def __init__(self) -> None:
+        self.granted = False
+        self.cancelled = False
+
+
+class CallSlot:
+    """Handle for one admitted call; mark ``throttled`` when the API says 429."""
+
+    __slots__ = ("throttled",)
+
+    def __init__(self) -> None:
+        self.throttled = False
+
+
+class LLMScheduler:
+    """AIMD concurrency limiter with a bounded priority queue."""
+
+    def __init__(
+        self,
+        initial_limit: float = 8,
+        min_limit: float = 1,
+        max_limit: float = 64,
+        max_queue: int = 256,
+        latency_target: Optional[float] = None,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.max_queue = max_queue
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.rejected = 0
+        self._queue: List[tuple] = []
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @contextmanager
+    def slot(self, priority: int = Priority.CLARIFICATION, deadline: Optional[Deadline] = None) -> Iterator[CallSlot]:
+        """Hold one concurrency slot for the duration of a call.
+
+        Raises:
+            SchedulerRejected: If the wait queue is full
+            DeadlineExceeded: If ``deadline`` expires while queued
+        """
+        self.acquire(priority, deadline)
+        handle = CallSlot()
+        start = time.perf_counter()
+        try:
+            yield handle
+        finally:
+            self.release(time.perf_counter() - start, handle.throttled)
+
+    def acquire(self, priority: int = Priority.CLARIFICATION, deadline: Optional[Deadline] = None) -> None:
+        """Block until a slot is free for a call of ``priority``."""
+        queued_at = time.perf_counter()
+        with self._cond:
+            if self.in_flight < int(self.limit) and not self._queued:
+                self.in_flight += 1
+                self._publish()
+                return
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                metrics.increment("llm_scheduler_rejected")
+                self._publish()
+                raise SchedulerRejected("LLM call queue is full")
+
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (int(priority), next(self._sequence), waiter))
+            self._queued += 1
+            self._publish()
+            while not waiter.granted:
+                timeout = deadline.remaining() if deadline is not None else None
+                if timeout == 0 or not self._cond.wait(timeout):
+                    if waiter.granted:
+                        break
+                    # Leave the entry in the heap; _dispatch skips cancelled waiters.
+                    waiter.cancelled = True
+                    self._queued -= 1
+                    self._publish()
+                    raise DeadlineExceeded("Deadline exceeded waiting for an LLM slot")
+        metrics.observe("llm_scheduler_queue_wait_seconds", time.perf_counter() - queued_at)
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now and nobody is queued."""
+        with self._cond:
+            if self.in_flight < int(self.limit) and not self._queued:
+                self.in_flight += 1
+                self._publish()
+                return True
+        return False
+
+    def release(self, latency: float, throttled: bool = False) -> None:
+        """Return a slot and adapt the limit from the call's outcome."""
+        with self._cond:
+            self.in_flight -= 1
+            congested = throttled or (
+                self.latency_target is not None and latency > self.latency_target
+            )
+            now = time.monotonic()
+            if congested:
+                # Cut at most once per latency window so one burst of 429s
+                # does not collapse the limit to the minimum.
+                if now - self._last_decrease >= latency:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    metrics.increment("llm_scheduler_limit_decreases")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / max(self.limit, 1))
+            self._dispatch()
+            self._publish()
+
+    def _dispatch(self) -> None:
+        granted = False
+        while self._queue and self.in_flight < int(self.limit):
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._queued -= 1
+            self.in_flight += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("llm_scheduler_in_flight", self.in_flight)
+        metrics.set_gauge("llm_scheduler_queued", self._queued)
+        metrics.set_gauge("llm_scheduler_limit", round(self.limit, 2))
+        metrics.set_gauge("llm_scheduler_rejected", self.rejected)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Whether ``exc`` is an HTTP 429 from the model provider."""
+    return getattr(exc, "status_code", None) == 429
+
+
+llm_scheduler = LLMScheduler(
+    initial_limit=config("LLM_CONCURRENCY_INITIAL", default=8, cast=float),
+    min_limit=config("LLM_CONCURRENCY_MIN", default=1, cast=float),
+    max_limit=config("LLM_CONCURRENCY_MAX", default=64, cast=float),
+    max_queue=config("LLM_QUEUE_MAX", default=256, cast=int),
+    latency_target=config("LLM_LATENCY_TARGET_SECONDS", default=20, cast=float) or None,
+)
+
+_http_client = None
+_http_lock = threading.Lock()
+
+
+def shared_http_client():
+    """Return the keep-alive ``httpx.Client`` shared by every chat model."""
+    global _http_client
+    with _http_lock:
+        if _http_client is None:
+            import httpx
+
+            max_connections = int(llm_scheduler.max_limit) * 2
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=config("LLM_KEEPALIVE_SECONDS", default=60, cast=float),
+                ),
+            )
+    return _http_client
@@ -0,0 +1,98 @@
+"""Lightweight in-process metrics shared by the agent, routes and services.
+
+Counters, gauges and latency histograms are kept in memory and exposed as a
+plain dictionary through :func:`snapshot` (served by ``GET /metrics``). The
+registry is thread-safe because the agent runs inside FastAPI's thread pool.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_histograms: Dict[str, Deque[float]] = {}
+
+# Histograms keep a bounded window of the most recent observations so the
+# memory footprint stays constant regardless of traffic.
+HISTOGRAM_WINDOW = 1024
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Add ``value`` to the counter ``name``."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set the gauge ``name`` to ``value``."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one observation (e.g. a latency in seconds) for ``name``."""
+    with _lock:
+        window = _histograms.get(name)
+        if window is None:
+            window = _histograms[name] = deque(maxlen=HISTOGRAM_WINDOW)
+        window.append(value)
+
+
+def counter(name: str) -> float:
+    """Return the current value of the counter ``name``."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def gauge(name: str) -> float:
+    """Return the current value of the gauge ``name``."""
+    with _lock:
+        return _gauges.get(name, 0)
+
+
+def percentile(name: str, pct: float) -> float | None:
+    """Return the ``pct`` percentile (0-100) of ``name`` or ``None`` if empty."""
+    with _lock:
+        window = list(_histograms.get(name, ()))
+    if not window:
+        return None
+    ordered = sorted(window)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def sample_count(name: str) -> int:
+    """Return how many observations are currently held for ``name``."""
+    with _lock:
+        return len(_histograms.get(name, ()))
+
+
+def snapshot() -> Dict[str, Dict[str, object]]:
+    """Return a JSON-serialisable copy of every metric."""
+    with _lock:
+        names = list(_histograms)
+        result: Dict[str, Dict[str, object]] = {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {},
+        }
+    for name in names:
+        result["histograms"][name] = {
+            "count": sample_count(name),
+            "p50": percentile(name, 50),
+            "p95": percentile(name, 95),
+            "p99": percentile(name, 99),
+        }
+    return result
+
+
+def reset() -> None:
+    """Clear every metric (used by the tests)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -4,7 +4,17 @@ from pathlib import Path
 from typing import List
 
 from decouple import AutoConfig
-from sqlalchemy import JSON, UUID, Column, Date, Integer, String, create_engine
+from sqlalchemy import (
+    JSON,
+    UUID,
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+    String,
+    create_engine,
+    func,
+)
 from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
@@ -92,7 +102,12 @@ Base = declarative_base()
 class Conversation(Base):
     __tablename__ = "conversations"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Partitioned by month on created_at, which is therefore part of the key
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(
+        DateTime(timezone=True), primary_key=True, server_default=func.now()
+    )
+    patient_id = Column(UUID, nullable=True)
     sender = Column(String, nullable=False)
     message = Column(String, nullable=False)
     response = Column(String)
@@ -104,5 +119,6 @@ class Patient(Base):
     full_name = Column(BYTEA, nullable=False)
     date_of_birth = Column(Date, nullable=False)
     phone_e164 = Column(String, nullable=False)
+    contact_phone = Column(String, nullable=True)
     email = Column(String, nullable=True)
     address_json = Column(JSON, nullable=True)
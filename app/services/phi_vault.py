@@ -0,0 +1,529 @@
+"""
+Append-only encrypted store for PHI (raw message and response text).
+
+With ``PHI_VAULT`` enabled, :func:`~app.services.secure_storage.store_conversation`
+puts the text of each turn here and keeps only a ``vault:<ref>`` reference
+in ``conversations``. This replaces the old ``db/secure_storage.json``, which
+had to be rewritten on every write and loaded whole on every read.
+
+Layout of ``PHI_VAULT_DIR``:
+
+``segment_<n>.log``
+    Records appended one after the other. Each record is a header (reference
+    ID, kind, payload length, CRC32) followed by its payload. For a ``put``
+    the payload is a 12-byte nonce and the AES-GCM ciphertext of the JSON
+    record, authenticated together with the reference ID. A ``delete`` has an
+    empty payload (a tombstone). Once a segment reaches
+    ``PHI_VAULT_SEGMENT_BYTES``, a new one is started.
+``index.bin``
+    A memory-mapped open-addressing hash table that maps each reference ID
+    to ``(segment, offset, length)``. A lookup reads one or two slots, so it
+    is O(1) however large the vault is. The index is derived data. It is
+    marked clean on :meth:`PhiVault.close`, and after a crash it is rebuilt
+    from the segments, truncating a torn record at the tail.
+
+Durability uses group commit. A writer appends its record and then waits
+until it is on disk. The first writer to wait becomes the leader and runs one
+``fsync`` that covers every record appended so far. Writers that arrive
+during that ``fsync`` are covered by the next one, so concurrent turns share
+``fsync`` calls instead of paying for one each. On disks where ``fsync`` is
+slow, ``PHI_VAULT_COMMIT_WINDOW_MS`` makes the leader wait for more writers
+to join first.
+
+:meth:`PhiVault.compact` copies the live records out of sealed segments that
+are mostly dead (deleted or overwritten) and then removes those segments.
+The records are copied still encrypted.
+
+AES-GCM needs the ``cryptography`` package (the optional ``vault`` extra).
+``python -m app.services.phi_vault import db/secure_storage.json`` loads an
+old JSON store.
+"""
+
+import argparse
+import base64
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from app.config import config
+
+from . import metrics
+from .utils.utils import logger
+
+PHI_VAULT = config("PHI_VAULT", default=False, cast=bool)
+VAULT_DIR = Path(
+    config(
+        "PHI_VAULT_DIR",
+        default=str(Path(__file__).resolve().parent / "database" / "vault"),
+    )
+)
+# urlsafe base64 of a 32-byte AES-256 key
+VAULT_KEY = config("PHI_VAULT_KEY", default="")
+SEGMENT_BYTES = config("PHI_VAULT_SEGMENT_BYTES", default=64 * 1024 * 1024, cast=int)
+COMMIT_WINDOW_MS = config("PHI_VAULT_COMMIT_WINDOW_MS", default=0.0, cast=float)
+# Sealed segments with less than this share of live bytes are compacted
+COMPACT_LIVE_RATIO = config("PHI_VAULT_COMPACT_LIVE_RATIO", default=0.5, cast=float)
+
+REFERENCE_PREFIX = "vault:"
+
+PUT, DELETE = 1, 2
+_RECORD = struct.Struct("<16sBII")  # reference ID, kind, payload length, CRC32
+_NONCE_BYTES = 12
+
+_INDEX_MAGIC = b"PHIVIDX1"
+_INDEX_HEADER = struct.Struct("<8sQQB")  # magic, capacity, used slots, clean
+_INDEX_HEADER_BYTES = 64
+_SLOT = struct.Struct("<16sIQI")  # reference ID, segment, offset, length
+_EMPTY_KEY = bytes(16)
+_INITIAL_CAPACITY = 1 << 16
+_MAX_LOAD = 0.7
+
+_SEGMENT_NAME = re.compile(r"segment_(\d{6})\.log")
+
+
+class _Index:
+    """Open-addressing (linear probing) hash table in a memory-mapped file.
+
+    A slot whose length is 0 marks a deleted reference. It keeps the segment
+    of the record it deleted, so compaction knows whether that delete's
+    tombstone is still needed.
+    """
+
+    def __init__(self, path: Path, capacity: int = _INITIAL_CAPACITY) -> None:
+        self.path = path
+        if not path.exists():
+            self._create(path, capacity)
+        self._open()
+
+    def _open(self) -> None:
+        path = self.path
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.capacity, self.used, self.clean = _INDEX_HEADER.unpack_from(self._map)
+        if magic != _INDEX_MAGIC:
+            raise ValueError(f"{path} is not a vault index")
+
+    @staticmethod
+    def _create(path: Path, capacity: int) -> None:
+        partial = path.with_name(path.name + ".partial")
+        header = _INDEX_HEADER.pack(_INDEX_MAGIC, capacity, 0, 0)
+        with open(partial, "wb") as f:
+            f.write(header.ljust(_INDEX_HEADER_BYTES, b"\0"))
+            f.truncate(_INDEX_HEADER_BYTES + capacity * _SLOT.size)
+        partial.replace(path)
+
+    def _position(self, key: bytes) -> Tuple[int, Optional[Tuple[int, int, int]]]:
+        """Slot number of ``key`` (or of the empty slot where it would go) and its entry."""
+        mask = self.capacity - 1
+        slot = int.from_bytes(key[:8], "little") & mask
+        while True:
+            at = _INDEX_HEADER_BYTES + slot * _SLOT.size
+            found, segment, offset, length = _SLOT.unpack_from(self._map, at)
+            if found == key:
+                return slot, (segment, offset, length)
+            if found == _EMPTY_KEY:
+                return slot, None
+            slot = (slot + 1) & mask
+
+    def get(self, key: bytes) -> Optional[Tuple[int, int, int]]:
+        """``(segment, offset, length)`` of ``key``; length 0 if it was deleted."""
+        return self._position(key)[1]
+
+    def set(self, key: bytes, segment: int, offset: int, length: int) -> None:
+        slot, entry = self._position(key)
+        at = _INDEX_HEADER_BYTES + slot * _SLOT.size
+        _SLOT.pack_into(self._map, at, key, segment, offset, length)
+        if entry is None:
+            self.used += 1
+            self._write_header()
+            if self.used > self.capacity * _MAX_LOAD:
+                self._grow()
+
+    def entries(self) -> Iterator[Tuple[bytes, int, int, int]]:
+        for slot in range(self.capacity):
+            entry = _SLOT.unpack_from(self._map, _INDEX_HEADER_BYTES + slot * _SLOT.size)
+            if entry[0] != _EMPTY_KEY:
+                yield entry
+
+    def mark(self, clean: bool) -> None:
+        self.clean = int(clean)
+        self._write_header()
+        self._map.flush()
+
+    def _write_header(self) -> None:
+        _INDEX_HEADER.pack_into(self._map, 0, _INDEX_MAGIC, self.capacity, self.used, self.clean)
+
+    def _grow(self) -> None:
+        entries = list(self.entries())
+        bigger = self.path.with_name(self.path.name + ".grow")
+        self._create(bigger, self.capacity * 2)
+        grown = _Index(bigger)
+        for entry in entries:
+            grown.set(*entry)
+        grown.close()
+        self.close()
+        bigger.replace(self.path)
+        self._open()
+
+    def close(self) -> None:
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+class PhiVault:
+    """Encrypted, append-only record store addressed by reference ID."""
+
+    def __init__(
+        self,
+        directory: Path = VAULT_DIR,
+        key: str = VAULT_KEY,
+        segment_bytes: int = SEGMENT_BYTES,
+        commit_window_ms: float = COMMIT_WINDOW_MS,
+    ) -> None:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        if not key:
+            raise RuntimeError("PHI_VAULT_KEY is not configured")
+        self._aead = AESGCM(base64.urlsafe_b64decode(key))
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_window = commit_window_ms / 1000
+
+        self._lock = threading.Lock()
+        self._commit = threading.Condition(self._lock)
+        self._written = self._synced = 0  # record sequence numbers
+        self._syncing = False
+        self._fds: Dict[int, int] = {}
+        self._sizes: Dict[int, int] = {}
+        self._live: Dict[int, int] = {}
+
+        directory.mkdir(parents=True, exist_ok=True)
+        for path in sorted(directory.glob("segment_*.log")):
+            match = _SEGMENT_NAME.fullmatch(path.name)
+            if match:
+                segment = int(match.group(1))
+                self._fds[segment] = os.open(path, os.O_RDWR | os.O_APPEND)
+                self._sizes[segment] = os.fstat(self._fds[segment]).st_size
+        try:
+            self._index = _Index(directory / "index.bin")
+        except (ValueError, struct.error):
+            logger.warning("phi_vault_index_unreadable")
+            (directory / "index.bin").unlink()
+            self._index = _Index(directory / "index.bin")
+        if self._fds and not self._index.clean:
+            self._rebuild()
+        else:
+            self._count_live()
+        self._index.mark(clean=False)
+        self._active = max(self._fds, default=0)
+        if not self._active:
+            self._start_segment()
+
+    # -- public API -------------------------------------------------------
+
+    def put(self, record: Dict[str, Any], ref: Optional[str] = None) -> str:
+        """Encrypt and store ``record``; return its reference ID once it is durable."""
+        key = uuid.UUID(ref).bytes if ref else uuid.uuid4().bytes
+        nonce = os.urandom(_NONCE_BYTES)
+        payload = nonce + self._aead.encrypt(nonce, json.dumps(record).encode(), key)
+        with self._lock:
+            self._store(key, PUT, payload)
+            seq = self._written
+        self._wait_durable(seq)
+        metrics.increment("phi_vault_writes")
+        return str(uuid.UUID(bytes=key))
+
+    def get(self, ref: str) -> Optional[Dict[str, Any]]:
+        """The record stored under ``ref``, or ``None`` if there is none."""
+        key = uuid.UUID(ref).bytes
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not entry[2]:
+                return None
+            segment, offset, length = entry
+            data = os.pread(self._fds[segment], length, offset)
+        header = _RECORD.unpack_from(data)
+        payload = data[_RECORD.size :]
+        if header[0] != key or zlib.crc32(payload) != header[3]:
+            raise ValueError(f"Vault record {ref} is corrupt")
+        plain = self._aead.decrypt(payload[:_NONCE_BYTES], payload[_NONCE_BYTES:], key)
+        return json.loads(plain)
+
+    def delete(self, ref: str) -> bool:
+        """Remove ``ref``; ``False`` if it was not stored."""
+        key = uuid.UUID(ref).bytes
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not entry[2]:
+                return False
+            self._store(key, DELETE, b"")
+            seq = self._written
+        self._wait_durable(seq)
+        return True
+
+    def compact(self, live_ratio: float = COMPACT_LIVE_RATIO) -> int:
+        """Rewrite sealed segments with less than ``live_ratio`` live bytes.
+
+        Returns the number of bytes reclaimed.
+        """
+        with self._lock:
+            candidates = [
+                segment
+                for segment, size in self._sizes.items()
+                if segment != self._active and self._live.get(segment, 0) < size * live_ratio
+            ]
+        reclaimed = 0
+        for segment in candidates:
+            # One segment at a time, so writers only wait for one copy
+            with self._lock:
+                reclaimed += self._compact_segment(segment)
+        if candidates:
+            metrics.increment("phi_vault_compacted_bytes", reclaimed)
+            logger.info("phi_vault_compacted", segments=len(candidates), bytes=reclaimed)
+        return reclaimed
+
+    def close(self) -> None:
+        with self._lock:
+            for fd in self._fds.values():
+                os.fsync(fd)
+                os.close(fd)
+            self._fds.clear()
+            self._index.mark(clean=True)
+            self._index.close()
+
+    # -- writing ------------------------------------------------------------
+    # Called with self._lock held unless noted
+
+    def _store(self, key: bytes, kind: int, payload: bytes) -> None:
+        data = _RECORD.pack(key, kind, len(payload), zlib.crc32(payload)) + payload
+        segment, offset = self._append(data)
+        self._apply(key, kind, segment, offset, len(data))
+
+    def _append(self, data: bytes) -> Tuple[int, int]:
+        size = self._sizes[self._active]
+        if size and size + len(data) > self.segment_bytes:
+            # Seal the full segment; everything written so far is then durable
+            os.fsync(self._fds[self._active])
+            self._synced = self._written
+            self._start_segment()
+        segment = self._active
+        offset = self._sizes[segment]
+        os.write(self._fds[segment], data)
+        self._sizes[segment] += len(data)
+        self._written += 1
+        return segment, offset
+
+    def _apply(self, key: bytes, kind: int, segment: int, offset: int, length: int) -> None:
+        old = self._index.get(key)
+        if old is not None and old[2]:
+            self._live[old[0]] = self._live.get(old[0], 0) - old[2]
+        if kind == PUT:
+            self._index.set(key, segment, offset, length)
+            self._live[segment] = self._live.get(segment, 0) + length
+        else:
+            # Remember where the deleted record was; see _compact_segment
+            self._index.set(key, old[0] if old else 0, 0, 0)
+
+    def _start_segment(self) -> None:
+        self._active += 1
+        path = self.directory / f"segment_{self._active:06d}.log"
+        self._fds[self._active] = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        self._sizes[self._active] = 0
+        self._live[self._active] = 0
+
+    def _wait_durable(self, seq: int) -> None:
+        """Block until record ``seq`` is fsynced (group commit); takes the lock."""
+        with self._lock:
+            while self._synced < seq:
+                if self._syncing:
+                    self._commit.wait()
+                    continue
+                # Lead this commit: let other writers append, then sync them all
+                self._syncing = True
+                self._lock.release()
+                try:
+                    if self.commit_window:
+                        time.sleep(self.commit_window)
+                finally:
+                    self._lock.acquire()
+                target, fd = self._written, self._fds[self._active]
+                self._lock.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._commit.notify_all()
+                metrics.observe("phi_vault_commit_batch", target - self._synced)
+                self._synced = max(self._synced, target)
+
+    def _compact_segment(self, segment: int) -> int:
+        while self._syncing:
+            # The commit leader may be syncing this segment's descriptor
+            self._commit.wait()
+        fd, size = self._fds[segment], self._sizes[segment]
+        moved = []
+        for offset, data in self._records(fd, size):
+            key, kind = data[:16], data[16]
+            entry = self._index.get(key)
+            if kind == PUT:
+                keep = entry == (segment, offset, len(data))
+            else:
+                # A tombstone is only needed while the record it deleted exists
+                keep = (
+                    entry is not None
+                    and not entry[2]
+                    and entry[0] != segment
+                    and entry[0] in self._fds
+                )
+            if keep:
+                moved.append((key, kind, data, *self._append(data)))
+        os.fsync(self._fds[self._active])
+        self._synced = self._written
+        for key, kind, data, new_segment, new_offset in moved:
+            if kind == PUT:
+                self._index.set(key, new_segment, new_offset, len(data))
+                self._live[new_segment] += len(data)
+        os.close(self._fds.pop(segment))
+        del self._sizes[segment]
+        self._live.pop(segment, None)
+        (self.directory / f"segment_{segment:06d}.log").unlink()
+        return size - sum(len(m[2]) for m in moved)
+
+    # -- recovery -----------------------------------------------------------
+
+    @staticmethod
+    def _records(fd: int, size: int) -> Iterator[Tuple[int, bytes]]:
+        """``(offset, record)`` of every intact record, stopping at a torn one."""
+        offset = 0
+        while offset + _RECORD.size <= size:
+            header = os.pread(fd, _RECORD.size, offset)
+            _, kind, length, crc = _RECORD.unpack(header)
+            end = offset + _RECORD.size + length
+            if kind not in (PUT, DELETE) or end > size:
+                return
+            payload = os.pread(fd, length, offset + _RECORD.size)
+            if zlib.crc32(payload) != crc:
+                return
+            yield offset, header + payload
+            offset = end
+
+    def _rebuild(self) -> None:
+        logger.warning("phi_vault_index_rebuild", segments=len(self._fds))
+        self._index.close()
+        (self.directory / "index.bin").unlink()
+        self._index = _Index(self.directory / "index.bin")
+        self._live = {}
+        for segment in sorted(self._fds):
+            end = 0
+            for offset, data in self._records(self._fds[segment], self._sizes[segment]):
+                self._apply(data[:16], data[16], segment, offset, len(data))
+                end = offset + len(data)
+            if end < self._sizes[segment]:
+                torn = self._sizes[segment] - end
+                logger.warning("phi_vault_torn_tail", segment=segment, bytes=torn)
+                os.ftruncate(self._fds[segment], end)
+                self._sizes[segment] = end
+
+    def _count_live(self) -> None:
+        self._live = {segment: 0 for segment in self._fds}
+        for _, segment, _, length in self._index.entries():
+            if length:
+                self._live[segment] += length
+
+
+_vault: Optional[PhiVault] = None
+_vault_lock = threading.Lock()
+
+
+def get_vault() -> PhiVault:
+    """Return the shared vault, opening it on first use."""
+    global _vault
+    with _vault_lock:
+        if _vault is None:
+            _vault = PhiVault()
+        return _vault
+
+
+def close_vault() -> None:
+    global _vault
+    with _vault_lock:
+        if _vault is not None:
+            _vault.close()
+            _vault = None
+
+
+def reveal(message: str, response: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Text of a stored turn, resolving a vault reference if the turn holds one.
+
+    A patient can type "vault: ..." too, so the text is only treated as a
+    reference when the vault is on and the rest of it is a reference ID. If
+    the record cannot be read the stored text is returned as it is.
+    """
+    ref = vault_ref(message)
+    if ref is None:
+        return message, response
+    try:
+        record = get_vault().get(ref)
+    except Exception as e:  # a missing key or package, a corrupt record, ...
+        logger.error(f"Error reading PHI vault record {ref}: {e}")
+        return message, response
+    if record is None:  # erased
+        return message, response
+    return record["message"], record["response"]
+
+
+def vault_ref(message: Optional[str]) -> Optional[str]:
+    """The reference ID in a stored ``vault:<ref>`` message, else ``None``."""
+    if not PHI_VAULT or not message or not message.startswith(REFERENCE_PREFIX):
+        return None
+    try:
+        return str(uuid.UUID(message[len(REFERENCE_PREFIX) :]))
+    except ValueError:
+        return None
+
+
+def compact_vault() -> None:
+    """Compact the shared vault, logging any failure."""
+    try:
+        get_vault().compact()
+    except (OSError, ValueError) as e:
+        logger.error(f"Error compacting PHI vault: {e}")
+
+
+def import_json(path: Path, vault: PhiVault) -> int:
+    """Copy the entries of an old JSON secure-storage file; return how many."""
+    entries = json.loads(path.read_text())
+    for ref, record in entries.items():
+        vault.put(record, ref=ref)
+    return len(entries)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Maintain the PHI vault.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="import an old secure_storage.json")
+    load.add_argument("path", type=Path)
+    commands.add_parser("compact", help="compact mostly dead segments")
+    args = parser.parse_args(argv)
+    vault = get_vault()
+    try:
+        if args.command == "import":
+            print(f"Imported {import_json(args.path, vault)} records")
+        else:
+            print(f"Reclaimed {vault.compact()} bytes")
+    finally:
+        close_vault()
+
+
+if __name__ == "__main__":
+    main()
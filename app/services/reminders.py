@@ -0,0 +1,244 @@
+"""
+Appointment reminders and the WhatsApp outbox dispatcher.
+
+Planning is one set-based ``INSERT ... SELECT``. Every booked appointment
+starting within the planning horizon is crossed with the configured reminder
+offsets (``REMINDER_OFFSETS_HOURS``). The resulting ``notification_outbox``
+rows get ``send_after = start_time - offset``. The ``(appointment_id,
+template_name)`` unique key makes re-planning idempotent, so the planner can
+run as often as it likes.
+
+Sending is driven by a :class:`~app.services.timer_wheel.TimerWheel` holding
+the ``send_after`` of every pending WhatsApp row in the horizon. The
+dispatcher thread sleeps until the wheel's next deadline or the next planning
+run, whichever comes first, instead of polling the outbox. When it wakes it
+claims all due rows with one ``SKIP LOCKED`` update and sends them.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .facebook_service import send_message
+from .models.models import SessionLocal
+from .timer_wheel import TimerWheel
+from .utils.utils import logger
+
+REMINDER_OFFSETS_HOURS = [
+    float(hours)
+    for hours in config("REMINDER_OFFSETS_HOURS", default="24,2").split(",")
+    if hours.strip()
+]
+PLAN_INTERVAL_SECONDS = config("REMINDER_PLAN_INTERVAL_SECONDS", default=900.0, cast=float)
+# Reminders due within this window are planned and loaded into the timer wheel
+PLAN_HORIZON = timedelta(hours=config("REMINDER_PLAN_HORIZON_HOURS", default=48, cast=float))
+DISPATCH_BATCH = config("OUTBOX_DISPATCH_BATCH", default=200, cast=int)
+MAX_RETRIES = config("OUTBOX_MAX_RETRIES", default=3, cast=int)
+CLINIC_TIMEZONE = ZoneInfo(config("CLINIC_TIMEZONE", default="UTC"))
+
+TEMPLATES = {
+    "reminder": "Reminder: you have an appointment on {start:%A %d %B at %H:%M}.",
+    "waitlist_offer": (
+        "Good news! An earlier appointment opened up on {start:%A %d %B at %H:%M}. "
+        "Reply YES or BOOK IT to take it."
+    ),
+}
+
+
+def reminder_templates(offsets: List[float] = REMINDER_OFFSETS_HOURS) -> List[Tuple[str, float]]:
+    """``(template_name, hours_before)`` pairs, e.g. ``("reminder_24h", 24.0)``."""
+    return [(f"reminder_{hours:g}h", hours) for hours in offsets]
+
+
+_PLAN_SQL = text(
+    """
+    INSERT INTO notification_outbox
+        (patient_id, appointment_id, channel, template_name, payload_json, send_after)
+    SELECT a.patient_id, a.appointment_id, 'whatsapp', r.template_name,
+           jsonb_build_object('appointment_id', a.appointment_id, 'start_time', s.start_time),
+           s.start_time - make_interval(secs => r.hours * 3600)
+    FROM slot s
+    JOIN appointment a ON a.slot_id = s.slot_id
+    CROSS JOIN unnest(CAST(:templates AS text[]), CAST(:hours AS float8[]))
+        AS r(template_name, hours)
+    WHERE s.status = 'busy'
+      AND s.start_time > now()
+      AND s.start_time <= now() + :horizon + make_interval(secs => :max_hours * 3600)
+      AND a.status = 'booked'
+      AND s.start_time - make_interval(secs => r.hours * 3600)
+          BETWEEN now() AND now() + :horizon
+    ON CONFLICT (appointment_id, template_name) DO NOTHING
+    RETURNING send_after
+    """
+)
+
+_PENDING_SQL = text(
+    """
+    SELECT send_after FROM notification_outbox
+    WHERE status = 'pending' AND channel = 'whatsapp' AND send_after <= now() + :horizon
+    """
+)
+
+_CLAIM_SQL = text(
+    """
+    UPDATE notification_outbox o
+    SET status = 'sent', sent_at = now()
+    FROM (
+        SELECT outbox_id FROM notification_outbox
+        WHERE status = 'pending' AND channel = 'whatsapp' AND send_after <= now()
+        ORDER BY send_after
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    ) due, patient p
+    WHERE o.outbox_id = due.outbox_id AND p.patient_id = o.patient_id
+    RETURNING o.outbox_id::text, p.phone_e164, o.template_name, o.payload_json
+    """
+)
+
+_FAILED_SQL = text(
+    """
+    UPDATE notification_outbox
+    SET retry_count = retry_count + 1,
+        sent_at = NULL,
+        status = CASE WHEN retry_count + 1 >= :max_retries THEN 'failed' ELSE 'pending' END,
+        send_after = now() + make_interval(secs => 60 * power(2, retry_count))
+    WHERE outbox_id = ANY(CAST(:outbox_ids AS uuid[]))
+    RETURNING status, send_after
+    """
+)
+
+
+def plan_reminders(db: Session) -> List[datetime]:
+    """Queue the reminders due within the horizon; return their ``send_after`` times."""
+    templates = reminder_templates()
+    if not templates:
+        return []
+    rows = db.execute(
+        _PLAN_SQL,
+        {
+            "templates": [name for name, _ in templates],
+            "hours": [hours for _, hours in templates],
+            "max_hours": max(hours for _, hours in templates),
+            "horizon": PLAN_HORIZON,
+        },
+    ).scalars()
+    planned = list(rows)
+    db.commit()
+    metrics.increment("reminders_planned", len(planned))
+    return planned
+
+
+def render(template_name: str, payload: dict) -> Optional[str]:
+    """Message text for an outbox row, or ``None`` for an unknown template."""
+    if template_name.startswith("reminder_"):
+        template_name = "reminder"
+    template = TEMPLATES.get(template_name)
+    if template is None:
+        return None
+    start = datetime.fromisoformat(payload["start_time"]).astimezone(CLINIC_TIMEZONE)
+    return template.format(start=start)
+
+
+def dispatch_due(db: Session, wheel: Optional[TimerWheel] = None) -> int:
+    """Claim and send every due WhatsApp outbox row; return how many were sent.
+
+    Failed sends are retried with exponential backoff; their new ``send_after``
+    is scheduled on ``wheel`` if one is given.
+    """
+    sent = 0
+    while True:
+        rows = db.execute(_CLAIM_SQL, {"batch": DISPATCH_BATCH}).all()
+        db.commit()
+        failed = []
+        for outbox_id, phone, template_name, payload in rows:
+            body = render(template_name, payload)
+            if body is None or not phone or send_message(phone, body) is None:
+                failed.append(outbox_id)
+            else:
+                sent += 1
+        if failed:
+            retries = db.execute(
+                _FAILED_SQL, {"outbox_ids": failed, "max_retries": MAX_RETRIES}
+            ).all()
+            db.commit()
+            for status, send_after in retries:
+                if wheel is not None and status == "pending":
+                    wheel.schedule(send_after.timestamp())
+            metrics.increment("outbox_send_failures", len(failed))
+        if len(rows) < DISPATCH_BATCH:
+            break
+    metrics.increment("outbox_sent", sent)
+    return sent
+
+
+class ReminderService:
+    """Background thread that plans reminders and sends due outbox rows."""
+
+    def __init__(self, session_factory=SessionLocal) -> None:
+        self.session_factory = session_factory
+        self.wheel = TimerWheel(tick=1.0, size=3600, now=time.time())
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._next_plan = 0.0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def notify(self, when: Optional[datetime] = None) -> None:
+        """Wake the dispatcher at ``when`` (default: now) for a newly queued row."""
+        with self._cond:
+            self.wheel.schedule(when.timestamp() if when else time.time())
+            self._cond.notify()
+
+    def _plan(self, db: Session) -> None:
+        for send_after in plan_reminders(db):
+            self.wheel.schedule(send_after.timestamp())
+        # Also pick up rows queued elsewhere (waitlist offers, retries)
+        for send_after in db.execute(_PENDING_SQL, {"horizon": PLAN_HORIZON}).scalars():
+            self.wheel.schedule(send_after.timestamp())
+        self._next_plan = time.time() + PLAN_INTERVAL_SECONDS
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    wake = min(self.wheel.next_due() or self._next_plan, self._next_plan)
+                    if wake <= time.time():
+                        break
+                    self._cond.wait(wake - time.time())
+                if self._closed:
+                    return
+            db = self.session_factory()
+            try:
+                if time.time() >= self._next_plan:
+                    self._plan(db)
+                if self.wheel.pop_due(time.time()):
+                    dispatch_due(db, self.wheel)
+            except SQLAlchemyError as e:
+                db.rollback()
+                logger.error(f"Error processing reminders: {e}")
+                self._next_plan = time.time() + 60
+            finally:
+                db.close()
+
+
+reminder_service = ReminderService()
@@ -0,0 +1,211 @@
+"""
+Partition maintenance and retention for ``conversations``.
+
+The table is range-partitioned by month on ``created_at``
+(``conversations_pYYYY_MM``). :func:`ensure_partitions` keeps
+``CONVERSATION_PARTITIONS_AHEAD`` months created in advance so inserts never
+find a missing partition. :func:`retire_partitions` removes months older than
+``CONVERSATION_RETENTION_MONTHS``. For each one it:
+
+1. detaches the partition with ``DETACH PARTITION ... CONCURRENTLY``, which
+   does not block inserts or reads of the live months;
+2. copies the detached table to a gzip CSV in ``CONVERSATION_ARCHIVE_DIR``;
+3. with ``PHI_VAULT`` on, deletes the vault records its turns refer to (the
+   archive keeps only the references);
+4. drops the table.
+
+Every step can be repeated. A run interrupted half way is finished by the
+next one: a pending detach is finalized, and an already-detached table is
+archived again before it is dropped.
+
+Run it by hand with::
+
+    python -m app.services.retention
+"""
+
+import gzip
+import os
+import re
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import List, NamedTuple
+
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .models.models import SessionLocal, engine
+from .phi_vault import PHI_VAULT, PhiVault, get_vault, vault_ref
+from .utils.utils import logger
+
+PARTITIONS_AHEAD = config("CONVERSATION_PARTITIONS_AHEAD", default=3, cast=int)
+RETENTION_MONTHS = config("CONVERSATION_RETENTION_MONTHS", default=12, cast=int)
+MAINTENANCE_INTERVAL_SECONDS = config(
+    "CONVERSATION_MAINTENANCE_INTERVAL_SECONDS", default=86400.0, cast=float
+)
+ARCHIVE_DIR = Path(
+    config(
+        "CONVERSATION_ARCHIVE_DIR",
+        default=str(Path(__file__).resolve().parent / "database" / "archive"),
+    )
+)
+
+_PARTITION_NAME = re.compile(r"^conversations_p(\d{4})_(\d{2})$")
+
+_PARTITIONS_SQL = text(
+    """
+    SELECT c.relname, i.inhrelid IS NOT NULL, COALESCE(i.inhdetachpending, false)
+    FROM pg_class c
+    LEFT JOIN pg_inherits i
+           ON i.inhrelid = c.oid AND i.inhparent = 'conversations'::regclass
+    WHERE c.relkind = 'r'
+      AND c.relnamespace = current_schema()::regnamespace
+      AND c.relname ~ '^conversations_p[0-9]{4}_[0-9]{2}$'
+    ORDER BY c.relname
+    """
+)
+
+
+class Partition(NamedTuple):
+    name: str
+    month: date
+    attached: bool
+    detach_pending: bool
+
+
+def partition_month(name: str) -> date:
+    """First day of the month stored in partition ``name``."""
+    match = _PARTITION_NAME.match(name)
+    if match is None:
+        raise ValueError(f"Not a conversations partition: {name}")
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def retention_cutoff(today: date, months: int = RETENTION_MONTHS) -> date:
+    """First day of the oldest month kept; partitions before it are retired."""
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    return date(year, month + 1, 1)
+
+
+def ensure_partitions(
+    months_ahead: int = PARTITIONS_AHEAD, db: Session | None = None
+) -> List[str]:
+    """Create missing partitions up to ``months_ahead`` months out; return their names."""
+
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        created = list(
+            db.execute(
+                text("SELECT fn_create_conversation_partitions(:months)"),
+                {"months": months_ahead},
+            ).scalars()
+        )
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if created_session:
+            db.close()
+    if created:
+        logger.info("conversation_partitions_created", partitions=created)
+    return created
+
+
+def list_partitions() -> List[Partition]:
+    """Monthly partitions, attached or detached but not yet dropped."""
+    with engine.connect() as conn:
+        rows = conn.execute(_PARTITIONS_SQL).all()
+    return [
+        Partition(name, partition_month(name), attached, pending)
+        for name, attached, pending in rows
+    ]
+
+
+def archive_partition(name: str, archive_dir: Path = ARCHIVE_DIR) -> Path:
+    """Copy partition ``name`` to ``<archive_dir>/<name>.csv.gz`` and return the path."""
+    partition_month(name)  # only ever interpolate a validated name
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+    partial = path.with_suffix(".gz.partial")
+    raw = engine.raw_connection()
+    try:
+        with gzip.open(partial, "wb") as out:
+            cursor = raw.cursor()
+            cursor.copy_expert(
+                f"COPY (SELECT * FROM {name} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)",
+                out,
+            )
+            cursor.close()
+        raw.commit()
+    finally:
+        raw.close()
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+    partial.replace(path)
+    return path
+
+
+def erase_vault_records(conn, name: str, vault: PhiVault | None = None) -> int:
+    """Delete the vault records referenced by partition ``name``; return how many."""
+    partition_month(name)  # only ever interpolate a validated name
+    vault = vault or get_vault()
+    rows = conn.execute(text(f"SELECT message FROM {name} WHERE message LIKE 'vault:%'"))
+    erased = 0
+    for (message,) in rows:
+        ref = vault_ref(message)
+        if ref is not None and vault.delete(ref):
+            erased += 1
+    if erased:
+        logger.info("conversation_vault_records_erased", partition=name, records=erased)
+        metrics.increment("phi_vault_records_erased", erased)
+    return erased
+
+
+def retire_partitions(cutoff: date, archive_dir: Path = ARCHIVE_DIR) -> List[Path]:
+    """Detach, archive and drop every partition for a month before ``cutoff``."""
+    archived = []
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for partition in list_partitions():
+            if partition.month >= cutoff:
+                continue
+            detach = f"ALTER TABLE conversations DETACH PARTITION {partition.name}"
+            if partition.detach_pending:
+                conn.execute(text(f"{detach} FINALIZE"))
+            elif partition.attached:
+                conn.execute(text(f"{detach} CONCURRENTLY"))
+            path = archive_partition(partition.name, archive_dir)
+            if PHI_VAULT:
+                # Before the drop, so a failure leaves the references to retry
+                erase_vault_records(conn, partition.name)
+            conn.execute(text(f"DROP TABLE {partition.name}"))
+            logger.info(
+                "conversation_partition_archived", partition=partition.name, path=str(path)
+            )
+            metrics.increment("conversation_partitions_archived")
+            archived.append(path)
+    return archived
+
+
+def run_retention() -> None:
+    """Create upcoming partitions and retire expired ones, logging any failure."""
+    try:
+        ensure_partitions()
+        retire_partitions(retention_cutoff(datetime.now(timezone.utc).date()))
+    # archive_partition copies through the raw DB-API connection, whose errors
+    # are psycopg2's own rather than SQLAlchemy's
+    except (SQLAlchemyError, psycopg2.Error, OSError, RuntimeError, ValueError) as e:
+        logger.error(f"Error maintaining conversation partitions: {e}")
+
+
+if __name__ == "__main__":
+    run_retention()
@@ -0,0 +1,262 @@
+"""
+In-memory availability index over the ``slot`` table.
+
+Free slots are kept in per-(provider, service type) lists sorted by start time,
+so "the next N free slots matching X" is a binary search plus a k-way merge of
+the matching lists and never touches the database. The index is kept current
+incrementally: ``slot.updated_at`` is bumped by a trigger on every change, and
+:meth:`SlotIndex.refresh` only reads the rows changed since the last refresh
+(with a small overlap for transactions that committed late). Hard deletes are
+not visible that way, so the index is rebuilt from scratch every
+``SLOT_INDEX_FULL_RELOAD_SECONDS``.
+
+Callbacks in :attr:`SlotIndex.listeners` are told about slots that became
+free since the previous refresh (e.g. after a cancellation), which is how the
+waitlist matcher hears about them.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .utils.utils import logger
+
+REFRESH_SECONDS = config("SLOT_INDEX_REFRESH_SECONDS", default=5.0, cast=float)
+FULL_RELOAD_SECONDS = config("SLOT_INDEX_FULL_RELOAD_SECONDS", default=900.0, cast=float)
+# Rows updated this long before the previous refresh are read again, so a
+# transaction that committed after that refresh is not missed.
+REFRESH_OVERLAP = timedelta(seconds=config("SLOT_INDEX_OVERLAP_SECONDS", default=30, cast=int))
+
+_Key = Tuple[str, Optional[str]]
+
+
+@dataclass(frozen=True, order=True)
+class FreeSlot:
+    start_time: datetime
+    end_time: datetime
+    slot_id: str
+    provider_id: str
+    service_type: Optional[str] = None
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end_time - self.start_time
+
+
+_SLOTS_SQL = """
+    SELECT s.slot_id::text, sc.provider_id::text,
+           COALESCE(s.service_type, sc.service_type) AS service_type,
+           s.start_time, s.end_time,
+           s.status = 'free' AND sc.is_active AS is_free,
+           s.updated_at
+    FROM slot s
+    JOIN schedule sc ON sc.schedule_id = s.schedule_id
+    WHERE s.end_time > now()
+"""
+_FULL_SQL = text(_SLOTS_SQL + " AND s.status = 'free' AND sc.is_active")
+_CHANGED_SQL = text(_SLOTS_SQL + " AND s.updated_at > :since")
+
+
+class SlotIndex:
+    """Sorted free-slot lists per provider and service type."""
+
+    def __init__(self) -> None:
+        self._by_key: Dict[_Key, List[FreeSlot]] = {}
+        self._by_id: Dict[str, FreeSlot] = {}
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._watermark: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._loaded_at = 0.0
+        # Called as ``listener(freed_slots, db)`` when a refresh or a reload
+        # (other than the first) finds slots that were not free before
+        self.listeners: List[Callable[[List[FreeSlot], Session], None]] = []
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, slot_id: str) -> bool:
+        return slot_id in self._by_id
+
+    # -- maintenance -----------------------------------------------------
+
+    def add(self, slot: FreeSlot) -> None:
+        with self._lock:
+            self._discard(slot.slot_id)
+            self._by_id[slot.slot_id] = slot
+            insort(self._by_key.setdefault((slot.provider_id, slot.service_type), []), slot)
+
+    def remove(self, slot_id: str) -> None:
+        with self._lock:
+            self._discard(slot_id)
+
+    def _discard(self, slot_id: str) -> None:
+        slot = self._by_id.pop(slot_id, None)
+        if slot is None:
+            return
+        key = (slot.provider_id, slot.service_type)
+        slots = self._by_key[key]
+        del slots[bisect_left(slots, slot)]
+        if not slots:
+            del self._by_key[key]
+
+    def apply(self, rows: Iterable[tuple]) -> int:
+        """Apply ``(slot_id, provider_id, service_type, start, end, is_free, ...)`` rows."""
+        count = 0
+        with self._lock:
+            for slot_id, provider_id, service_type, start, end, is_free, *_ in rows:
+                if is_free:
+                    self.add(FreeSlot(start, end, slot_id, provider_id, service_type))
+                else:
+                    self._discard(slot_id)
+                count += 1
+        return count
+
+    def prune(self, now: Optional[datetime] = None) -> None:
+        """Drop slots that have already started."""
+        now = now or datetime.now(timezone.utc)
+        probe = FreeSlot(now, now, "", "")
+        with self._lock:
+            for key, slots in list(self._by_key.items()):
+                started = bisect_left(slots, probe)
+                for slot in slots[:started]:
+                    del self._by_id[slot.slot_id]
+                del slots[:started]
+                if not slots:
+                    del self._by_key[key]
+
+    def load(self, db: Session) -> int:
+        """Rebuild the index from every future free slot."""
+        rows = db.execute(_FULL_SQL).all()
+        with self._lock:
+            # On the first load every slot is "new"; that is not a cancellation
+            before = None if self._watermark is None else set(self._by_id)
+            self._by_key.clear()
+            self._by_id.clear()
+            self.apply(rows)
+            self._watermark = max(
+                (row[6] for row in rows), default=datetime.now(timezone.utc)
+            )
+            freed = (
+                []
+                if before is None
+                else [slot for slot_id, slot in self._by_id.items() if slot_id not in before]
+            )
+        self._loaded_at = self._refreshed_at = time.monotonic()
+        metrics.increment("slot_index_full_loads")
+        metrics.set_gauge("slot_index_free_slots", len(self))
+        self._notify(freed, db)
+        return len(rows)
+
+    def refresh(self, db: Session) -> int:
+        """Apply the slot rows changed since the last refresh."""
+        if self._watermark is None or time.monotonic() - self._loaded_at >= FULL_RELOAD_SECONDS:
+            return self.load(db)
+        rows = db.execute(_CHANGED_SQL, {"since": self._watermark - REFRESH_OVERLAP}).all()
+        with self._lock:
+            freed = [
+                FreeSlot(start, end, slot_id, provider_id, service_type)
+                for slot_id, provider_id, service_type, start, end, is_free, _ in rows
+                if is_free and slot_id not in self._by_id
+            ]
+            self.apply(rows)
+            self._watermark = max((row[6] for row in rows), default=self._watermark)
+            self.prune()
+        self._refreshed_at = time.monotonic()
+        metrics.increment("slot_index_refreshes")
+        metrics.increment("slot_index_rows_applied", len(rows))
+        metrics.set_gauge("slot_index_free_slots", len(self))
+        self._notify(freed, db)
+        return len(rows)
+
+    def _notify(self, freed: List[FreeSlot], db: Session) -> None:
+        if freed:
+            for listener in self.listeners:
+                listener(freed, db)
+
+    def ensure_fresh(
+        self, session_factory: Callable[[], Session], max_age: float = REFRESH_SECONDS
+    ) -> None:
+        """Refresh if the index is older than ``max_age`` seconds.
+
+        Only one caller refreshes at a time; the others keep answering from the
+        current index instead of waiting. Database errors are logged and the
+        stale index keeps serving.
+        """
+        if time.monotonic() - self._refreshed_at < max_age:
+            return
+        if not self._refresh_lock.acquire(blocking=self._watermark is None):
+            return
+        try:
+            db = session_factory()
+            try:
+                self.refresh(db)
+            finally:
+                db.close()
+        except SQLAlchemyError as e:
+            metrics.increment("slot_index_refresh_errors")
+            logger.error(f"Error refreshing slot index: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    # -- queries ---------------------------------------------------------
+
+    def next_free(
+        self,
+        limit: int = 3,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+        provider_id: Optional[str] = None,
+        service_type: Optional[str] = None,
+        min_duration: Optional[timedelta] = None,
+    ) -> List[FreeSlot]:
+        """Return up to ``limit`` free slots in start order.
+
+        Args:
+            limit: Maximum number of slots
+            after: Earliest start time (default: now)
+            before: Latest start time (exclusive)
+            provider_id: Only this provider's slots
+            service_type: Only slots of this service type
+            min_duration: Only slots at least this long
+        """
+        started = time.perf_counter()
+        after = after or datetime.now(timezone.utc)
+        probe = FreeSlot(after, after, "", "")
+        with self._lock:
+            streams = [
+                islice(slots, bisect_left(slots, probe), None)
+                for (provider, service), slots in self._by_key.items()
+                if (provider_id is None or provider == provider_id)
+                and (service_type is None or service == service_type)
+            ]
+            matches: Iterator[FreeSlot] = heapq.merge(*streams)
+            if before is not None:
+                matches = _take_while_before(matches, before)
+            if min_duration is not None:
+                matches = (slot for slot in matches if slot.duration >= min_duration)
+            result = list(islice(matches, limit))
+        metrics.observe("slot_index_query_seconds", time.perf_counter() - started)
+        return result
+
+
+def _take_while_before(slots: Iterator[FreeSlot], before: datetime) -> Iterator[FreeSlot]:
+    for slot in slots:
+        if slot.start_time >= before:
+            return
+        yield slot
+
+
+slot_index = SlotIndex()
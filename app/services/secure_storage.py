@@ -1,13 +1,19 @@
 """Utility for storing conversations in the database."""
 
+import json
+import re
 import uuid
-from datetime import date
-from typing import Any
 
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
-from .models.models import Conversation, Patient, SessionLocal
+from app.agents.schemas.patient_form_EN import PatientHistory
+from app.config import config
+
+from .fhir import IDENTITY_FIELDS
+from .models.models import Conversation, SessionLocal
+from .phi_vault import PHI_VAULT, REFERENCE_PREFIX, get_vault
 
 
 def store_conversation(
@@ -16,7 +22,14 @@ def store_conversation(
     response: str,
     db: Session | None = None,
 ) -> int:
-    """Persist a conversation to the database and return the row ID."""
+    """Persist a conversation to the database and return the row ID.
+
+    With ``PHI_VAULT`` the text goes to the PHI vault and both columns hold
+    its reference instead.
+    """
+    if PHI_VAULT:
+        ref = get_vault().put({"sender": sender, "message": message, "response": response})
+        message = response = REFERENCE_PREFIX + ref
 
     created_session = False
     if db is None:
@@ -37,15 +50,88 @@ def store_conversation(
             db.close()
 
 
-def store_patient(
-    patient_id: uuid.UUID | str,
-    full_name: bytes,
-    date_of_birth: date,
-    phone_e164: str,
-    email: str | None,
-    address_json: dict[str, Any] | str,
+PHI_ENCRYPTION_KEY = config("PHI_ENCRYPTION_KEY", default="")
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def to_e164(number: str) -> str | None:
+    """``number`` as ``+<digits>``, or ``None`` if it cannot be an E.164 number."""
+    digits = _NON_DIGITS.sub("", number or "")
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+# One round trip: upsert the patient by the sender's verified WhatsApp number
+# (name encrypted by pgcrypto), link the sender's earlier conversation turns
+# to them and store the intake answers. Data-modifying CTEs all run in the
+# same snapshot, so the statement is atomic. The intake ID comes from the
+# caller, so running it again for the same intake (a retried finalization)
+# updates the answers instead of adding a second response.
+#
+# The phone number the patient typed is only stored as contact_phone: it may
+# be a relative's or mistyped, so it never selects the patient row. An email
+# already on another patient's row is left out rather than failing on
+# patient.email UNIQUE (ON CONFLICT covers one constraint only); a concurrent
+# claim of the same email still fails and the finalization is retried.
+_FINALIZE_SQL = text(
+    """
+    WITH upserted AS (
+        INSERT INTO patient (
+            full_name, date_of_birth, phone_e164, contact_phone, email, address_json
+        )
+        VALUES (
+            pgp_sym_encrypt(:full_name, :key),
+            :date_of_birth,
+            :phone_e164,
+            :contact_phone,
+            CASE WHEN NOT EXISTS (
+                SELECT 1 FROM patient
+                WHERE email = :email
+                  AND phone_e164 IS DISTINCT FROM CAST(:phone_e164 AS text)
+            ) THEN :email END,
+            CAST(:address_json AS jsonb)
+        )
+        ON CONFLICT (phone_e164) DO UPDATE
+        SET full_name = EXCLUDED.full_name,
+            date_of_birth = EXCLUDED.date_of_birth,
+            contact_phone = COALESCE(EXCLUDED.contact_phone, patient.contact_phone),
+            email = COALESCE(EXCLUDED.email, patient.email),
+            address_json = COALESCE(EXCLUDED.address_json, patient.address_json)
+        RETURNING patient_id
+    ), linked AS (
+        UPDATE conversations c
+        SET patient_id = u.patient_id
+        FROM upserted u
+        WHERE c.sender = :sender AND c.patient_id IS DISTINCT FROM u.patient_id
+    ), intake AS (
+        INSERT INTO intake_response (intake_id, patient_id, sender, answers)
+        SELECT CAST(:intake_id AS uuid), patient_id, :sender, CAST(:answers AS jsonb)
+        FROM upserted
+        ON CONFLICT (intake_id) DO UPDATE
+        SET patient_id = EXCLUDED.patient_id, answers = EXCLUDED.answers
+        RETURNING intake_id
+    )
+    SELECT u.patient_id, i.intake_id FROM upserted u, intake i
+    """
+)
+
+
+def finalize_intake(
+    sender: str,
+    history: PatientHistory,
     db: Session | None = None,
-) -> uuid.UUID:
+    intake_id: str | None = None,
+) -> tuple[uuid.UUID, uuid.UUID]:
+    """Persist a completed intake; return ``(patient_id, intake_id)``.
+
+    A returning patient (same WhatsApp number) is updated in place, and so is
+    an intake stored before under the same ``intake_id`` (a new one by
+    default). A sender that is not a phone number gets a new patient row.
+    """
+    if not PHI_ENCRYPTION_KEY:
+        raise RuntimeError("PHI_ENCRYPTION_KEY is not configured")
 
     created_session = False
     if db is None:
@@ -53,24 +139,50 @@ def store_patient(
         created_session = True
 
     try:
-        id_ = uuid.UUID(str(patient_id))
-        patient = Patient(
-            patient_id=id_,
-            full_name=full_name,
-            date_of_birth=date_of_birth,
-            phone_e164=phone_e164,
-            email=email,
-            address_json=address_json,
-        )
-        db.add(patient)
+        patient_id, intake_id = db.execute(
+            _FINALIZE_SQL,
+            {
+                "key": PHI_ENCRYPTION_KEY,
+                "intake_id": intake_id or str(uuid.uuid4()),
+                "full_name": history.name,
+                "date_of_birth": history.dob,
+                "phone_e164": to_e164(sender),
+                "contact_phone": history.phone_number,
+                "email": history.email_address,
+                "address_json": json.dumps(history.address) if history.address else None,
+                "sender": sender,
+                "answers": history.model_dump_json(exclude=IDENTITY_FIELDS),
+            },
+        ).one()
         db.commit()
-        db.refresh(patient)
-
-        return patient_id
-
+        return patient_id, intake_id
     except SQLAlchemyError:
         db.rollback()
         raise
     finally:
         if created_session:
             db.close()
+
+
+_LATEST_INTAKE_SQL = text(
+    """
+    SELECT intake_id FROM intake_response
+    WHERE sender = :sender
+    ORDER BY completed_at DESC
+    LIMIT 1
+    """
+)
+
+
+def latest_intake_id(sender: str, db: Session | None = None) -> uuid.UUID | None:
+    """ID of the most recent intake stored for ``sender``."""
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        return db.execute(_LATEST_INTAKE_SQL, {"sender": sender}).scalar()
+    finally:
+        if created_session:
+            db.close()
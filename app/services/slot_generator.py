@@ -0,0 +1,204 @@
+"""
+Set-based expansion of ``schedule`` rows into ``slot`` rows.
+
+Each schedule describes a repeating pattern:
+- ``slot_minutes`` long slots;
+- between ``day_start`` and ``day_end`` (local time in ``time_zone``);
+- on the ISO ``working_days``;
+- within ``period_start``/``period_end``.
+The pattern is expanded inside Postgres with two nested ``generate_series``
+calls and written with one ``INSERT ... ON CONFLICT DO NOTHING`` on the
+``(start_time, end_time, schedule_id)`` key. A year of calendars is therefore a
+single statement, not one ORM object per slot.
+
+Regeneration is incremental. Editing a schedule bumps its ``updated_at``, and
+:func:`regenerate_changed` only re-expands schedules edited since their
+``slots_generated_at``, plus those last expanded over a day ago whose period
+runs past the horizon then, so the horizon keeps moving forward. Free future
+slots that no longer fit the pattern are deleted, missing ones are inserted,
+and booked or reserved slots (and past ones) are never touched.
+
+The app runs :func:`run_slot_generation` with its daily maintenance (see
+``CONVERSATION_MAINTENANCE``); ``python -m app.services.slot_generator`` runs
+it by hand, e.g. right after editing schedules.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .models.models import SessionLocal
+from .utils.utils import logger
+
+# Slots are generated this far ahead; the daily run extends long periods
+HORIZON_DAYS = config("SLOT_GENERATION_HORIZON_DAYS", default=400, cast=int)
+
+_WANTED = """
+    SELECT sc.schedule_id,
+           t AS start_time,
+           t + make_interval(mins => sc.slot_minutes) AS end_time,
+           sc.service_type
+    FROM schedule sc
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('day', greatest(sc.period_start, :since) AT TIME ZONE sc.time_zone),
+        least(sc.period_end, :until) AT TIME ZONE sc.time_zone,
+        interval '1 day'
+    ) AS d(day)
+    CROSS JOIN LATERAL generate_series(
+        (d.day + sc.day_start) AT TIME ZONE sc.time_zone,
+        (d.day + sc.day_end - make_interval(mins => sc.slot_minutes)) AT TIME ZONE sc.time_zone,
+        make_interval(mins => sc.slot_minutes)
+    ) AS t
+    WHERE sc.is_active
+      AND {schedules}
+      AND EXTRACT(ISODOW FROM d.day)::smallint = ANY(sc.working_days)
+      AND t >= greatest(sc.period_start, :since)
+      AND t + make_interval(mins => sc.slot_minutes) <= least(sc.period_end, :until)
+"""
+
+_GENERATE = """
+    WITH targets AS (
+        {targets}
+    ), wanted AS (
+        {wanted}
+    ), removed AS (
+        DELETE FROM slot s
+        USING targets g
+        WHERE s.schedule_id = g.schedule_id
+          AND s.status = 'free'
+          AND s.start_time >= :since
+          AND NOT EXISTS (
+              SELECT 1 FROM wanted w
+              WHERE w.schedule_id = s.schedule_id
+                AND w.start_time = s.start_time
+                AND w.end_time = s.end_time
+          )
+          AND NOT EXISTS (SELECT 1 FROM appointment a WHERE a.slot_id = s.slot_id)
+          AND NOT EXISTS (SELECT 1 FROM waitlist_request r WHERE r.fulfilled_slot = s.slot_id)
+        RETURNING 1
+    ), inserted AS (
+        INSERT INTO slot (schedule_id, start_time, end_time, status, service_type)
+        SELECT schedule_id, start_time, end_time, 'free', service_type FROM wanted w
+        -- Keep a changed pattern from overlapping slots that are already taken
+        WHERE NOT EXISTS (
+            SELECT 1 FROM slot s
+            WHERE s.schedule_id = w.schedule_id
+              AND s.status <> 'free'
+              AND s.start_time < w.end_time
+              AND s.end_time > w.start_time
+        )
+        ON CONFLICT (start_time, end_time, schedule_id) DO NOTHING
+        RETURNING 1
+    ), marked AS (
+        UPDATE schedule sc
+        SET slots_generated_at = now()
+        FROM targets g
+        WHERE sc.schedule_id = g.schedule_id
+    )
+    SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM removed)
+"""
+
+_GENERATE_SQL = text(
+    _GENERATE.format(
+        targets="""SELECT schedule_id FROM schedule
+                   WHERE schedule_id = ANY(CAST(:schedule_ids AS uuid[]))""",
+        wanted=_WANTED.format(schedules="sc.schedule_id IN (SELECT schedule_id FROM targets)"),
+    )
+)
+_REGENERATE_CHANGED_SQL = text(
+    _GENERATE.format(
+        # Edited schedules match idx_schedule_regenerate; the second branch
+        # rolls the horizon forward. The lock keeps two workers from expanding
+        # the same schedule at once.
+        targets="""SELECT schedule_id FROM schedule
+                   WHERE slots_generated_at IS NULL OR updated_at > slots_generated_at
+                      OR (is_active
+                          AND slots_generated_at < now() - interval '1 day'
+                          AND period_end > slots_generated_at
+                                           + make_interval(days => :horizon_days))
+                   FOR UPDATE SKIP LOCKED""",
+        wanted=_WANTED.format(schedules="sc.schedule_id IN (SELECT schedule_id FROM targets)"),
+    )
+)
+
+
+def _run(db: Session | None, statement, params: dict) -> tuple[int, int]:
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+    try:
+        inserted, removed = db.execute(statement, params).one()
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if created_session:
+            db.close()
+    metrics.increment("slots_generated", inserted)
+    metrics.increment("slots_removed", removed)
+    return inserted, removed
+
+
+def _window(since: Optional[datetime], until: Optional[datetime]) -> dict[str, datetime]:
+    since = since or datetime.now(timezone.utc)
+    return {"since": since, "until": until or since + timedelta(days=HORIZON_DAYS)}
+
+
+def generate_slots(
+    schedule_ids: Sequence[str],
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session | None = None,
+) -> tuple[int, int]:
+    """Expand the given schedules into slots between ``since`` and ``until``.
+
+    Args:
+        schedule_ids: Schedules to expand
+        since: Start of the window (default: now); earlier slots are left alone
+        until: End of the window (default: ``since`` plus the generation horizon)
+        db: Optional session
+
+    Returns:
+        ``(inserted, removed)`` slot counts
+    """
+    params = _window(since, until)
+    params["schedule_ids"] = list(schedule_ids)
+    return _run(db, _GENERATE_SQL, params)
+
+
+def regenerate_changed(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session | None = None,
+) -> tuple[int, int]:
+    """Re-expand every schedule created or edited since its last generation.
+
+    Schedules whose period runs past the horizon of their last expansion (done
+    over a day ago) are re-expanded too, which extends their slots.
+    """
+    params = _window(since, until)
+    params["horizon_days"] = HORIZON_DAYS
+    inserted, removed = _run(db, _REGENERATE_CHANGED_SQL, params)
+    if inserted or removed:
+        logger.info(f"Slot generation: {inserted} slots added, {removed} removed")
+    return inserted, removed
+
+
+def run_slot_generation() -> None:
+    """Regenerate changed schedules and extend the horizon, logging any failure."""
+    try:
+        regenerate_changed()
+    except SQLAlchemyError as e:
+        logger.error(f"Error generating slots: {e}")
+
+
+if __name__ == "__main__":
+    run_slot_generation()
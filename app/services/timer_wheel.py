@@ -0,0 +1,77 @@
+"""
+Hashed timer wheel.
+
+Deadlines are rounded to ``tick`` seconds and dropped into one of ``size``
+buckets, so scheduling is O(1) however many timers are pending. Deadlines more
+than one rotation away wait in an overflow list and move into the wheel as it
+turns. :meth:`TimerWheel.next_due` tells a caller exactly how long it may sleep
+before something is due.
+"""
+
+import threading
+from typing import Any, List, Optional, Tuple
+
+
+class TimerWheel:
+    """Timers bucketed by ``tick``-second slots over ``size`` slots."""
+
+    def __init__(self, tick: float = 1.0, size: int = 3600, now: float = 0.0) -> None:
+        self.tick = tick
+        self.size = size
+        self._buckets: List[List[Tuple[int, Any]]] = [[] for _ in range(size)]
+        self._overflow: List[Tuple[int, Any]] = []
+        self._cursor = int(now // tick)  # last tick already fired
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count + len(self._overflow)
+
+    def schedule(self, when: float, item: Any = None) -> None:
+        """Fire ``item`` at ``when`` (same clock as ``pop_due``); past times fire next."""
+        with self._lock:
+            tick = max(int(-(-when // self.tick)), self._cursor + 1)
+            if tick - self._cursor < self.size:
+                self._buckets[tick % self.size].append((tick, item))
+                self._count += 1
+            else:
+                self._overflow.append((tick, item))
+
+    def pop_due(self, now: float) -> List[Any]:
+        """Advance the wheel to ``now`` and return every item that is due."""
+        with self._lock:
+            now_tick = int(now // self.tick)
+            due: List[Any] = []
+            if now_tick <= self._cursor:
+                return due
+            steps = min(now_tick - self._cursor, self.size)
+            for offset in range(1, steps + 1):
+                bucket = self._buckets[(self._cursor + offset) % self.size]
+                if bucket:
+                    due.extend(item for _, item in bucket)
+                    self._count -= len(bucket)
+                    bucket.clear()
+            self._cursor = now_tick
+            if self._overflow:
+                later = []
+                for tick, item in self._overflow:
+                    if tick <= now_tick:
+                        due.append(item)
+                    elif tick - now_tick < self.size:
+                        self._buckets[tick % self.size].append((tick, item))
+                        self._count += 1
+                    else:
+                        later.append((tick, item))
+                self._overflow = later
+            return due
+
+    def next_due(self) -> Optional[float]:
+        """Time of the earliest pending timer, or ``None`` if there is none."""
+        with self._lock:
+            if self._count:
+                for offset in range(1, self.size + 1):
+                    if self._buckets[(self._cursor + offset) % self.size]:
+                        return (self._cursor + offset) * self.tick
+            if self._overflow:
+                return min(tick for tick, _ in self._overflow) * self.tick
+            return None
@@ -0,0 +1,362 @@
+"""
+Waitlist matcher: hands freed slots to the best waiting patient.
+
+Unfulfilled ``waitlist_request`` rows are held in memory in heaps ordered by
+priority (highest first) and then by request time. A request with a bounded
+window sits in one heap per UTC day it covers. Open-ended windows, and windows
+longer than ``WAITLIST_MAX_WINDOW_DAYS``, sit in one shared "anytime" heap.
+Matching a slot therefore looks at the top of two heaps: the slot's day and
+"anytime". Requests whose window covers the day but not the slot's hours are
+skipped over and pushed back, so a match is O(log n) in the usual case.
+
+Matches found in one pass are written together in a single statement:
+- the slots are locked and marked ``reserved``;
+- the requests get ``fulfilled_slot``, ``fulfilled_at`` and a
+  ``hold_expires_at`` ``WAITLIST_HOLD_MINUTES`` ahead;
+- a WhatsApp ``waitlist_offer`` is queued in ``notification_outbox``.
+
+The patient takes the slot with :func:`accept_offer`, which books it. Holds
+nobody accepted in time are released by :func:`release_expired_holds`: the
+slot goes back to ``free``, and the slot index's next refresh offers it to
+the next waiting patient.
+"""
+
+import heapq
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+from . import metrics
+from .models.models import SessionLocal
+from .reminders import reminder_service
+from .scheduler import FreeSlot, slot_index
+from .secure_storage import to_e164
+from .utils.utils import logger
+
+MAX_WINDOW_DAYS = config("WAITLIST_MAX_WINDOW_DAYS", default=31, cast=int)
+RELOAD_SECONDS = config("WAITLIST_RELOAD_SECONDS", default=300.0, cast=float)
+HOLD_MINUTES = config("WAITLIST_HOLD_MINUTES", default=30, cast=int)
+OFFER_TEMPLATE = "waitlist_offer"
+
+
+@dataclass(order=True)
+class WaitlistEntry:
+    sort_key: Tuple[int, datetime]
+    request_id: str = field(compare=False)
+    patient_id: str = field(compare=False)
+    desired_from: Optional[datetime] = field(default=None, compare=False)
+    desired_to: Optional[datetime] = field(default=None, compare=False)
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "WaitlistEntry":
+        request_id, patient_id, desired_from, desired_to, priority, requested_at = row
+        return cls((-priority, requested_at), request_id, patient_id, desired_from, desired_to)
+
+    def covers(self, slot: FreeSlot) -> bool:
+        return (self.desired_from is None or self.desired_from <= slot.start_time) and (
+            self.desired_to is None or slot.end_time <= self.desired_to
+        )
+
+    def days(self) -> Optional[List[date]]:
+        """UTC days the window spans, or ``None`` for the "anytime" heap."""
+        if self.desired_from is None or self.desired_to is None:
+            return None
+        first = self.desired_from.astimezone(timezone.utc).date()
+        last = self.desired_to.astimezone(timezone.utc).date()
+        if (last - first).days >= MAX_WINDOW_DAYS:
+            return None
+        return [first + timedelta(days=n) for n in range((last - first).days + 1)]
+
+
+_LOAD_SQL = text(
+    """
+    SELECT request_id::text, patient_id::text, desired_from, desired_to, priority, requested_at
+    FROM waitlist_request
+    WHERE fulfilled_at IS NULL AND (desired_to IS NULL OR desired_to > now())
+    """
+)
+
+_FULFIL_SQL = text(
+    """
+    WITH matched AS (
+        SELECT *
+        FROM unnest(CAST(:request_ids AS uuid[]), CAST(:slot_ids AS uuid[]))
+            AS m(request_id, slot_id)
+    ), locked AS (
+        SELECT slot_id, start_time
+        FROM slot
+        WHERE slot_id IN (SELECT slot_id FROM matched) AND status = 'free'
+        FOR UPDATE SKIP LOCKED
+    ), fulfilled AS (
+        UPDATE waitlist_request w
+        SET fulfilled_slot = m.slot_id,
+            fulfilled_at = now(),
+            hold_expires_at = now() + make_interval(mins => :hold_minutes)
+        FROM matched m
+        JOIN locked l ON l.slot_id = m.slot_id
+        WHERE w.request_id = m.request_id AND w.fulfilled_at IS NULL
+        RETURNING w.request_id, w.patient_id, m.slot_id, l.start_time, w.hold_expires_at
+    ), reserved AS (
+        UPDATE slot s
+        SET status = 'reserved'
+        FROM fulfilled f
+        WHERE s.slot_id = f.slot_id
+    )
+    INSERT INTO notification_outbox (patient_id, channel, template_name, payload_json, send_after)
+    SELECT patient_id, 'whatsapp', :template,
+           jsonb_build_object('request_id', request_id, 'slot_id', slot_id,
+                              'start_time', start_time, 'hold_expires_at', hold_expires_at),
+           now()
+    FROM fulfilled
+    RETURNING payload_json->>'request_id'
+    """
+)
+
+
+# The newest open offer of the sender is booked: the reserved slot becomes
+# busy, an appointment is created and the request is marked accepted. The
+# request row is locked first, so an expiring hold cannot free the slot at
+# the same time.
+_ACCEPT_SQL = text(
+    """
+    WITH offer AS (
+        SELECT w.request_id, w.patient_id, w.fulfilled_slot
+        FROM waitlist_request w
+        JOIN patient p ON p.patient_id = w.patient_id
+        WHERE p.phone_e164 = :phone_e164
+          AND w.accepted_at IS NULL AND w.released_at IS NULL
+          AND w.hold_expires_at > now()
+        ORDER BY w.fulfilled_at DESC
+        LIMIT 1
+        FOR UPDATE OF w
+    ), taken AS (
+        UPDATE slot s
+        SET status = 'busy'
+        FROM offer o
+        WHERE s.slot_id = o.fulfilled_slot AND s.status = 'reserved'
+        RETURNING s.slot_id, s.start_time
+    ), booked AS (
+        INSERT INTO appointment (slot_id, patient_id)
+        SELECT t.slot_id, o.patient_id FROM taken t, offer o
+        RETURNING appointment_id
+    ), accepted AS (
+        UPDATE waitlist_request w
+        SET accepted_at = now()
+        FROM offer o, taken t
+        WHERE w.request_id = o.request_id
+    )
+    SELECT b.appointment_id::text, t.start_time FROM booked b, taken t
+    """
+)
+
+_RELEASE_SQL = text(
+    """
+    WITH expired AS (
+        UPDATE waitlist_request
+        SET released_at = now()
+        WHERE hold_expires_at <= now() AND accepted_at IS NULL AND released_at IS NULL
+        RETURNING fulfilled_slot
+    )
+    UPDATE slot s
+    SET status = 'free'
+    FROM expired e
+    WHERE s.slot_id = e.fulfilled_slot AND s.status = 'reserved'
+    RETURNING s.slot_id::text
+    """
+)
+
+
+def accept_offer(sender: str, db: Session | None = None) -> Optional[Tuple[str, datetime]]:
+    """Book the slot held for ``sender``; return ``(appointment_id, start_time)``.
+
+    ``None`` if the sender has no open offer (none made, expired or taken).
+    """
+    phone = to_e164(sender)
+    if phone is None:
+        return None
+
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        booked = db.execute(_ACCEPT_SQL, {"phone_e164": phone}).one_or_none()
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if created_session:
+            db.close()
+    if booked is None:
+        return None
+    metrics.increment("waitlist_offers_accepted")
+    return booked[0], booked[1]
+
+
+def release_expired_holds(db: Session | None = None) -> List[str]:
+    """Free the slots of offers not accepted in time; return their IDs."""
+    created_session = False
+    if db is None:
+        db = SessionLocal()
+        created_session = True
+
+    try:
+        released = list(db.execute(_RELEASE_SQL).scalars())
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Error releasing expired waitlist holds: {e}")
+        return []
+    finally:
+        if created_session:
+            db.close()
+    metrics.increment("waitlist_holds_expired", len(released))
+    return released
+
+
+class WaitlistMatcher:
+    """In-memory priority index of unfulfilled waitlist requests."""
+
+    def __init__(self) -> None:
+        self._days: Dict[date, List[WaitlistEntry]] = {}
+        self._anytime: List[WaitlistEntry] = []
+        self._pending: Dict[str, WaitlistEntry] = {}
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, entry: WaitlistEntry) -> None:
+        with self._lock:
+            self._add(entry)
+
+    def _add(self, entry: WaitlistEntry) -> None:
+        if entry.request_id in self._pending:
+            return
+        self._pending[entry.request_id] = entry
+        days = entry.days()
+        if days is None:
+            heapq.heappush(self._anytime, entry)
+        for day in days or ():
+            heapq.heappush(self._days.setdefault(day, []), entry)
+
+    def remove(self, request_id: str) -> None:
+        """Forget a request; its heap entries are dropped lazily."""
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def load(self, db: Session) -> int:
+        """Rebuild from the unfulfilled rows (served by ``idx_waitlist_unfulfilled``)."""
+        rows = db.execute(_LOAD_SQL).all()
+        with self._lock:
+            self._days.clear()
+            self._anytime.clear()
+            self._pending.clear()
+            for row in rows:
+                self._add(WaitlistEntry.from_row(row))
+        self._loaded_at = time.monotonic()
+        metrics.set_gauge("waitlist_pending", len(self))
+        return len(rows)
+
+    def _best(self, heap: List[WaitlistEntry], slot: FreeSlot) -> Optional[WaitlistEntry]:
+        """Highest-priority live entry in ``heap`` whose window covers ``slot``."""
+        skipped = []
+        found = None
+        while heap:
+            entry = heap[0]
+            if self._pending.get(entry.request_id) is not entry:
+                heapq.heappop(heap)  # fulfilled or removed
+                continue
+            if entry.covers(slot):
+                found = entry
+                break
+            skipped.append(heapq.heappop(heap))
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return found
+
+    def take(self, slot: FreeSlot) -> Optional[WaitlistEntry]:
+        """Remove and return the request ``slot`` should be offered to."""
+        with self._lock:
+            day = slot.start_time.astimezone(timezone.utc).date()
+            candidates = [
+                entry
+                for entry in (
+                    self._best(self._days.get(day, []), slot),
+                    self._best(self._anytime, slot),
+                )
+                if entry is not None
+            ]
+            if not candidates:
+                return None
+            entry = min(candidates)
+            del self._pending[entry.request_id]
+            return entry
+
+    def match(self, slots: Iterable[FreeSlot], db: Session) -> List[Tuple[str, str]]:
+        """Offer freed ``slots`` to waiting patients.
+
+        Returns:
+            ``(request_id, slot_id)`` pairs that were fulfilled
+        """
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= RELOAD_SECONDS:
+            self.load(db)
+        matches = []
+        for slot in sorted(slots):
+            entry = self.take(slot)
+            if entry is not None:
+                matches.append((entry, slot))
+        if not matches:
+            return []
+
+        try:
+            fulfilled = set(
+                db.execute(
+                    _FULFIL_SQL,
+                    {
+                        "request_ids": [entry.request_id for entry, _ in matches],
+                        "slot_ids": [slot.slot_id for _, slot in matches],
+                        "template": OFFER_TEMPLATE,
+                        "hold_minutes": HOLD_MINUTES,
+                    },
+                ).scalars()
+            )
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Error fulfilling waitlist requests: {e}")
+            fulfilled = set()
+
+        result = []
+        for entry, slot in matches:
+            if entry.request_id in fulfilled:
+                slot_index.remove(slot.slot_id)
+                result.append((entry.request_id, slot.slot_id))
+            else:
+                # The slot was taken meanwhile; keep waiting for the next one
+                self.add(entry)
+        metrics.increment("waitlist_offers", len(result))
+        metrics.increment("waitlist_match_conflicts", len(matches) - len(result))
+        metrics.set_gauge("waitlist_pending", len(self))
+        return result
+
+    def on_slots_freed(self, slots: List[FreeSlot], db: Session) -> None:
+        """:attr:`SlotIndex.listeners` callback."""
+        fulfilled = self.match(slots, db)
+        if fulfilled:
+            logger.info(f"Offered {len(fulfilled)} freed slots to waitlisted patients")
+            reminder_service.notify()
+
+
+waitlist_matcher = WaitlistMatcher()
@@ -0,0 +1,105 @@
+"""
+Typed decoding of WhatsApp Cloud API webhook payloads.
+
+The envelope is described with ``TypedDict`` schemas and validated straight from
+the raw request bytes by Pydantic's compiled core, so there is no Python-level
+``json.loads`` followed by ``.get()`` walking and unknown fields (contacts,
+metadata, pricing, ...) are dropped during parsing. Most webhook traffic is
+delivery/read status callbacks that need no agent work; :func:`classify`
+recognises them with a byte scan before any parsing happens so they can be
+acknowledged immediately.
+"""
+
+import re
+from enum import Enum
+from typing import Iterator, List, NotRequired
+
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+
+
+class WebhookKind(str, Enum):
+    """What a webhook payload carries."""
+
+    MESSAGE = "message"
+    STATUS = "status"
+    OTHER = "other"
+
+
+# Match object keys only: a quoted value is followed by "," or "}", never ":".
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+_STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+
+
+def classify(body: bytes) -> WebhookKind:
+    """Classify a raw payload without parsing it."""
+    if _MESSAGES_KEY.search(body):
+        return WebhookKind.MESSAGE
+    if _STATUSES_KEY.search(body):
+        return WebhookKind.STATUS
+    return WebhookKind.OTHER
+
+
+class TextBody(TypedDict):
+    body: str
+
+
+# "from" is a keyword, hence the functional syntax
+InboundMessage = TypedDict(
+    "InboundMessage",
+    {
+        "from": str,
+        "id": NotRequired[str],
+        "timestamp": NotRequired[str],
+        "type": NotRequired[str],
+        "text": NotRequired[TextBody],
+    },
+)
+
+
+class StatusEvent(TypedDict):
+    id: str
+    status: str
+    timestamp: NotRequired[str]
+    recipient_id: NotRequired[str]
+
+
+class ChangeValue(TypedDict):
+    messages: NotRequired[List[InboundMessage]]
+    statuses: NotRequired[List[StatusEvent]]
+
+
+class Change(TypedDict):
+    value: ChangeValue
+
+
+class Entry(TypedDict):
+    changes: NotRequired[List[Change]]
+
+
+class WebhookEnvelope(TypedDict):
+    entry: NotRequired[List[Entry]]
+
+
+_envelope = TypeAdapter(WebhookEnvelope)
+
+
+def parse_webhook(body: bytes) -> WebhookEnvelope:
+    """Decode a raw webhook body.
+
+    Raises:
+        pydantic.ValidationError: If ``body`` is not a valid envelope
+    """
+    return _envelope.validate_json(body)
+
+
+def iter_messages(envelope: WebhookEnvelope) -> Iterator[InboundMessage]:
+    for entry in envelope.get("entry", ()):
+        for change in entry.get("changes", ()):
+            yield from change["value"].get("messages", ())
+
+
+def iter_statuses(envelope: WebhookEnvelope) -> Iterator[StatusEvent]:
+    for entry in envelope.get("entry", ()):
+        for change in entry.get("changes", ()):
+            yield from change["value"].get("statuses", ())
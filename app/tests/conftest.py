@@ -0,0 +1,28 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def pg_db():
+    """A session on ``TEST_DATABASE_URL`` whose commits are rolled back afterwards."""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(url)
+    with engine.connect() as probe:
+        found = probe.execute(text("SELECT to_regprocedure('pgp_sym_encrypt(text,text)')"))
+        if found.scalar() is None:
+            pytest.skip("pgcrypto is not installed")
+    connection = engine.connect()
+    outer = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        outer.rollback()
+        connection.close()
+        engine.dispose()
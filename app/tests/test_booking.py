@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services import booking
+from app.services.scheduler import SlotIndex
+
+NOW = datetime.now(timezone.utc) + timedelta(days=1)
+
+
+def make_index(count):
+    index = SlotIndex()
+    for i in range(count):
+        start = NOW + timedelta(hours=i)
+        index.apply([(f"s{i}", "dr-a", "checkup", start, start + timedelta(minutes=30), True)])
+    return index
+
+
+def fake_execute(taken, calls):
+    """Book the first candidate not in ``taken``, like the SKIP LOCKED statement."""
+
+    def execute(_db, statement, params):
+        calls.append(params.get("slot_ids"))
+        for slot_id in params.get("slot_ids") or ():
+            if slot_id not in taken:
+                taken.add(slot_id)
+                return (slot_id, f"appt-{slot_id}")
+        return None
+
+    return execute
+
+
+def test_book_next_free_retries_onto_alternates(monkeypatch):
+    index = make_index(12)
+    taken = {f"s{i}" for i in range(7)}
+    calls = []
+    monkeypatch.setattr(booking, "slot_index", index)
+    monkeypatch.setattr(booking, "_execute", fake_execute(taken, calls))
+
+    result = booking.book_next_free("patient-1", preferred="s0", after=NOW)
+
+    assert result == booking.Booking(appointment_id="appt-s7", slot_id="s7")
+    assert calls[0] == ["s0", "s1", "s2", "s3", "s4"]
+    assert calls[1] == ["s5", "s6", "s7", "s8", "s9"]
+    # Taken candidates and the booked slot are no longer offered
+    assert index.next_free(1, after=NOW)[0].slot_id == "s8"
+
+
+def test_book_next_free_falls_back_to_database_search(monkeypatch):
+    index = make_index(0)
+    calls = []
+    monkeypatch.setattr(booking, "slot_index", index)
+    monkeypatch.setattr(
+        booking, "_execute", lambda _db, _statement, params: calls.append(params) or None
+    )
+
+    assert booking.book_next_free("patient-1", after=NOW) is None
+    assert len(calls) == 1
+    assert calls[0]["patient_id"] == "patient-1"
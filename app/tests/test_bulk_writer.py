@@ -0,0 +1,73 @@
+import time
+
+from sqlalchemy import column, table
+
+from app.services import metrics
+from app.services.bulk_writer import BulkWriter
+
+events = table("events", column("id"))
+
+
+class FakeSession:
+    batches = []
+
+    def execute(self, _statement, rows):
+        FakeSession.batches.append(list(rows))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def setup_function():
+    metrics.reset()
+    FakeSession.batches = []
+
+
+def test_rows_are_written_in_batches():
+    writer = BulkWriter(events, FakeSession, flush_size=3, flush_interval=60)
+    for i in range(7):
+        writer.add({"id": i})
+    time.sleep(0.1)
+    writer.close()
+
+    assert sum(len(batch) for batch in FakeSession.batches) == 7
+    assert len(FakeSession.batches) <= 3
+    assert metrics.counter("bulk_writer.events.rows") == 7
+
+
+def test_partial_batch_flushes_after_interval():
+    writer = BulkWriter(events, FakeSession, flush_size=100, flush_interval=0.05)
+    writer.add({"id": 1})
+    time.sleep(0.3)
+
+    assert FakeSession.batches == [[{"id": 1}]]
+    writer.close()
+
+
+def test_every_partial_batch_flushes_after_interval():
+    writer = BulkWriter(events, FakeSession, flush_size=100, flush_interval=0.05)
+    writer.add({"id": 1})
+    deadline = time.monotonic() + 2
+    while len(FakeSession.batches) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # The writer is now waiting on an empty buffer; a new row must re-arm the timer
+    writer.add({"id": 2})
+    while len(FakeSession.batches) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert FakeSession.batches == [[{"id": 1}], [{"id": 2}]]
+    writer.close()
+
+
+def test_full_buffer_sheds_rows():
+    writer = BulkWriter(events, FakeSession, flush_size=100, flush_interval=60, max_buffer=2)
+    for i in range(3):
+        writer.add({"id": i})
+    writer.close()
+
+    assert metrics.counter("bulk_writer.events.dropped") == 1
@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.agents import medical_intake_agent
+from app.services import conversation_history
+from app.services.conversation_history import Turn, decode_cursor, encode_cursor
+
+
+def _turn(id_, message, response="ok"):
+    return Turn(id_, datetime(2026, 5, 1, 12, id_, tzinfo=timezone.utc), message, response)
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    turn = _turn(7, "hi")
+    assert decode_cursor(encode_cursor(turn)) == (turn.created_at, 7)
+    for bad in ("", "not-a-cursor", encode_cursor(turn)[:-3]):
+        with pytest.raises(ValueError):
+            decode_cursor(bad)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = None
+
+    def execute(self, _sql, params):
+        self.params = params
+        return FakeResult(self.rows[: params["limit"]])
+
+
+def test_page_fetches_one_extra_row_to_find_the_next_cursor():
+    rows = [
+        (i, datetime(2026, 5, 1, 12, i, tzinfo=timezone.utc), f"m{i}", "r") for i in (9, 8, 7)
+    ]
+    db = FakeDB(rows)
+    turns, cursor = conversation_history.conversation_page("+1", limit=2, db=db)
+    assert [t.id for t in turns] == [9, 8]
+    assert db.params["limit"] == 3
+    assert decode_cursor(cursor) == (rows[1][1], 8)
+
+    turns, cursor = conversation_history.conversation_page(
+        "+1", limit=2, cursor=cursor, db=FakeDB(rows[2:])
+    )
+    assert [t.id for t in turns] == [7]
+    assert cursor is None
+
+
+def test_rehydrate_skips_turns_before_a_completed_intake(monkeypatch):
+    turns = [
+        _turn(1, "old"),
+        _turn(2, "**END INTAKE**", medical_intake_agent.INTAKE_COMPLETED + "\n{}"),
+        _turn(3, "hello again", "Hi! What is your name?"),
+    ]
+    monkeypatch.setattr(medical_intake_agent, "recent_turns", lambda *_: turns)
+    assert medical_intake_agent._rehydrate("+1") == [
+        {"role": "human", "content": "hello again"},
+        {"role": "ai", "content": "Hi! What is your name?"},
+    ]
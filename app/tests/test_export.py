@@ -0,0 +1,81 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+from uuid import UUID
+
+import pytest
+
+from app.services.export import ExportResult, check_export, iter_export
+
+CREATED = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+ROWS = [
+    (1, UUID(int=1), "+1", "hi", "hello", CREATED),
+    (2, None, "+1", "bye", None, CREATED),
+    (3, None, "+2", "a,b", "c\nd", CREATED),
+]
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def keys(self):
+        return ["id", "patient_id", "sender", "message", "response", "created_at"]
+
+    def partitions(self, size):
+        size = 2  # several batches even for a handful of rows
+        for start in range(0, len(self.rows), size):
+            yield self.rows[start : start + size]
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = None
+
+    def execute(self, _sql, params):
+        self.params = params
+        return FakeResult(self.rows)
+
+
+def test_jsonl_gzip_export_records_high_water_mark():
+    result = ExportResult()
+    db = FakeDB(ROWS)
+    data = b"".join(iter_export("conversations", "jsonl", True, 10, result, db))
+    lines = gzip.decompress(data).decode().splitlines()
+    assert db.params == {"after_id": 10}
+    assert json.loads(lines[0]) == {
+        "id": 1,
+        "patient_id": "00000000-0000-0000-0000-000000000001",
+        "sender": "+1",
+        "message": "hi",
+        "response": "hello",
+        "created_at": "2026-05-01T12:00:00+00:00",
+    }
+    assert len(lines) == 3
+    assert (result.rows, result.last_id) == (3, 3)
+
+
+def test_csv_export_writes_header_once():
+    data = b"".join(iter_export("conversations", "csv", db=FakeDB(ROWS)))
+    rows = list(csv.reader(io.StringIO(data.decode())))
+    assert rows[0][0] == "id" and len(rows) == 4
+    assert rows[3][3:5] == ["a,b", "c\nd"]
+
+
+def test_parquet_export_keeps_types_across_batches():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data = b"".join(iter_export("conversations", "parquet", db=FakeDB(ROWS)))
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.num_row_groups == 2
+    table = parquet.read()
+    assert table.column("patient_id").to_pylist() == [str(UUID(int=1)), None, None]
+
+
+def test_check_export_rejects_unknown_table_and_format():
+    with pytest.raises(ValueError):
+        check_export("patient; DROP TABLE patient", "csv")
+    with pytest.raises(ValueError):
+        check_export("patients", "xml")
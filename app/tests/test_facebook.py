@@ -1,10 +1,18 @@
 import os
+import time
 
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")  # noqa: E402
 
 from fastapi.testclient import TestClient  # noqa: E402
 
-from app.main import app, get_db  # noqa: E402
+from app.main import STILL_WORKING_MESSAGE, app, get_db  # noqa: E402
+from app.services.facebook_service import chunk_reply  # noqa: E402
+from app.services.webhook_payload import (  # noqa: E402
+    WebhookKind,
+    classify,
+    iter_messages,
+    parse_webhook,
+)
 
 
 class DummyDB:
@@ -27,9 +35,10 @@ async def override_get_db():
 
 def setup_test(monkeypatch):
     app.dependency_overrides[get_db] = override_get_db
-    monkeypatch.setattr("app.main.intake_agent", lambda body: "ok")
+    monkeypatch.setattr("app.main.intake_agent", lambda *_, **__: "ok")
     monkeypatch.setattr("app.main.fb_send_message", lambda *_, **__: None)
     monkeypatch.setattr("app.main.store_conversation", lambda *_, **__: 1)
+    monkeypatch.setattr("app.main.record_statuses", lambda *_, **__: 0)
 
 
 def teardown_test():
@@ -69,3 +78,86 @@ def test_facebook_webhook(monkeypatch):
     assert response.status_code == 200
 
     teardown_test()
+
+
+def test_facebook_webhook_sends_holding_message(monkeypatch):
+    setup_test(monkeypatch)
+    sent = []
+
+    def slow_agent(*_, **__):
+        time.sleep(0.2)
+        return "ok"
+
+    monkeypatch.setattr("app.main.intake_agent", slow_agent)
+    monkeypatch.setattr("app.main.fb_send_message", lambda to, body: sent.append(body))
+    monkeypatch.setattr("app.main.TURN_REPLY_BUDGET_SECONDS", 0.01)
+    payload = {
+        "entry": [
+            {
+                "changes": [
+                    {"value": {"messages": [{"from": "123", "text": {"body": "hi"}}]}}
+                ]
+            }
+        ]
+    }
+    response = client.post("/facebook/webhook", json=payload)
+    assert response.status_code == 200
+    assert sent[0] == STILL_WORKING_MESSAGE
+
+    teardown_test()
+
+
+def test_chunk_reply_splits_at_natural_breaks():
+    pieces = ["First paragraph is here.", "\n\n", "Second one", " follows. And more"]
+    messages = list(chunk_reply(pieces, min_chars=10, max_chars=40))
+    assert messages == ["First paragraph is here.", "Second one follows.", "And more"]
+
+    long_text = ["word " * 30]
+    assert all(len(m) <= 40 for m in chunk_reply(long_text, min_chars=10, max_chars=40))
+
+
+def test_status_callback_skips_agent(monkeypatch):
+    setup_test(monkeypatch)
+
+    def fail(*_, **__):
+        raise AssertionError("agent must not run for status callbacks")
+
+    monkeypatch.setattr("app.main.intake_agent", fail)
+    recorded = []
+    monkeypatch.setattr(
+        "app.main.record_statuses", lambda statuses: recorded.extend(statuses)
+    )
+    payload = {
+        "entry": [
+            {
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "statuses": [
+                                {"id": "wamid.1", "status": "read", "recipient_id": "123"}
+                            ]
+                        },
+                    }
+                ]
+            }
+        ]
+    }
+    response = client.post("/facebook/webhook", json=payload)
+    assert response.status_code == 200
+    assert recorded == [{"id": "wamid.1", "status": "read", "recipient_id": "123"}]
+
+    teardown_test()
+
+
+def test_parse_webhook_payload():
+    body = (
+        b'{"entry": [{"changes": [{"field": "messages", "value": {"contacts": [],'
+        b' "messages": [{"from": "123", "id": "wamid.2", "type": "text", "text": {"body": "hi"}}]}}]}]}'
+    )
+    assert classify(body) is WebhookKind.MESSAGE
+    messages = list(iter_messages(parse_webhook(body)))
+    assert messages == [
+        {"from": "123", "id": "wamid.2", "type": "text", "text": {"body": "hi"}}
+    ]
+    assert classify(b'{"entry": [{"changes": [{"field": "messages"}]}]}') is WebhookKind.OTHER
@@ -0,0 +1,120 @@
+from datetime import time
+
+from app.agents import medical_intake_agent
+from app.services import faq, metrics
+from app.services.faq import Bm25Index, FaqEntry, FaqIndex, detect_language, looks_like_question
+
+ENTRIES = [
+    FaqEntry(
+        "en",
+        "Which insurance plans do you accept?",
+        "We accept Medicare, Medicaid and most Blue Cross plans.",
+    ),
+    FaqEntry("en", "Is there parking at the clinic?", "Free parking is behind the building."),
+    FaqEntry("en", "Do you offer telehealth visits?", "Yes, video visits are available."),
+    FaqEntry(
+        "es",
+        "¿Qué seguros médicos aceptan?",
+        "Aceptamos Medicare, Medicaid y la mayoría de los planes Blue Cross.",
+    ),
+    FaqEntry("es", "¿Hay estacionamiento en la clínica?", "Hay estacionamiento gratis atrás."),
+]
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+    def scalar(self):
+        return self.rows
+
+
+class FakeDB:
+    def __init__(self, fingerprint="v1"):
+        self.fingerprint = fingerprint
+        self.rows = {
+            faq._FAQ_SQL: [(e.language, e.question, e.answer) for e in ENTRIES],
+            faq._CLINIC_SQL: [("c1", "MedBot Clinic", {"text": "1 Main St"})],
+            faq._PROVIDER_SQL: [("c1", "Dr. Ada Lee", "Family medicine"), ("c1", "Dr. Bo", None)],
+            faq._HOURS_SQL: [("c1", [1, 2, 3, 4, 5], time(8), time(17), "America/Chicago")],
+        }
+
+    def execute(self, statement, params=None):
+        if statement is faq._FINGERPRINT_SQL:
+            return FakeResult(self.fingerprint)
+        return FakeResult(self.rows[statement])
+
+
+def test_bm25_answers_confident_matches_and_falls_through_otherwise():
+    index = Bm25Index([e for e in ENTRIES if e.language == "en"], "en")
+    match = index.search("Do you accept Medicaid?")
+    assert match.entry is ENTRIES[0]
+    assert match.confidence == 1.0
+    # Words the index has never seen lower the confidence
+    assert index.search("Can I get my parking validated for the MRI?").confidence < 0.6
+    assert index.search("What is the meaning of life?") is None
+
+
+def test_language_detection_and_question_gating():
+    assert detect_language("¿Dónde está la clínica?") == "es"
+    assert detect_language("Hay estacionamiento en la clinica") == "es"
+    assert detect_language("Is there parking?") == "en"
+    assert looks_like_question("Do you take Medicaid")
+    assert looks_like_question("parking?")
+    assert not looks_like_question("I don't have insurance")
+
+
+def test_load_entries_generates_clinic_facts_in_both_languages():
+    entries = faq.load_entries(FakeDB())
+    answers = {e.answer for e in entries}
+    assert "MedBot Clinic is at 1 Main St." in answers
+    assert "MedBot Clinic is open Mon–Fri 08:00–17:00 (America/Chicago)." in answers
+    assert "MedBot Clinic atiende lun–vie 08:00–17:00 (America/Chicago)." in answers
+    assert "Our providers at MedBot Clinic: Dr. Ada Lee (Family medicine), Dr. Bo." in answers
+    assert len(entries) == len(ENTRIES) + 6
+
+
+def test_index_rebuilds_only_when_the_fingerprint_changes():
+    index = FaqIndex(refresh_seconds=0)
+    db = FakeDB()
+    assert index.refresh(db)
+    assert not index.refresh(db)
+    db.fingerprint = "v2"
+    db.rows[faq._FAQ_SQL] = []
+    assert index.refresh(db)
+    assert index._indexes["en"].search("Do you offer telehealth?") is None
+
+
+def test_lookup_reports_hit_rate_and_latency(monkeypatch):
+    metrics.reset()
+    index = FaqIndex(min_confidence=0.6, refresh_seconds=3600)
+    index.build(faq.load_entries(FakeDB()))
+    monkeypatch.setattr(index, "_checked_at", float("inf"))
+
+    assert index.lookup("¿Aceptan Medicaid?").entry == ENTRIES[3]
+    assert index.lookup("Where is the clinic?").entry.answer == "MedBot Clinic is at 1 Main St."
+    assert index.lookup("Can I bring my dog to the appointment?") is None
+    assert index.lookup("I take ibuprofen for my back") is None
+
+    assert metrics.counter("faq_lookups") == 3
+    assert metrics.counter("faq_hits") == 2
+    assert metrics.gauge("faq_hit_rate") == 2 / 3
+    assert metrics.sample_count("faq_lookup_seconds") == 3
+
+
+def test_intake_agent_answers_faq_without_a_model_call(monkeypatch):
+    metrics.reset()
+    index = FaqIndex(refresh_seconds=3600)
+    index.build(ENTRIES)
+    monkeypatch.setattr(index, "_checked_at", float("inf"))
+    monkeypatch.setattr(medical_intake_agent, "faq_index", index)
+    monkeypatch.setattr(medical_intake_agent, "OPENAI_API_KEY", "")
+    monkeypatch.setitem(medical_intake_agent.user_conversations, "+1", [])
+
+    reply = medical_intake_agent.intake_agent("Is there parking?", "+1")
+    assert reply == ENTRIES[1].answer
+    assert medical_intake_agent.user_conversations["+1"][-1] == {"role": "ai", "content": reply}
+    assert metrics.counter("llm_calls_saved") == 1
@@ -0,0 +1,65 @@
+import json
+from datetime import date, datetime, timezone
+
+from app.agents.schemas.patient_form_EN import PatientHistory
+from app.services.fhir import appointment_resource, patient_resource, questionnaire_response
+from app.services.fhir_export import serialize_batch
+
+
+def _items_by_link(items):
+    return {item["linkId"]: item for item in items}
+
+
+def test_questionnaire_response_mirrors_patient_history():
+    history = PatientHistory(
+        name="Jane Doe",
+        dob=date(1990, 1, 2),
+        pre_conditions=["asthma", "hypertension"],
+        prescriptions=[{"name": "salbutamol", "dosage": "100mcg"}, {"name": "ramipril"}],
+        lifestyle={"smoke_tobacco": False, "drink_alcohol": True, "recreational_drugs": False},
+        signature="Jane Doe",
+    )
+    answers = history.model_dump(mode="json")
+    resource = questionnaire_response("i-1", "p-1", json.dumps(answers), None)
+    items = _items_by_link(resource["item"])
+
+    assert resource["subject"] == {"reference": "Patient/p-1"}
+    assert "name" not in items and "signature" not in items
+    assert items["dob"]["answer"] == [{"valueDate": "1990-01-02"}]
+    assert items["pre_conditions"]["answer"] == [
+        {"valueString": "asthma"},
+        {"valueString": "hypertension"},
+    ]
+    prescriptions = [i for i in resource["item"] if i["linkId"] == "prescriptions"]
+    assert [p["item"][0]["answer"] for p in prescriptions] == [
+        [{"valueString": "salbutamol"}],
+        [{"valueString": "ramipril"}],
+    ]
+    lifestyle = _items_by_link(items["lifestyle"]["item"])
+    assert lifestyle["lifestyle.drink_alcohol"]["answer"] == [{"valueBoolean": True}]
+    # Empty answers and sections are left out
+    assert "review_of_systems" not in items and "allergies_foods" not in items
+
+
+def test_patient_and_appointment_resources():
+    patient = patient_resource("p-1", date(1990, 1, 2), "+15550100", None, "1 Main St")
+    assert patient["birthDate"] == "1990-01-02"
+    assert patient["telecom"] == [{"system": "phone", "value": "+15550100", "use": "mobile"}]
+    assert patient["address"] == [{"text": "1 Main St"}]
+
+    start = datetime(2030, 3, 4, 9, 30, tzinfo=timezone.utc)
+    appointment = appointment_resource(
+        "a-1", "no_show", "checkup", "p-1", "s-1", "dr-1", start, start, None
+    )
+    assert appointment["status"] == "noshow"
+    assert [p["actor"]["reference"] for p in appointment["participant"]] == [
+        "Patient/p-1",
+        "Practitioner/dr-1",
+    ]
+    assert appointment["slot"] == [{"reference": "Slot/s-1"}]
+
+
+def test_serialize_batch_writes_one_resource_per_line():
+    rows = [("p-1", None, "+1", None, None), ("p-2", None, None, "a@b.c", None)]
+    lines = serialize_batch("Patient", rows).decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["p-1", "p-2"]
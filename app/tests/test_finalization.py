@@ -0,0 +1,158 @@
+import base64
+import json
+import threading
+import time
+from datetime import date
+
+import pytest
+
+from app.agents.schemas.patient_form_EN import PatientHistory
+from app.services.finalization import DONE, FAILED, FinalizationPipeline
+from app.services.phi_vault import PhiVault
+
+KEY = base64.urlsafe_b64encode(bytes(range(32))).decode()
+
+
+def _vault(directory):
+    pytest.importorskip("cryptography")
+    return PhiVault(directory, KEY, commit_window_ms=0)
+
+
+def _history():
+    return PatientHistory(name="Jane Doe", dob=date(1990, 1, 2))
+
+
+def _wait(pipeline, job, states=(DONE,), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(stage.state in states for stage in job.stages.values()):
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"stages did not settle: {job.stages}")
+
+
+def test_stages_run_concurrently_and_the_journal_is_removed(tmp_path):
+    barrier = threading.Barrier(2, timeout=2)
+    seen = []
+
+    def stage(job):
+        # Both stages must be running at once to get past the barrier
+        barrier.wait()
+        seen.append(job.history["name"])
+
+    pipeline = FinalizationPipeline(tmp_path, {"persist": stage, "pdf": stage}, workers=2)
+    job = pipeline.submit("+15550100", _history())
+    _wait(pipeline, job)
+    pipeline.close()
+
+    assert seen == ["Jane Doe", "Jane Doe"]
+    assert pipeline.status(job.intake_id) is job
+    assert pipeline.latest("+15550100") is job
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_failed_stage_is_retried_with_the_same_intake_id(tmp_path):
+    calls = []
+
+    def flaky(job):
+        calls.append(job.intake_id)
+        if len(calls) < 3:
+            raise RuntimeError("database unavailable")
+
+    pipeline = FinalizationPipeline(
+        tmp_path, {"persist": flaky, "pdf": lambda job: None}, retry_seconds=0
+    )
+    job = pipeline.submit("+15550100", _history())
+    _wait(pipeline, job)
+    pipeline.close()
+
+    assert calls == [job.intake_id] * 3
+    assert job.stages["persist"].attempts == 3
+    assert job.stages["pdf"].attempts == 1
+
+
+def test_stage_gives_up_after_max_attempts_and_can_be_retried(tmp_path):
+    broken = True
+
+    def persist(job):
+        if broken:
+            raise RuntimeError("boom")
+
+    pipeline = FinalizationPipeline(
+        tmp_path,
+        {"persist": persist, "pdf": lambda job: None},
+        max_attempts=2,
+        retry_seconds=0,
+    )
+    job = pipeline.submit("+15550100", _history())
+    _wait(pipeline, job, states=(DONE, FAILED))
+
+    assert job.stages["persist"].state == FAILED
+    assert job.stages["persist"].attempts == 2
+    assert job.stages["persist"].error == "boom"
+    # The journal stays until every stage is done
+    journal = json.loads((tmp_path / f"{job.intake_id}.json").read_text())
+    assert journal["stages"]["persist"]["state"] == FAILED
+    assert journal["stages"]["pdf"]["state"] == DONE
+
+    broken = False
+    assert pipeline.retry(job.intake_id)
+    _wait(pipeline, job)
+    pipeline.close()
+    assert not (tmp_path / f"{job.intake_id}.json").exists()
+
+
+def test_recover_resumes_only_unfinished_stages(tmp_path):
+    ran = []
+    vault = _vault(tmp_path / "vault")
+    spool = tmp_path / "spool"
+
+    def blocked(job):
+        raise RuntimeError("down")
+
+    first = FinalizationPipeline(
+        spool,
+        {"persist": blocked, "pdf": lambda job: None},
+        max_attempts=1,
+        vault=lambda: vault,
+    )
+    job = first.submit("+15550100", _history())
+    _wait(first, job, states=(DONE, FAILED))
+    first.close()
+    # The journal holds the vault reference, not the intake
+    journal = (spool / f"{job.intake_id}.json").read_text()
+    assert "Jane Doe" not in journal
+    assert json.loads(journal)["history_ref"] == job.intake_id
+
+    # A new process picks the job up from the spool
+    second = FinalizationPipeline(
+        spool,
+        {"persist": lambda job: ran.append("persist"), "pdf": lambda job: ran.append("pdf")},
+        vault=lambda: vault,
+    )
+    assert second.recover() == 1
+    recovered = second.status(job.intake_id)
+    _wait(second, recovered)
+    second.close()
+
+    assert ran == ["persist"]
+    assert recovered.history["name"] == "Jane Doe"
+    assert not list(spool.glob("*.json"))
+    assert vault.get(job.intake_id) is None
+    vault.close()
+
+
+def test_without_the_vault_the_intake_is_not_journaled(tmp_path):
+    def blocked(job):
+        raise RuntimeError("down")
+
+    first = FinalizationPipeline(
+        tmp_path, {"persist": blocked, "pdf": lambda job: None}, max_attempts=1, vault=None
+    )
+    job = first.submit("+15550100", _history())
+    _wait(first, job, states=(DONE, FAILED))
+    first.close()
+    assert "Jane Doe" not in (tmp_path / f"{job.intake_id}.json").read_text()
+
+    second = FinalizationPipeline(tmp_path, {"persist": blocked, "pdf": blocked}, vault=None)
+    assert second.recover() == 0
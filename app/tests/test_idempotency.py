@@ -0,0 +1,98 @@
+from sqlalchemy import text
+
+from app.services import idempotency, metrics
+from app.services.idempotency import (
+    RecentIds,
+    claim_message,
+    prune_processed_messages,
+    recent_messages,
+    release_message,
+)
+
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+
+class FakeDB:
+    """Mimics the processed_message primary key."""
+
+    def __init__(self):
+        self.claimed = set()
+        self.executed = 0
+
+    def execute(self, statement, params):
+        self.executed += 1
+        message_id = params["message_id"]
+        if statement is idempotency._RELEASE_SQL:
+            self.claimed.discard(message_id)
+            return FakeResult(None)
+        if message_id in self.claimed:
+            return FakeResult(None)
+        self.claimed.add(message_id)
+        return FakeResult((message_id,))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def setup_function():
+    metrics.reset()
+    recent_messages._expiry.clear()
+
+
+def test_recent_ids_is_bounded():
+    ids = RecentIds(max_size=2, ttl=60)
+    for key in ("a", "b", "c"):
+        ids.add(key)
+    assert "a" not in ids
+    assert "c" in ids
+    assert len(ids) == 2
+
+
+def test_recent_ids_expire():
+    ids = RecentIds(ttl=0)
+    ids.add("a")
+    assert "a" not in ids
+
+
+def test_duplicate_is_absorbed_without_db():
+    db = FakeDB()
+    assert claim_message("wamid.1", db) is True
+    assert claim_message("wamid.1", db) is False
+    assert db.executed == 1
+    assert metrics.counter("webhook_duplicates_absorbed_cache") == 1
+
+
+def test_duplicate_from_other_worker_is_absorbed():
+    db = FakeDB()
+    db.claimed.add("wamid.2")
+    assert claim_message("wamid.2", db) is False
+    assert metrics.counter("webhook_duplicates_absorbed_db") == 1
+
+
+def test_released_message_can_be_claimed_again():
+    db = FakeDB()
+    assert claim_message("wamid.3", db) is True
+    release_message("wamid.3", db)
+    assert "wamid.3" not in recent_messages
+    assert claim_message("wamid.3", db) is True
+
+
+def test_old_claims_are_pruned(pg_db):
+    pg_db.execute(
+        text(
+            "INSERT INTO processed_message (message_id, received_at) "
+            "VALUES ('wamid.old', now() - interval '8 days'), ('wamid.new', now())"
+        )
+    )
+    assert prune_processed_messages(days=7, db=pg_db) == 1
+    left = pg_db.execute(text("SELECT message_id FROM processed_message")).scalars().all()
+    assert "wamid.new" in left and "wamid.old" not in left
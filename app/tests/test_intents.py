@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta, timezone
+
+from app.agents import intents, medical_intake_agent
+from app.chains import schedule_chain
+from app.agents.intents import (
+    ACCEPT_OFFER,
+    AVAILABLE_TIMES,
+    CLINIC_LOCATION,
+    END_INTAKE,
+    EXIT,
+    RESEND_PDF,
+    RESET,
+    STATUS,
+    YES,
+    answer_intent,
+    match_intent,
+)
+from app.services import metrics
+from app.services.clinic_info import Clinic, format_address
+from app.services.finalization import DONE, FinalizationJob
+from app.services.scheduler import SlotIndex
+
+
+def test_match_intent_only_whole_messages():
+    assert match_intent("Restart") == (RESET, "en")
+    assert match_intent("  empezar de nuevo, por favor ") == (RESET, "es")
+    assert match_intent("exit") == (EXIT, "en")
+    assert match_intent("What's my status?") == (STATUS, "en")
+    assert match_intent("Please resend my PDF") == (RESEND_PDF, "en")
+    assert match_intent("¿Dónde está la clínica?") == (CLINIC_LOCATION, "es")
+    assert match_intent("**END INTAKE**") == (END_INTAKE, "en")
+    assert match_intent("I need to restart my medication") is None
+    assert match_intent("I have been in a stressful situation at work") is None
+    assert match_intent("") is None
+
+
+def test_reset_clears_history_and_marks_the_boundary():
+    history = [{"role": "human", "content": "Jane"}, {"role": "ai", "content": "DOB?"}]
+    confirm = answer_intent(RESET, "en", "+1", history)
+    assert intents.asks_confirmation(confirm)
+    assert len(history) == 2
+    history += [{"role": "human", "content": "restart"}, {"role": "ai", "content": confirm}]
+    reply = answer_intent(RESET, "en", "+1", history)
+    assert history == []
+    assert intents.resets_history(reply)
+    assert not intents.resets_history("What is your date of birth?")
+
+
+def test_exit_mid_intake_needs_confirmation_and_terminar_finishes():
+    history = [{"role": "ai", "content": "Do you smoke?"}]
+    assert intents.asks_confirmation(answer_intent(EXIT, "en", "+1", history))
+    assert history == [{"role": "ai", "content": "Do you smoke?"}]
+    # Without an intake in progress there is nothing to lose
+    assert answer_intent(EXIT, "en", "+1", []) == intents.REPLIES[EXIT, "en"]
+    assert match_intent("terminar") == (END_INTAKE, "es")
+    assert match_intent("quit") == (EXIT, "en")
+
+
+def test_status_counts_answers_and_end_intake_needs_the_model_mid_intake():
+    history = [
+        {"role": "human", "content": "hi"},
+        {"role": "ai", "content": "Name?"},
+        {"role": "human", "content": "Jane"},
+        {"role": "ai", "content": "DOB?"},
+    ]
+    assert "2 question(s)" in answer_intent(STATUS, "en", "+1", history)
+    assert answer_intent(END_INTAKE, "en", "+1", history) is None
+    assert "no intake in progress" in answer_intent(END_INTAKE, "en", "+1", [])
+
+
+def test_resend_pdf_uses_the_latest_job(monkeypatch):
+    job = FinalizationJob("abc", "+1", {})
+    job.stages["pdf"].state = DONE
+    monkeypatch.setattr(intents.finalization_pipeline, "latest", lambda sender: job)
+    assert answer_intent(RESEND_PDF, "en", "+1", []) == f"Your intake form: {job.pdf_path}"
+
+    retried = []
+    pending = FinalizationJob("def", "+1", {})
+    monkeypatch.setattr(intents.finalization_pipeline, "latest", lambda sender: pending)
+    monkeypatch.setattr(intents.finalization_pipeline, "retry", retried.append)
+    assert "still being generated" in answer_intent(RESEND_PDF, "en", "+1", [])
+    assert retried == ["def"]
+
+
+def test_clinic_location_reads_the_clinic_table(monkeypatch):
+    monkeypatch.setattr(intents, "clinics", lambda: [Clinic("MedBot Clinic", "1 Main St")])
+    assert answer_intent(CLINIC_LOCATION, "es", "+1", []) == "MedBot Clinic está en 1 Main St."
+    monkeypatch.setattr(intents, "clinics", lambda: [])
+    assert answer_intent(CLINIC_LOCATION, "en", "+1", []) is None
+
+
+def test_yes_books_an_open_waitlist_offer_and_otherwise_falls_through(monkeypatch):
+    assert match_intent("book it") == (ACCEPT_OFFER, "en")
+    assert match_intent("Sí, la quiero") == (ACCEPT_OFFER, "es")
+    assert match_intent("YES") == (YES, "en")
+    assert match_intent("yes I have diabetes") is None
+
+    start = datetime(2030, 3, 4, 15, 30, tzinfo=timezone.utc)
+    monkeypatch.setattr(intents, "CLINIC_TIMEZONE", timezone.utc)
+    monkeypatch.setattr(intents, "accept_offer", lambda sender: ("appt-1", start))
+    booked = "Done! Your appointment on Monday 04 March at 15:30 is booked."
+    assert answer_intent(YES, "en", "+1", []) == booked
+    offer = {"role": "ai", "content": "Good news! An earlier appointment opened up on Monday."}
+    assert answer_intent(YES, "en", "+1", [{"role": "human", "content": "hi"}, offer]) == booked
+    assert answer_intent(ACCEPT_OFFER, "en", "+1", [{"role": "ai", "content": "Age?"}]) == booked
+    # Without an open offer the model handles the message
+    monkeypatch.setattr(intents, "accept_offer", lambda sender: None)
+    assert answer_intent(ACCEPT_OFFER, "en", "+1", []) is None
+
+
+def test_yes_to_an_intake_question_does_not_book_an_open_offer(monkeypatch):
+    calls = []
+    monkeypatch.setattr(intents, "accept_offer", lambda sender: calls.append(sender))
+    history = [
+        {"role": "human", "content": "hi"},
+        {"role": "ai", "content": "Do you smoke tobacco?"},
+    ]
+    assert answer_intent(YES, "en", "+1", history) is None
+    assert answer_intent(YES, "es", "+1", history) is None
+    assert calls == []
+
+
+def test_available_times_are_offered_from_the_slot_index(monkeypatch):
+    assert match_intent("What times are available?") == (AVAILABLE_TIMES, "en")
+    assert match_intent("¿Qué horarios hay disponibles?") == (AVAILABLE_TIMES, "es")
+    assert match_intent("I am available most mornings") is None
+
+    index = SlotIndex()
+    start = datetime(2030, 3, 4, 15, 30, tzinfo=timezone.utc)
+    index.apply([("s1", "dr-a", "checkup", start, start + timedelta(minutes=30), True, start)])
+    monkeypatch.setattr(schedule_chain, "slot_index", index)
+    monkeypatch.setattr(schedule_chain, "CLINIC_TIMEZONE", timezone.utc)
+    monkeypatch.setattr(index, "ensure_fresh", lambda *_: None)
+
+    assert answer_intent(AVAILABLE_TIMES, "en", "+1", []) == (
+        "These appointment times are available:\n1. Monday 04 March, 15:30"
+    )
+    assert answer_intent(AVAILABLE_TIMES, "es", "+1", []).endswith("1. 04/03/2030 15:30")
+    index.remove("s1")
+    assert "no hay horarios" in answer_intent(AVAILABLE_TIMES, "es", "+1", [])
+
+
+def test_format_address():
+    assert format_address({"line": ["1 Main St"], "city": "Springfield", "state": "IL"}) == (
+        "1 Main St, Springfield, IL"
+    )
+    assert format_address({"text": "1 Main St"}) == "1 Main St"
+    assert format_address(None) == ""
+
+
+def test_intake_agent_answers_commands_without_a_model_call(monkeypatch):
+    metrics.reset()
+    monkeypatch.setattr(medical_intake_agent, "OPENAI_API_KEY", "")
+    monkeypatch.setitem(
+        medical_intake_agent.user_conversations, "+1", [{"role": "human", "content": "hi"}]
+    )
+    # No API key: any model call would raise
+    assert medical_intake_agent.intake_agent("restart", "+1").startswith("This will erase")
+    assert medical_intake_agent.intake_agent("restart", "+1").startswith("Your intake")
+    assert list(medical_intake_agent.intake_agent_stream("status", "+1"))[0].startswith(
+        "You have not started"
+    )
+    assert metrics.counter("llm_calls_saved") == 3
+    assert metrics.counter(f"intent_replies.{RESET}") == 2
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from app.services import metrics
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.llm_scheduler import LLMScheduler, Priority, SchedulerRejected
+
+
+def setup_function():
+    metrics.reset()
+
+
+def test_priority_order_when_saturated():
+    scheduler = LLMScheduler(initial_limit=1, max_limit=1)
+    scheduler.acquire()
+    order = []
+
+    def call(priority, name):
+        with scheduler.slot(priority):
+            order.append(name)
+
+    threads = [
+        threading.Thread(target=call, args=(Priority.GREETING, "greeting")),
+        threading.Thread(target=call, args=(Priority.RED_FLAG, "red_flag")),
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    assert scheduler.queued == 2
+
+    scheduler.release(0.01)
+    for thread in threads:
+        thread.join()
+
+    assert order == ["red_flag", "greeting"]
+    assert metrics.gauge("llm_scheduler_in_flight") == 0
+
+
+def test_aimd_limit():
+    scheduler = LLMScheduler(initial_limit=8, max_limit=16)
+    scheduler.acquire()
+    scheduler.release(0.01, throttled=True)
+    assert scheduler.limit == 4
+
+    for _ in range(8):
+        scheduler.acquire()
+        scheduler.release(0.01)
+    assert 5 < scheduler.limit < 6
+
+
+def test_full_queue_rejects():
+    scheduler = LLMScheduler(initial_limit=1, max_limit=1, max_queue=0)
+    scheduler.acquire()
+
+    with pytest.raises(SchedulerRejected):
+        scheduler.acquire()
+    assert metrics.counter("llm_scheduler_rejected") == 1
+
+
+def test_queue_wait_respects_deadline():
+    scheduler = LLMScheduler(initial_limit=1, max_limit=1)
+    scheduler.acquire()
+
+    with pytest.raises(DeadlineExceeded):
+        scheduler.acquire(deadline=Deadline.after(0.05))
+    assert scheduler.queued == 0
@@ -0,0 +1,137 @@
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from app.agents.model_router import (
+    CLARIFICATION,
+    FINAL_EXTRACTION,
+    RED_FLAG_TRIAGE,
+    SMALL_TALK,
+    ModelRouter,
+    Route,
+    classify_turn,
+)
+from app.services import metrics
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.llm_scheduler import LLMScheduler
+
+
+class FakeChat:
+    failing: set = set()
+
+    def __init__(self, model, **kwargs):
+        self.model = model
+        self.kwargs = kwargs
+
+    def invoke(self, messages):
+        if self.model in self.failing:
+            raise TimeoutError("slow model")
+        return AIMessage(
+            content=self.model,
+            usage_metadata={"input_tokens": 1000, "output_tokens": 500, "total_tokens": 1500},
+        )
+
+
+def make_router(scheduler=None, **route_kwargs):
+    route = Route(FINAL_EXTRACTION, "big", timeout=5, fallback_model="small", **route_kwargs)
+    return ModelRouter(
+        "key",
+        routes={FINAL_EXTRACTION: route},
+        prices={"big": (0.01, 0.02), "small": (0.001, 0.002)},
+        llm_factory=FakeChat,
+        scheduler=scheduler,
+    )
+
+
+def setup_function():
+    metrics.reset()
+    FakeChat.failing = set()
+
+
+def test_classify_turn():
+    history = [{"role": "human", "content": "hi"}]
+    assert classify_turn("hello") == SMALL_TALK
+    assert classify_turn("I have had a cough for a week", history) == CLARIFICATION
+    assert classify_turn("**END INTAKE**", history) == FINAL_EXTRACTION
+    assert classify_turn("I have chest pain", history) == RED_FLAG_TRIAGE
+
+
+def test_only_a_whole_message_command_ends_the_intake():
+    history = [{"role": "human", "content": "hi"}]
+    assert classify_turn("Done!", history) == FINAL_EXTRACTION
+    assert classify_turn("eso es todo", history) == FINAL_EXTRACTION
+    assert classify_turn("I'm done with my antibiotics", history) == CLARIFICATION
+    assert classify_turn("That's all I remember about the pain", history) == CLARIFICATION
+
+
+def test_route_cost_and_client_reuse():
+    router = make_router()
+
+    assert router.invoke(FINAL_EXTRACTION, []).content == "big"
+    router.invoke(FINAL_EXTRACTION, [])
+
+    assert len(router._clients) == 1
+    assert metrics.counter(f"llm_route_calls.{FINAL_EXTRACTION}") == 2
+    assert round(metrics.counter(f"llm_route_cost_usd.{FINAL_EXTRACTION}"), 6) == 0.04
+
+
+def test_fallback_on_error():
+    FakeChat.failing = {"big"}
+    router = make_router()
+
+    assert router.invoke(FINAL_EXTRACTION, []).content == "small"
+    assert metrics.counter(f"llm_route_fallbacks.{FINAL_EXTRACTION}") == 1
+
+
+def test_latency_budget_prefers_fallback():
+    router = make_router(latency_budget=1.0)
+    router._latency["big"] = 5.0
+
+    assert router.invoke(FINAL_EXTRACTION, []).content == "small"
+
+
+class SlowFirstChat(FakeChat):
+    calls = 0
+
+    def invoke(self, messages):
+        SlowFirstChat.calls += 1
+        if SlowFirstChat.calls == 1:
+            time.sleep(0.5)
+            return AIMessage(content="slow")
+        return AIMessage(content="fast")
+
+
+def test_hedged_request_wins(monkeypatch):
+    monkeypatch.setattr("app.agents.model_router.HEDGE_MIN_SAMPLES", 1)
+    SlowFirstChat.calls = 0
+    metrics.observe("llm_model_latency_seconds.big", 0.01)
+    router = make_router()
+    router._llm_factory = SlowFirstChat
+
+    assert router.invoke(FINAL_EXTRACTION, []).content == "fast"
+    assert metrics.counter(f"llm_hedges_won.{FINAL_EXTRACTION}") == 1
+
+
+def test_hedge_only_uses_spare_scheduler_slots(monkeypatch):
+    monkeypatch.setattr("app.agents.model_router.HEDGE_MIN_SAMPLES", 1)
+    SlowFirstChat.calls = 0
+    metrics.observe("llm_model_latency_seconds.big", 0.01)
+    scheduler = LLMScheduler(initial_limit=1, max_limit=1)
+    router = make_router(scheduler)
+    router._llm_factory = SlowFirstChat
+
+    assert router.invoke(FINAL_EXTRACTION, []).content == "slow"
+    assert metrics.counter(f"llm_hedges_skipped.{FINAL_EXTRACTION}") == 1
+    assert scheduler.in_flight == 0
+
+
+def test_deadline_exceeded(monkeypatch):
+    monkeypatch.setattr("app.agents.model_router.HEDGE_PERCENTILE", 0)
+    SlowFirstChat.calls = 0
+    router = make_router()
+    router._llm_factory = SlowFirstChat
+
+    with pytest.raises(DeadlineExceeded):
+        router.invoke(FINAL_EXTRACTION, [], deadline=Deadline.after(0.05))
+    assert metrics.counter(f"llm_deadline_exceeded.{FINAL_EXTRACTION}") == 1
@@ -0,0 +1,148 @@
+import base64
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from app.services import phi_vault  # noqa: E402
+from app.services.phi_vault import PhiVault  # noqa: E402
+
+KEY = base64.urlsafe_b64encode(bytes(range(32))).decode()
+
+
+def _vault(directory, **kwargs):
+    kwargs.setdefault("commit_window_ms", 0)
+    return PhiVault(directory, KEY, **kwargs)
+
+
+def _turn(i):
+    return {"sender": "+15550100", "message": f"message {i}", "response": f"reply {i}"}
+
+
+def test_records_are_encrypted_and_survive_reopening(tmp_path):
+    vault = _vault(tmp_path)
+    ref = vault.put(_turn(1))
+    assert vault.get(ref) == _turn(1)
+    vault.close()
+
+    segment = (tmp_path / "segment_000001.log").read_bytes()
+    assert b"message 1" not in segment
+
+    vault = _vault(tmp_path)
+    assert vault.get(ref) == _turn(1)
+    assert vault.get("00000000-0000-4000-8000-000000000000") is None
+    vault.close()
+
+
+def test_delete_and_overwrite(tmp_path):
+    vault = _vault(tmp_path)
+    ref = vault.put(_turn(1))
+    vault.put(_turn(2), ref=ref)
+    assert vault.get(ref) == _turn(2)
+    assert vault.delete(ref)
+    assert vault.get(ref) is None
+    assert not vault.delete(ref)
+    vault.close()
+
+
+def test_index_is_rebuilt_after_a_crash(tmp_path):
+    vault = _vault(tmp_path, segment_bytes=1024)
+    refs = [vault.put(_turn(i)) for i in range(40)]
+    vault.delete(refs[0])
+    # Simulate a crash: the index was never marked clean, and the last
+    # record was only half written
+    for fd in vault._fds.values():
+        os.close(fd)
+    last = max(tmp_path.glob("segment_*.log"))
+    with open(last, "ab") as f:
+        f.write(b"\x01" * 10)
+
+    vault = _vault(tmp_path, segment_bytes=1024)
+    assert vault.get(refs[0]) is None
+    assert [vault.get(ref) for ref in refs[1:]] == [_turn(i) for i in range(1, 40)]
+    # The torn tail was cut off and new records go after it
+    ref = vault.put(_turn(99))
+    assert vault.get(ref) == _turn(99)
+    vault.close()
+
+
+def test_compaction_keeps_live_records_and_deletes(tmp_path):
+    vault = _vault(tmp_path, segment_bytes=2048)
+    refs = [vault.put(_turn(i)) for i in range(60)]
+    for ref in refs[:50]:
+        vault.delete(ref)
+    segments = len(list(tmp_path.glob("segment_*.log")))
+
+    assert vault.compact() > 0
+    assert len(list(tmp_path.glob("segment_*.log"))) < segments
+    assert [vault.get(ref) for ref in refs[50:]] == [_turn(i) for i in range(50, 60)]
+    assert all(vault.get(ref) is None for ref in refs[:50])
+    vault.close()
+
+    # Deleted records stay deleted when the index is rebuilt from segments
+    (tmp_path / "index.bin").unlink()
+    vault = _vault(tmp_path, segment_bytes=2048)
+    assert all(vault.get(ref) is None for ref in refs[:50])
+    assert vault.get(refs[55]) == _turn(55)
+    vault.close()
+
+
+def test_concurrent_writers_share_fsyncs(tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(phi_vault.os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    vault = _vault(tmp_path, commit_window_ms=20)
+    refs = []
+
+    def write(i):
+        refs.append(vault.put(_turn(i)))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(refs) == 8
+    assert len(fsyncs) < 8
+    vault.close()
+
+
+def test_index_grows_past_its_load_factor(tmp_path, monkeypatch):
+    monkeypatch.setattr(phi_vault, "_INITIAL_CAPACITY", 8)
+    vault = _vault(tmp_path)
+    refs = [vault.put(_turn(i)) for i in range(50)]
+    assert vault._index.capacity >= 64
+    assert vault.get(refs[3]) == _turn(3)
+    vault.close()
+
+
+def test_reveal_resolves_vault_references(tmp_path, monkeypatch):
+    vault = _vault(tmp_path)
+    monkeypatch.setattr(phi_vault, "_vault", vault)
+    monkeypatch.setattr(phi_vault, "PHI_VAULT", True)
+    reference = phi_vault.REFERENCE_PREFIX + vault.put(_turn(1))
+    assert phi_vault.reveal(reference, reference) == ("message 1", "reply 1")
+    assert phi_vault.reveal("plain", "text") == ("plain", "text")
+    vault.close()
+
+
+def test_reveal_leaves_text_that_is_not_a_readable_reference(tmp_path, monkeypatch):
+    vault = _vault(tmp_path)
+    monkeypatch.setattr(phi_vault, "_vault", vault)
+    reference = phi_vault.REFERENCE_PREFIX + vault.put(_turn(1))
+    # Typed by a patient, or stored while the vault was off
+    assert phi_vault.reveal("vault: hi there", "ok") == ("vault: hi there", "ok")
+    assert phi_vault.reveal(reference, "ok") == (reference, "ok")
+
+    monkeypatch.setattr(phi_vault, "PHI_VAULT", True)
+    assert phi_vault.reveal("vault: hi there", "ok") == ("vault: hi there", "ok")
+
+    def corrupt(ref):
+        raise ValueError(f"Vault record {ref} is corrupt")
+
+    monkeypatch.setattr(vault, "get", corrupt)
+    assert phi_vault.reveal(reference, "ok") == (reference, "ok")
+    vault.close()
@@ -0,0 +1,134 @@
+from datetime import date
+
+from app.agents import medical_intake_agent, question_planner
+from app.agents.question_planner import (
+    BUNDLES,
+    draft_from_history,
+    filled_fields,
+    instructions,
+    missing_fields,
+    plan_questions,
+)
+from app.agents.schemas.patient_form_EN import PatientHistory, ReviewOfSystems
+
+
+def test_bundles_cover_every_asked_field_once():
+    fields = [f for bundle in BUNDLES for f in bundle.fields]
+    assert sorted(fields) == sorted(
+        f for f in PatientHistory.model_fields if f not in question_planner.NOT_ASKED
+    )
+    family = next(b for b in BUNDLES if b.name == "family_history")
+    assert len(family.fields) == 7
+
+
+def test_required_fields_are_planned_first():
+    draft = {"name": "Jane", "dob": "1990-01-01", "reason_for_visit": "cough"}
+    plan = plan_questions(draft, max_bundles=2)
+    assert plan.missing_required == ["phone_number"]
+    assert [b.name for b in plan.next_bundles] == ["contact", "identity"]
+    assert "phone_number" in missing_fields(draft)
+    assert "name" not in missing_fields(draft)
+
+
+def test_nested_blocks_are_missing_until_their_required_fields_are_known():
+    assert "lifestyle" in missing_fields({"lifestyle": {"smoke_tobacco": False}})
+    done = {"smoke_tobacco": False, "drink_alcohol": True, "recreational_drugs": False}
+    assert "lifestyle" not in missing_fields({"lifestyle": done})
+
+
+def test_review_of_systems_is_one_checklist():
+    draft = {f: True for b in BUNDLES if b.name != "review_of_systems" for f in b.fields}
+    text = instructions(plan_questions(draft), draft)
+    assert "Review of systems (as a checklist" in text
+    assert "fever or chills; fatigue or weakness" in text
+    assert "Still required" not in text
+
+    everything = dict(draft, review_of_systems=True)
+    assert plan_questions(everything).complete
+    assert "Every topic has been covered" in instructions(plan_questions(everything))
+
+
+def test_draft_from_history_counts_answered_questions():
+    history = [
+        {"role": "human", "content": "hi"},
+        {"role": "ai", "content": "What is your full name and date of birth?"},
+        {"role": "human", "content": "Jane Doe, 1990-01-01. Reach me at jane@example.com"},
+        {"role": "ai", "content": "Do you smoke or drink alcohol?"},
+    ]
+    draft = draft_from_history(history)
+    assert draft["name"] is True and draft["dob"] is True
+    assert draft["email_address"] == "jane@example.com"
+    # The lifestyle question is not answered yet; the date is not a phone number
+    assert "lifestyle" not in draft
+    assert "phone_number" not in draft
+
+    history.append(
+        {"role": "human", "content": "No, solo una cerveza. Mi número es 555 123 4567"}
+    )
+    draft = draft_from_history(history)
+    assert draft["lifestyle"] is True
+    assert draft["phone_number"] == "555 123 4567"
+
+
+def test_cues_outside_a_question_fill_nothing():
+    history = [
+        {"role": "human", "content": "hi"},
+        {
+            "role": "ai",
+            "content": "Hi! Before your visit we need your full name, phone number, date of "
+            "birth and reason to visit. What is your full name?",
+        },
+        {"role": "human", "content": "Jane Doe"},
+    ]
+    draft = draft_from_history(history)
+    assert draft["name"] is True
+    assert "reason_for_visit" not in draft and "dob" not in draft
+    assert plan_questions(draft).missing_required == ["dob", "phone_number", "reason_for_visit"]
+
+
+def test_required_fields_need_an_answer_that_fits():
+    history = [
+        {"role": "ai", "content": "What is your date of birth and reason for your visit?"},
+        {"role": "human", "content": "I'd rather not say"},
+    ]
+    draft = draft_from_history(history)
+    assert "dob" not in draft and "reason_for_visit" not in draft
+
+    history[-1] = {"role": "human", "content": "no"}
+    assert "reason_for_visit" not in draft_from_history(history)
+
+    history[-1] = {"role": "human", "content": "March 4, 1990. A cough that will not go away"}
+    draft = draft_from_history(history)
+    assert draft["dob"] is True and draft["reason_for_visit"] is True
+
+
+def test_spanish_questions_are_recognised():
+    history = [
+        {"role": "ai", "content": "¿Tiene alguna alergia a medicamentos o alimentos?"},
+        {"role": "human", "content": "No"},
+    ]
+    assert draft_from_history(history)["allergies_foods"] is True
+
+
+def test_filled_fields_counts_leaf_values():
+    patient = PatientHistory(
+        name="Jane",
+        dob=date(1990, 1, 1),
+        allergies_foods=["peanuts", "shellfish"],
+        review_of_systems=ReviewOfSystems(cough=True, headache=True),
+    )
+    assert filled_fields(patient) == 5
+
+
+def test_prepare_turn_adds_the_plan_before_the_patient_message(monkeypatch):
+    monkeypatch.setattr(medical_intake_agent, "OPENAI_API_KEY", "test")
+    monkeypatch.setitem(
+        medical_intake_agent.user_conversations,
+        "+1",
+        [{"role": "human", "content": "hi"}, {"role": "ai", "content": "What is your full name?"}],
+    )
+    _route, messages, _end, _bind = medical_intake_agent._prepare_turn("Jane Doe", "+1")
+    assert messages[-1].content == "Jane Doe"
+    assert messages[-2].type == "system"
+    assert messages[-2].content.startswith("INTAKE PLAN")
+    assert "phone number" in messages[-2].content
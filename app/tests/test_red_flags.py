@@ -0,0 +1,66 @@
+from app.agents.red_flags import RedFlagScreen, escalation_message, normalize, screen
+
+
+def _terms(text):
+    return [flag.term for flag in screen(text)]
+
+
+def test_normalize_strips_accents_case_and_apostrophes():
+    assert normalize("Opresión en el PECHO, ¿y tú?") == [
+        "opresion", "en", "el", "pecho", ",", "y", "tu", "?"
+    ]
+    assert normalize("I can’t breathe") == normalize("i cant breathe")
+
+
+def test_screen_matches_whole_phrases_in_both_languages():
+    assert _terms("I have CHEST PAIN since this morning") == ["chest pain"]
+    assert _terms("Me duele mucho, creo que es un infarto") == ["infarto"]
+    assert _terms("tengo dolor de pécho y no puedo respirar") == [
+        "dolor de pecho",
+        "no puedo respirar",
+    ]
+    assert _terms("I can’t breathe") == ["can't breathe"]
+    assert _terms("I had heatstroke last summer") == []
+    assert _terms("I have had a cough for a week") == []
+
+
+def test_negated_phrases_are_ignored_within_their_clause():
+    assert _terms("no chest pain") == []
+    assert _terms("I don't have trouble breathing") == []
+    assert _terms("sin dolor de pecho") == []
+    assert _terms("No, I have chest pain") == ["chest pain"]
+    assert _terms("no fever but chest pain") == ["chest pain"]
+
+
+def test_never_does_not_negate():
+    assert _terms("I have never had chest pain like this before") == ["chest pain"]
+    assert _terms("Nunca habia tenido dolor de pecho asi") == ["dolor de pecho"]
+    assert _terms("Jamás había tenido dolor de pecho así") == ["dolor de pecho"]
+
+
+def test_family_and_past_history_are_not_escalated():
+    assert _terms("My father had a stroke") == []
+    assert _terms("mom had a heart attack at 60") == []
+    assert _terms("Mi padre tuvo un infarto") == []
+    assert _terms("I had chest pain last year") == []
+    assert _terms("I had a seizure in 2015") == []
+    assert _terms("Tuve un infarto hace dos años") == []
+    # Still escalated: recent, or about the patient
+    assert _terms("I had chest pain last night") == ["chest pain"]
+    assert _terms("my wife says I can't breathe") == ["can't breathe"]
+    assert _terms("mis sintomas son dolor de pecho") == ["dolor de pecho"]
+    assert _terms("My dad had a stroke, and now I have chest pain") == ["chest pain"]
+
+
+def test_overlapping_phrases_are_all_reported():
+    custom = RedFlagScreen({"en": {"a": ("pain in the chest", "chest"), "b": ("the chest",)}})
+    assert [flag.term for flag in custom.scan("pain in the chest")] == [
+        "pain in the chest",
+        "the chest",
+        "chest",
+    ]
+
+
+def test_escalation_message_follows_the_language_of_the_match():
+    assert "emergency" in escalation_message(screen("chest pain"))
+    assert "emergencia" in escalation_message(screen("dolor de pecho"))
@@ -0,0 +1,36 @@
+from app.services.reminders import reminder_templates, render
+from app.services.timer_wheel import TimerWheel
+
+
+def test_wheel_fires_in_order_and_reports_next_deadline():
+    wheel = TimerWheel(tick=1.0, size=10, now=100.0)
+    wheel.schedule(103.2, "b")
+    wheel.schedule(101.0, "a")
+    wheel.schedule(150.0, "far")  # beyond one rotation
+    assert len(wheel) == 3
+    assert wheel.next_due() == 101.0
+    assert wheel.pop_due(100.5) == []
+    assert wheel.pop_due(101.0) == ["a"]
+    assert wheel.next_due() == 104.0
+    assert wheel.pop_due(104.0) == ["b"]
+    assert wheel.next_due() == 150.0
+    assert wheel.pop_due(149.9) == []
+    assert wheel.pop_due(150.0) == ["far"]
+    assert wheel.next_due() is None
+
+
+def test_wheel_catches_up_after_long_sleep():
+    wheel = TimerWheel(tick=1.0, size=10, now=0.0)
+    for when in (1, 5, 9, 25):
+        wheel.schedule(when, when)
+    # Past deadlines fire on the next tick
+    wheel.schedule(-5, "late")
+    assert sorted(map(str, wheel.pop_due(100.0))) == ["1", "25", "5", "9", "late"]
+    assert len(wheel) == 0
+
+
+def test_reminder_templates_and_render():
+    assert reminder_templates([24, 2.5]) == [("reminder_24h", 24), ("reminder_2.5h", 2.5)]
+    text = render("reminder_24h", {"start_time": "2030-03-04T09:30:00+00:00"})
+    assert text == "Reminder: you have an appointment on Monday 04 March at 09:30."
+    assert render("unknown", {"start_time": "2030-03-04T09:30:00+00:00"}) is None
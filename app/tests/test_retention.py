@@ -0,0 +1,70 @@
+import uuid
+from datetime import date
+
+import psycopg2
+import pytest
+
+from app.services import phi_vault, retention
+from app.services.retention import (
+    erase_vault_records,
+    partition_month,
+    retention_cutoff,
+    run_retention,
+)
+
+
+class FakeConn:
+    def __init__(self, messages):
+        self.messages = messages
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+        return [(message,) for message in self.messages]
+
+
+class FakeVault:
+    def __init__(self, refs):
+        self.refs = set(refs)
+
+    def delete(self, ref):
+        if ref not in self.refs:
+            return False
+        self.refs.remove(ref)
+        return True
+
+
+def test_partition_month_parses_only_monthly_partitions():
+    assert partition_month("conversations_p2025_03") == date(2025, 3, 1)
+    with pytest.raises(ValueError):
+        partition_month("conversations_p2025_03; DROP TABLE patient")
+    with pytest.raises(ValueError):
+        partition_month("conversations")
+
+
+def test_retention_cutoff_keeps_whole_months():
+    assert retention_cutoff(date(2026, 10, 19), months=12) == date(2025, 10, 1)
+    assert retention_cutoff(date(2026, 1, 31), months=1) == date(2025, 12, 1)
+    assert retention_cutoff(date(2026, 3, 1), months=0) == date(2026, 3, 1)
+
+
+def test_expired_turns_lose_their_vault_records(monkeypatch):
+    monkeypatch.setattr(phi_vault, "PHI_VAULT", True)
+    kept, gone = str(uuid.uuid4()), str(uuid.uuid4())
+    vault = FakeVault([kept, gone])
+    conn = FakeConn(["vault:" + gone, "vault: typed by a patient", "vault:" + str(uuid.uuid4())])
+
+    assert erase_vault_records(conn, "conversations_p2025_03", vault) == 1
+    assert vault.refs == {kept}
+    assert "FROM conversations_p2025_03" in conn.statements[0]
+    with pytest.raises(ValueError):
+        erase_vault_records(conn, "patient", vault)
+
+
+def test_run_retention_logs_driver_errors_from_the_archive_copy(monkeypatch):
+    def failed_copy(_cutoff):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(retention, "ensure_partitions", lambda: [])
+    monkeypatch.setattr(retention, "retire_partitions", failed_copy)
+    run_retention()
@@ -1,9 +1,14 @@
+import asyncio
 import os
+import threading
+
+import pytest
 
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")  # noqa: E402
 
 from fastapi.testclient import TestClient  # noqa: E402
 
+from app import main  # noqa: E402
 from app.main import app, get_db  # noqa: E402
 
 
@@ -27,7 +32,7 @@ async def override_get_db():
 
 def setup_test(monkeypatch):
     app.dependency_overrides[get_db] = override_get_db
-    monkeypatch.setattr("app.main.intake_agent", lambda body: "ok")
+    monkeypatch.setattr("app.main.intake_agent", lambda *_, **__: "ok")
     monkeypatch.setattr("app.main.fb_send_message", lambda *_, **__: None)
     monkeypatch.setattr("app.main.store_conversation", lambda *_, **__: 1)
 
@@ -44,3 +49,160 @@ def test_message_route(monkeypatch):
     )
     assert response.status_code == 200
     teardown_test()
+
+
+def test_failed_webhook_message_releases_its_claim(monkeypatch):
+    setup_test(monkeypatch)
+    released = []
+    monkeypatch.setattr("app.main.claim_message", lambda *_: True)
+    monkeypatch.setattr(
+        "app.main.release_message", lambda message_id, _db: released.append(message_id)
+    )
+
+    def broken(*_):
+        raise RuntimeError("agent crashed")
+
+    monkeypatch.setattr("app.main._reply_within_budget", broken)
+    body = (
+        b'{"entry": [{"changes": [{"field": "messages", "value": {"messages":'
+        b' [{"from": "123", "id": "wamid.9", "type": "text", "text": {"body": "hi"}}]}}]}]}'
+    )
+    with pytest.raises(RuntimeError):
+        client.post("/facebook/webhook", content=body)
+    assert released == ["wamid.9"]
+    teardown_test()
+
+
+def test_failed_late_reply_still_answers_the_patient(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, "_store_and_send", lambda *args: sent.append(args))
+
+    async def late():
+        pending = asyncio.get_running_loop().create_future()
+        pending.set_exception(RuntimeError("agent crashed"))
+        await main._finish_late_reply("+123", "hi", pending)
+
+    asyncio.run(late())
+    assert sent == [("+123", "hi", main.ERROR_MESSAGE)]
+
+
+def test_failed_stream_still_answers_and_stores_the_turn(monkeypatch):
+    sent, stored = [], []
+
+    def broken_stream(*_, **__):
+        yield "Thanks, Jane. "
+        raise RuntimeError("OPENAI_API_KEY is not configured")
+
+    monkeypatch.setattr(main, "intake_agent_stream", broken_stream)
+    monkeypatch.setattr(main, "fb_send_message", lambda to, text: sent.append(text))
+    monkeypatch.setattr(main, "store_conversation", lambda *args: stored.append(args) or 1)
+
+    main._stream_and_send("+123", "hi", main.Deadline.after(5), threading.Event())
+    reply = "".join(sent)
+    assert reply.startswith("Thanks, Jane.")
+    assert reply.endswith(main.ERROR_MESSAGE)
+    assert stored == [("+123", "hi", f"Thanks, Jane. \n\n{main.ERROR_MESSAGE}")]
+
+
+def test_maintenance_keeps_running_after_a_failed_step(monkeypatch):
+    pruned, generated = [], []
+
+    def broken():
+        raise RuntimeError("archive failed")
+
+    monkeypatch.setattr(main, "run_retention", broken)
+    monkeypatch.setattr(main, "prune_processed_messages", lambda: pruned.append(1))
+    monkeypatch.setattr(main, "run_slot_generation", lambda: generated.append(1))
+    monkeypatch.setattr(main, "MAINTENANCE_INTERVAL_SECONDS", 0)
+
+    async def run():
+        task = asyncio.create_task(main._maintain_conversations())
+        while len(generated) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert len(pruned) >= 2
+
+
+def test_red_flag_message_is_escalated_before_the_agent_reply(monkeypatch):
+    setup_test(monkeypatch)
+    sent = []
+    monkeypatch.setattr("app.main.fb_send_message", lambda to, text: sent.append(text))
+    response = client.post(
+        "/message",
+        data={"From": "whatsapp:+123", "Body": "Tengo dolor de pecho"},
+    )
+    assert response.status_code == 200
+    assert len(sent) == 2
+    assert "emergencia" in sent[0]
+    assert sent[1] == "ok"
+    teardown_test()
+
+
+def test_local_test_stream_route(monkeypatch):
+    setup_test(monkeypatch)
+    stored = []
+    monkeypatch.setattr(
+        "app.main.intake_agent_stream", lambda *_, **__: iter(["Hello", " there"])
+    )
+    monkeypatch.setattr(
+        "app.main.store_conversation", lambda *args, **__: stored.append(args) or 1
+    )
+    response = client.post("/local_test/stream", data={"message": "hi"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert 'event: token\ndata: "Hello"' in response.text
+    assert 'event: done\ndata: "Hello there"' in response.text
+    assert stored[0][2] == "Hello there"
+    teardown_test()
+
+
+def test_conversations_route_pages_and_rejects_bad_cursor(monkeypatch):
+    setup_test(monkeypatch)
+    calls = []
+
+    def page(sender, limit, cursor, db):
+        calls.append((sender, limit, cursor))
+        if cursor == "bad":
+            raise ValueError("Invalid cursor")
+        return [], "next"
+
+    monkeypatch.setattr("app.main.conversation_page", page)
+    monkeypatch.setattr("app.main.STAFF_API_KEY", "staff-key")
+    staff = {"X-API-Key": "staff-key"}
+    response = client.get("/conversations/+123", params={"limit": 10}, headers=staff)
+    assert response.json() == {"items": [], "next_cursor": "next"}
+    assert calls == [("+123", 10, None)]
+    bad = client.get("/conversations/+123", params={"cursor": "bad"}, headers=staff)
+    assert bad.status_code == 400
+    zero = client.get("/conversations/+123", params={"limit": 0}, headers=staff)
+    assert zero.status_code == 422
+    teardown_test()
+
+
+def test_conversations_route_requires_the_staff_key(monkeypatch):
+    setup_test(monkeypatch)
+    monkeypatch.setattr("app.main.conversation_page", lambda *_: ([], None))
+    monkeypatch.setattr("app.main.STAFF_API_KEY", "staff-key")
+    assert client.get("/conversations/+123").status_code == 401
+    assert client.get("/conversations/+123", headers={"X-API-Key": "nope"}).status_code == 401
+    monkeypatch.setattr("app.main.STAFF_API_KEY", "")
+    assert client.get("/conversations/+123", headers={"X-API-Key": ""}).status_code == 503
+    teardown_test()
+
+
+def test_export_route_streams_and_validates(monkeypatch):
+    monkeypatch.setattr(
+        "app.main.iter_export", lambda table, fmt, gz, after_id: iter([b"a", b"b"])
+    )
+    monkeypatch.setattr("app.main.STAFF_API_KEY", "staff-key")
+    staff = {"X-API-Key": "staff-key"}
+    response = client.get(
+        "/export/conversations", params={"format": "csv", "gzip": True}, headers=staff
+    )
+    assert response.content == b"ab"
+    assert response.headers["content-type"] == "application/gzip"
+    assert "conversations.csv.gz" in response.headers["content-disposition"]
+    assert client.get("/export/secrets", headers=staff).status_code == 400
+    assert client.get("/export/patients").status_code == 401
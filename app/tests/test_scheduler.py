@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.scheduler import FreeSlot, SlotIndex
+
+NOW = datetime(2030, 1, 7, 9, 0, tzinfo=timezone.utc)
+
+
+def row(slot_id, provider, start_hours, free=True, service="checkup", minutes=30):
+    start = NOW + timedelta(hours=start_hours)
+    return (slot_id, provider, service, start, start + timedelta(minutes=minutes), free, NOW)
+
+
+def build():
+    index = SlotIndex()
+    index.apply(
+        [
+            row("a1", "dr-a", 1),
+            row("a2", "dr-a", 3),
+            row("b1", "dr-b", 2),
+            row("b2", "dr-b", 4, service="vaccine"),
+            row("b3", "dr-b", 5, minutes=60),
+        ]
+    )
+    return index
+
+
+def ids(slots):
+    return [slot.slot_id for slot in slots]
+
+
+def test_next_free_merges_providers_in_start_order():
+    index = build()
+    assert ids(index.next_free(4, after=NOW)) == ["a1", "b1", "a2", "b2"]
+
+
+def test_next_free_filters():
+    index = build()
+    assert ids(index.next_free(5, after=NOW, provider_id="dr-b", service_type="checkup")) == [
+        "b1",
+        "b3",
+    ]
+    assert ids(index.next_free(5, after=NOW + timedelta(hours=2, minutes=30))) == [
+        "a2",
+        "b2",
+        "b3",
+    ]
+    assert ids(index.next_free(5, after=NOW, before=NOW + timedelta(hours=3))) == ["a1", "b1"]
+    assert ids(index.next_free(5, after=NOW, min_duration=timedelta(minutes=45))) == ["b3"]
+
+
+def test_changed_rows_update_index():
+    index = build()
+    index.apply([row("a1", "dr-a", 1, free=False), row("c1", "dr-c", 0.5)])
+    assert "a1" not in index
+    assert ids(index.next_free(2, after=NOW)) == ["c1", "b1"]
+
+    # A free slot moved to a new time is re-sorted, not duplicated
+    index.apply([row("c1", "dr-c", 6)])
+    assert ids(index.next_free(10, after=NOW))[-1] == "c1"
+    assert len(index) == 5
+
+
+def test_prune_drops_started_slots():
+    index = build()
+    index.prune(NOW + timedelta(hours=3))
+    assert sorted(ids(index.next_free(10, after=NOW))) == ["a2", "b2", "b3"]
+    assert isinstance(index.next_free(1, after=NOW)[0], FreeSlot)
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, _statement, _params=None):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+def test_full_reload_reports_newly_free_slots():
+    index = SlotIndex()
+    seen = []
+    index.listeners.append(lambda slots, _db: seen.append(ids(slots)))
+
+    index.load(FakeDB([row("a1", "dr-a", 1), row("a2", "dr-a", 3)]))
+    assert seen == []  # the first load frees nothing
+
+    index.load(FakeDB([row("a2", "dr-a", 3), row("b1", "dr-b", 2)]))
+    assert seen == [["b1"]]
+    index.load(FakeDB([row("a2", "dr-a", 3), row("b1", "dr-b", 2)]))
+    assert seen == [["b1"]]
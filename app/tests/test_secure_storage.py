@@ -0,0 +1,93 @@
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+from app.agents.schemas.patient_form_EN import PatientHistory
+from app.services import secure_storage
+
+
+class FakeResult:
+    def one(self):
+        return "patient-1", "intake-1"
+
+
+class FakeDB:
+    def __init__(self):
+        self.params = None
+        self.committed = False
+
+    def execute(self, _sql, params):
+        self.params = params
+        return FakeResult()
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+def test_finalize_intake_is_one_statement(monkeypatch):
+    monkeypatch.setattr(secure_storage, "PHI_ENCRYPTION_KEY", "secret")
+    history = PatientHistory(name="Jane Doe", dob=date(1990, 1, 2), signature="JD")
+    db = FakeDB()
+    assert secure_storage.finalize_intake("+15550100", history, db) == ("patient-1", "intake-1")
+    assert db.committed
+    # The name goes to pgcrypto only; the answers keep neither name nor signature
+    assert db.params["full_name"] == "Jane Doe"
+    assert db.params["phone_e164"] == "+15550100"
+    assert db.params["contact_phone"] is None
+    answers = json.loads(db.params["answers"])
+    assert "name" not in answers and "signature" not in answers
+    assert answers["dob"] == "1990-01-02"
+    assert db.params["intake_id"]
+
+
+def test_finalize_intake_reuses_the_given_intake_id(monkeypatch):
+    monkeypatch.setattr(secure_storage, "PHI_ENCRYPTION_KEY", "secret")
+    history = PatientHistory(name="A", dob=date(1990, 1, 2))
+    db = FakeDB()
+    secure_storage.finalize_intake("+1", history, db, intake_id="9f0c")
+    assert db.params["intake_id"] == "9f0c"
+
+
+def test_finalize_intake_requires_a_key(monkeypatch):
+    monkeypatch.setattr(secure_storage, "PHI_ENCRYPTION_KEY", "")
+    history = PatientHistory(name="A", dob=date(1990, 1, 2))
+    with pytest.raises(RuntimeError):
+        secure_storage.finalize_intake("+1", history, FakeDB())
+
+
+def test_to_e164():
+    assert secure_storage.to_e164("15550100123") == "+15550100123"
+    assert secure_storage.to_e164("+1 (555) 010-0123") == "+15550100123"
+    assert secure_storage.to_e164("abc") is None
+    assert secure_storage.to_e164("12345678901234567") is None
+
+
+def test_finalize_intake_against_postgres(monkeypatch, pg_db):
+    monkeypatch.setattr(secure_storage, "PHI_ENCRYPTION_KEY", "secret")
+    first = PatientHistory(
+        name="Jane Doe", dob=date(1990, 1, 2), phone_number="555-0100", email_address="j@x.org"
+    )
+    patient_id, _ = secure_storage.finalize_intake("15550100123", first, pg_db)
+
+    # Same WhatsApp sender, another typed number: the same patient is updated
+    again = first.model_copy(update={"phone_number": "555-0199"})
+    assert secure_storage.finalize_intake("15550100123", again, pg_db)[0] == patient_id
+
+    # Another sender typing the first patient's number and email is a new patient
+    other = PatientHistory(
+        name="John Roe", dob=date(1985, 5, 6), phone_number="555-0199", email_address="j@x.org"
+    )
+    other_id, _ = secure_storage.finalize_intake("15550100456", other, pg_db)
+    assert other_id != patient_id
+
+    rows = dict(
+        pg_db.execute(
+            text("SELECT phone_e164, (contact_phone, email)::text FROM patient")
+        ).all()
+    )
+    assert rows == {"+15550100123": "(555-0199,j@x.org)", "+15550100456": "(555-0199,)"}
@@ -0,0 +1,127 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+from app.agents import medical_intake_agent
+from app.agents.structured_output import (
+    IntakeValidationError,
+    complete_intake,
+    is_submission,
+)
+from app.services import metrics
+
+VALID = {
+    "name": "Ana Perez",
+    "dob": "1990-04-02",
+    "phone_number": "+15550100",
+    "reason_for_visit": "Headache",
+}
+
+
+def tool_reply(arguments: dict | str, call_id: str = "call_1") -> AIMessage:
+    raw = arguments if isinstance(arguments, str) else json.dumps(arguments)
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_calls": [
+                {
+                    "id": call_id,
+                    "type": "function",
+                    "function": {"name": "PatientHistory", "arguments": raw},
+                }
+            ]
+        },
+    )
+
+
+class FakeLLM:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    def invoke(self, messages):
+        self.calls.append(list(messages))
+        return self.replies.pop(0)
+
+
+def setup_function():
+    metrics.reset()
+
+
+def test_valid_submission_needs_no_extra_call():
+    llm = FakeLLM([])
+    result = tool_reply(VALID)
+    assert is_submission(result)
+
+    patient = complete_intake(llm, [HumanMessage(content="done")], result)
+
+    assert patient.dob.isoformat() == "1990-04-02"
+    assert llm.calls == []
+    assert metrics.counter("intake_validation_retries_avoided") == 0
+
+
+def test_invalid_submission_is_repaired_in_turn():
+    llm = FakeLLM([tool_reply(VALID, call_id="call_2")])
+    result = tool_reply({**VALID, "dob": "02/04/1990"})
+
+    patient = complete_intake(llm, [HumanMessage(content="done")], result)
+
+    assert patient.name == "Ana Perez"
+    feedback = llm.calls[0][-1]
+    assert isinstance(feedback, ToolMessage)
+    assert feedback.tool_call_id == "call_1"
+    assert "dob" in feedback.content
+    assert metrics.counter("intake_validation_retries_avoided") == 1
+
+
+def test_legacy_text_json_is_validated():
+    result = AIMessage(content=f"Here you go: {json.dumps(VALID)}")
+
+    patient = complete_intake(FakeLLM([]), [], result)
+
+    assert patient.reason_for_visit == "Headache"
+
+
+def test_repairs_are_bounded():
+    bad = tool_reply({"name": "Ana"})
+    llm = FakeLLM([bad, bad])
+
+    with pytest.raises(IntakeValidationError):
+        complete_intake(llm, [], bad, max_repairs=2)
+
+    assert len(llm.calls) == 2
+    assert metrics.counter("intake_validation_failures") == 1
+
+
+class FakeStreamRouter:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def stream(self, route, messages, bind=None, deadline=None):
+        return iter(self.chunks)
+
+    def llm(self, route, bind=None, deadline=None):
+        return FakeLLM([])
+
+
+def test_stream_yields_the_completion_after_streamed_prose(monkeypatch):
+    call = tool_reply(VALID)
+    chunks = [
+        AIMessageChunk(content="Thanks, Ana. "),
+        AIMessageChunk(content="Submitting your form now."),
+        AIMessageChunk(content="", additional_kwargs=call.additional_kwargs),
+    ]
+    job = SimpleNamespace(intake_id="intake-1", pdf_path="/tmp/intake-1.pdf")
+    monkeypatch.setattr(medical_intake_agent, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(medical_intake_agent, "STRUCTURED_OUTPUT", True)
+    monkeypatch.setattr(medical_intake_agent, "get_router", lambda: FakeStreamRouter(chunks))
+    monkeypatch.setattr(medical_intake_agent.finalization_pipeline, "submit", lambda *_: job)
+    monkeypatch.setitem(medical_intake_agent.user_conversations, "+1", [])
+
+    pieces = list(medical_intake_agent.intake_agent_stream("It started yesterday", "+1"))
+    assert pieces[:2] == ["Thanks, Ana. ", "Submitting your form now."]
+    assert pieces[2].startswith("\n\n" + medical_intake_agent.INTAKE_COMPLETED)
+    assert "Intake reference: intake-1" in pieces[2]
+    assert medical_intake_agent.user_conversations["+1"] == []
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.services import waitlist
+from app.services.scheduler import FreeSlot
+from app.services.waitlist import WaitlistEntry, WaitlistMatcher
+
+DAY = datetime(2030, 3, 4, tzinfo=timezone.utc)
+
+
+def entry(request_id, priority=0, start_hours=None, end_hours=None, requested_minutes=0):
+    return WaitlistEntry.from_row(
+        (
+            request_id,
+            f"patient-{request_id}",
+            DAY + timedelta(hours=start_hours) if start_hours is not None else None,
+            DAY + timedelta(hours=end_hours) if end_hours is not None else None,
+            priority,
+            DAY - timedelta(days=1) + timedelta(minutes=requested_minutes),
+        )
+    )
+
+
+def slot(hour, slot_id="slot"):
+    start = DAY + timedelta(hours=hour)
+    return FreeSlot(start, start + timedelta(minutes=30), slot_id, "dr-a")
+
+
+def test_highest_priority_then_oldest_request_wins():
+    matcher = WaitlistMatcher()
+    matcher.add(entry("late", priority=1, requested_minutes=10))
+    matcher.add(entry("early", priority=1, requested_minutes=5))
+    matcher.add(entry("low", priority=0))
+    assert matcher.take(slot(10)).request_id == "early"
+    assert matcher.take(slot(10)).request_id == "late"
+    assert matcher.take(slot(10)).request_id == "low"
+    assert matcher.take(slot(10)) is None
+
+
+def test_window_must_cover_slot():
+    matcher = WaitlistMatcher()
+    matcher.add(entry("afternoon", priority=5, start_hours=14, end_hours=18))
+    matcher.add(entry("next-day", priority=5, start_hours=24, end_hours=30))
+    matcher.add(entry("morning", start_hours=8, end_hours=12))
+    assert matcher.take(slot(9)).request_id == "morning"
+    assert matcher.take(slot(11)) is None
+    # The skipped afternoon request is still waiting
+    assert matcher.take(slot(15)).request_id == "afternoon"
+    assert matcher.take(slot(25)).request_id == "next-day"
+
+
+def test_multi_day_window_is_matched_once():
+    matcher = WaitlistMatcher()
+    matcher.add(entry("week", start_hours=0, end_hours=24 * 7))
+    assert matcher.take(slot(50)).request_id == "week"
+    assert matcher.take(slot(100)) is None
+    assert len(matcher) == 0
+
+
+def _offer(db, phone, hold_minutes):
+    """A patient with a waitlist request holding a reserved slot."""
+    patient_id = db.execute(
+        text(
+            "INSERT INTO patient (full_name, phone_e164) "
+            "VALUES (pgp_sym_encrypt('P', 'k'), :phone) RETURNING patient_id"
+        ),
+        {"phone": phone},
+    ).scalar()
+    slot_id = db.execute(
+        text(
+            "INSERT INTO slot (start_time, end_time, status) "
+            "VALUES (now() + interval '1 day', now() + interval '1 day 30 min', 'reserved') "
+            "RETURNING slot_id"
+        )
+    ).scalar()
+    db.execute(
+        text(
+            "INSERT INTO waitlist_request (patient_id, fulfilled_slot, fulfilled_at, "
+            "hold_expires_at) VALUES (:patient, :slot, now(), now() + make_interval(mins => :m))"
+        ),
+        {"patient": patient_id, "slot": slot_id, "m": hold_minutes},
+    )
+    return slot_id
+
+
+def _slot_status(db, slot_id):
+    return db.execute(text("SELECT status FROM slot WHERE slot_id = :s"), {"s": slot_id}).scalar()
+
+
+def test_accepting_an_offer_books_the_slot(pg_db):
+    slot_id = _offer(pg_db, "+15550100001", hold_minutes=30)
+    booked = waitlist.accept_offer("15550100001", pg_db)
+    assert booked is not None
+    assert _slot_status(pg_db, slot_id) == "busy"
+    # Accepted once; a second YES finds no open offer and nothing expires
+    assert waitlist.accept_offer("15550100001", pg_db) is None
+    assert waitlist.release_expired_holds(pg_db) == []
+
+
+def test_expired_holds_free_their_slot(pg_db):
+    slot_id = _offer(pg_db, "+15550100002", hold_minutes=-1)
+    assert waitlist.accept_offer("15550100002", pg_db) is None
+    assert waitlist.release_expired_holds(pg_db) == [str(slot_id)]
+    assert _slot_status(pg_db, slot_id) == "free"
+    assert waitlist.release_expired_holds(pg_db) == []
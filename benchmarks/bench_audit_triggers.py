@@ -0,0 +1,83 @@
+"""
+Bulk-update throughput with row-level vs. statement-level audit triggers.
+
+Two scratch copies of ``appointment`` are created. One is audited by a
+``FOR EACH ROW`` trigger, which runs one ``audit_log`` insert per changed row
+(the original design, with its record-ID lookup fixed so it runs). The other
+uses the schema's ``fn_audit_trigger``, which runs once per statement over
+transition tables. Both get the same bulk ``UPDATE``s; a copy without any
+trigger shows the floor.
+
+Run against a scratch database (``DATABASE_URL``) with the schema loaded::
+
+    python -m benchmarks.bench_audit_triggers
+"""
+
+import time
+
+from sqlalchemy import text
+
+from app.services.models.models import engine
+
+ROWS = 50_000
+ROUNDS = 3
+
+_ROW_FUNCTION = """
+CREATE OR REPLACE FUNCTION pg_temp.bench_audit_row() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO audit_log(table_name, record_id, action, diff_json)
+    SELECT TG_TABLE_NAME, NEW.appointment_id, 'UPDATE', jsonb_object_agg(e.key, e.value)
+    FROM jsonb_each(to_jsonb(NEW)) e
+    WHERE to_jsonb(OLD) -> e.key IS DISTINCT FROM e.value;
+    RETURN NEW;
+END; $$
+"""
+
+_TRIGGERS = {
+    "no trigger": None,
+    "row level": """CREATE TRIGGER audit AFTER UPDATE ON {table}
+                    FOR EACH ROW EXECUTE FUNCTION pg_temp.bench_audit_row()""",
+    "statement": """CREATE TRIGGER audit AFTER UPDATE ON {table}
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('appointment_id')""",
+}
+
+
+def main() -> None:
+    with engine.connect() as conn:
+        conn.execute(text(_ROW_FUNCTION))
+        for name, trigger in _TRIGGERS.items():
+            table = "bench_" + name.replace(" ", "_")
+            conn.execute(text(f"CREATE TEMP TABLE {table} (LIKE appointment INCLUDING DEFAULTS)"))
+            conn.execute(
+                text(
+                    f"""INSERT INTO {table} (appointment_id, reason_code)
+                        SELECT uuid_generate_v4(), 'bench' FROM generate_series(1, :rows)"""
+                ),
+                {"rows": ROWS},
+            )
+            if trigger:
+                conn.execute(text(trigger.format(table=table)))
+            conn.commit()
+
+            elapsed = 0.0
+            for round_ in range(ROUNDS):
+                started = time.perf_counter()
+                conn.execute(
+                    text(f"UPDATE {table} SET status = :status, updated_at = now()"),
+                    {"status": ("checked_in", "fulfilled", "booked")[round_ % 3]},
+                )
+                conn.commit()
+                elapsed += time.perf_counter() - started
+            print(
+                f"{name:11} {ROWS * ROUNDS / elapsed:10.0f} rows/s "
+                f"({elapsed / ROUNDS * 1000:7.1f} ms per {ROWS}-row UPDATE)"
+            )
+            conn.execute(text(f"DROP TABLE {table}"))
+            conn.execute(text("DELETE FROM audit_log WHERE table_name = :t"), {"t": table})
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Bookings per second when many patients race for the same clinic day.
+
+Every worker wants the earliest free slot. The baseline is the usual
+read-then-write booking: read the earliest free slot, claim it with a
+conditional ``UPDATE`` and retry when another patient got there first. The
+contention-safe path is :func:`app.services.booking.book_first_free`, a single
+``SKIP LOCKED`` statement. After each run the benchmark checks that no slot
+was booked twice.
+
+Run against a scratch database (``DATABASE_URL``) with the schema loaded::
+
+    python -m benchmarks.bench_booking_contention
+"""
+
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.services.booking import book_first_free
+from app.services.models.models import DATABASE_URL
+
+WORKERS = 32
+SLOTS = 2_000
+
+# One connection per worker so the pool itself is not the bottleneck
+engine = create_engine(DATABASE_URL, pool_size=WORKERS)
+Session = sessionmaker(bind=engine)
+
+_SETUP = [
+    "INSERT INTO clinic (clinic_id, name, address_json) VALUES (:clinic, 'Bench clinic', '{}')",
+    """INSERT INTO provider (provider_id, clinic_id, npi_number, display_name)
+       VALUES (:provider, :clinic, :npi, 'Dr Bench')""",
+    """INSERT INTO schedule (schedule_id, provider_id, service_type, period_start, period_end)
+       VALUES (:schedule, :provider, 'bench', now(), now() + interval '1 year')""",
+    """INSERT INTO slot (schedule_id, start_time, end_time, status, service_type)
+       SELECT :schedule, t, t + interval '15 minutes', 'free', 'bench'
+       FROM generate_series(now() + interval '1 day', now() + interval '1 day'
+                            + (:slots - 1) * interval '15 minutes', interval '15 minutes') t""",
+    "INSERT INTO patient (patient_id, phone_e164) VALUES (:patient, :phone)",
+]
+_TEARDOWN = [
+    """DELETE FROM appointment WHERE slot_id IN
+       (SELECT slot_id FROM slot WHERE schedule_id = :schedule)""",
+    "DELETE FROM patient WHERE patient_id = :patient",
+    "DELETE FROM clinic WHERE clinic_id = :clinic",
+]
+
+_NAIVE_SELECT = text(
+    """
+    SELECT s.slot_id FROM slot s JOIN schedule sc ON sc.schedule_id = s.schedule_id
+    WHERE s.status = 'free' AND sc.provider_id = :provider
+    ORDER BY s.start_time LIMIT 1
+    """
+)
+_NAIVE_UPDATE = text("UPDATE slot SET status = 'busy' WHERE slot_id = :slot AND status = 'free'")
+_NAIVE_INSERT = text("INSERT INTO appointment (slot_id, patient_id) VALUES (:slot, :patient)")
+
+retries = Counter()
+
+
+def naive_book(ids: dict) -> bool:
+    """Read the earliest free slot, then claim it with a conditional update."""
+    db = Session()
+    try:
+        while True:
+            slot = db.execute(_NAIVE_SELECT, ids).scalar()
+            if slot is None:
+                return False
+            if db.execute(_NAIVE_UPDATE, {"slot": slot}).rowcount == 1:
+                break
+            # Someone else claimed it between our read and write
+            db.rollback()
+            retries["read+write"] += 1
+        db.execute(_NAIVE_INSERT, {"slot": slot, "patient": ids["patient"]})
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def skip_locked_book(ids: dict) -> bool:
+    db = Session()
+    try:
+        return book_first_free(ids["patient"], provider_id=ids["provider"], db=db) is not None
+    finally:
+        db.close()
+
+
+def run(name: str, book, bookings: int) -> None:
+    ids = {
+        "clinic": str(uuid.uuid4()),
+        "provider": str(uuid.uuid4()),
+        "schedule": str(uuid.uuid4()),
+        "patient": str(uuid.uuid4()),
+        "npi": uuid.uuid4().hex,
+        "phone": "+1" + uuid.uuid4().hex[:10],
+        "slots": SLOTS,
+    }
+    with engine.begin() as conn:
+        for statement in _SETUP:
+            conn.execute(text(statement), ids)
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(WORKERS) as pool:
+            booked = sum(pool.map(lambda _: book(ids), range(bookings)))
+        elapsed = time.perf_counter() - started
+        with engine.connect() as conn:
+            double = conn.execute(
+                text(
+                    """SELECT count(*) - count(DISTINCT a.slot_id) FROM appointment a
+                       JOIN slot s ON s.slot_id = a.slot_id WHERE s.schedule_id = :schedule"""
+                ),
+                ids,
+            ).scalar()
+        print(
+            f"{name:12} {booked:5} bookings in {elapsed:6.2f}s "
+            f"= {booked / elapsed:7.0f}/s  retries: {retries[name]:5}  double-booked: {double}"
+        )
+    finally:
+        with engine.begin() as conn:
+            for statement in _TEARDOWN:
+                conn.execute(text(statement), ids)
+
+
+def main(bookings: int = 1_000) -> None:
+    run("read+write", naive_book, bookings)
+    run("skip locked", skip_locked_book, bookings)
+
+
+if __name__ == "__main__":
+    main()
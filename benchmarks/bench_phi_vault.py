@@ -0,0 +1,93 @@
+"""
+PHI storage throughput: the old JSON file vs. the append-only vault.
+
+The JSON store is loaded whole and rewritten (and fsynced) for every write,
+and loaded whole for every read, as ``db/secure_storage.json`` was. The
+vault is written by several threads at once, as concurrent webhook turns
+would do, so their fsyncs are batched by group commit. Reads are random
+lookups by reference ID.
+
+Run with ``python -m benchmarks.bench_phi_vault``.
+"""
+
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from app.services.phi_vault import PhiVault
+
+RECORDS = 2_000
+JSON_RECORDS = 300  # the JSON store gets slow quickly
+READS = 20_000
+THREADS = 16
+
+RECORD = {
+    "sender": "+15550100",
+    "message": "I have had a headache for three days and some nausea in the mornings.",
+    "response": "Thanks for telling me. Have you had any fever or changes in vision?",
+}
+
+
+def _json_store(path: Path) -> None:
+    started = time.perf_counter()
+    refs = []
+    for _ in range(JSON_RECORDS):
+        data = json.loads(path.read_text()) if path.exists() else {}
+        ref = str(uuid.uuid4())
+        data[ref] = RECORD
+        with open(path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        refs.append(ref)
+    elapsed = time.perf_counter() - started
+    print(f"json file  {JSON_RECORDS / elapsed:10.0f} writes/s", end="")
+
+    reads = READS // 20
+    started = time.perf_counter()
+    for _ in range(reads):
+        json.loads(path.read_text())[random.choice(refs)]
+    print(f"  {reads / (time.perf_counter() - started):10.0f} reads/s ({JSON_RECORDS} records)")
+
+
+def _vault(directory: Path, commit_window_ms: float, threads: int) -> None:
+    key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+    vault = PhiVault(directory, key, commit_window_ms=commit_window_ms)
+    refs = []
+
+    def write(count: int) -> None:
+        for _ in range(count):
+            refs.append(vault.put(RECORD))
+
+    workers = [threading.Thread(target=write, args=(RECORDS // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    label = f"vault {threads:2}t {commit_window_ms:g}ms"
+    print(f"{label:18} {len(refs) / elapsed:10.0f} writes/s", end="")
+
+    started = time.perf_counter()
+    for _ in range(READS):
+        vault.get(random.choice(refs))
+    print(f"  {READS / (time.perf_counter() - started):10.0f} reads/s ({len(refs)} records)")
+    vault.close()
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        _json_store(Path(tmp) / "secure_storage.json")
+        for threads, window in ((1, 0), (THREADS, 0), (THREADS, 2)):
+            _vault(Path(tmp) / f"vault_{threads}_{window}", window, threads)
+
+
+if __name__ == "__main__":
+    main()
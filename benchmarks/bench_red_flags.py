@@ -0,0 +1,61 @@
+"""
+Red-flag pre-screen throughput: keyword loop vs. the Aho-Corasick automaton.
+
+The keyword loop is the previous check in ``classify_turn`` (a substring test
+per phrase), run here over the full lexicon after the same normalization.
+The automaton makes one pass over the words of the message however many
+phrases there are. Messages are typical intake answers in English and
+Spanish, one in ten with a red flag.
+
+Run with ``python -m benchmarks.bench_red_flags``.
+"""
+
+import timeit
+
+from app.agents.red_flags import LEXICON, RedFlagScreen, normalize, screen
+
+MESSAGES = [
+    "I have had a dry cough for about a week and a mild fever at night.",
+    "My mother has diabetes and my father had high blood pressure.",
+    "I take 20 mg of lisinopril every morning and ibuprofen when needed.",
+    "Tengo dolor de cabeza desde hace tres días y un poco de náuseas.",
+    "No fumo, tomo alcohol solo los fines de semana y camino todos los días.",
+    "I'm allergic to penicillin, it gives me a rash.",
+    "Sometimes I feel dizzy when I stand up too quickly.",
+    "Soy alérgica a la penicilina y al polen.",
+    "I work in an office and sleep about six hours a night.",
+    "Since this morning I have chest pain that goes down my left arm.",
+]
+NUMBER = 20_000
+
+
+def main() -> None:
+    phrases = [
+        " ".join(normalize(term))
+        for categories in LEXICON.values()
+        for terms in categories.values()
+        for term in terms
+    ]
+
+    def keywords(text: str) -> bool:
+        lowered = " ".join(normalize(text))
+        return any(phrase in lowered for phrase in phrases)
+
+    print(f"{len(phrases)} phrases, {len(MESSAGES)} messages per round")
+    for name, check in (("keyword loop", keywords), ("aho-corasick", screen)):
+        seconds = timeit.timeit(lambda: [check(m) for m in MESSAGES], number=NUMBER)
+        per_message = seconds / (NUMBER * len(MESSAGES))
+        print(f"{name:13} {1 / per_message:10.0f} msgs/s ({per_message * 1e6:5.1f} µs/msg)")
+
+    # The automaton's cost stays flat as the lexicon grows; the loop's does not
+    big = {"en": {"extra": [f"symptom number {i}" for i in range(5000)]}, **LEXICON}
+    big_screen = RedFlagScreen(big)
+    phrases += [f"symptom number {i}" for i in range(5000)]
+    for name, check in (("keyword loop", keywords), ("aho-corasick", big_screen.scan)):
+        seconds = timeit.timeit(lambda: [check(m) for m in MESSAGES], number=NUMBER // 20)
+        per_message = seconds / (NUMBER // 20 * len(MESSAGES))
+        print(f"{name:13} {1 / per_message:10.0f} msgs/s with {len(phrases)} phrases")
+
+
+if __name__ == "__main__":
+    main()
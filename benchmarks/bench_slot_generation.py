@@ -0,0 +1,124 @@
+"""
+Generating a year of slots for 50 providers.
+
+The baseline expands one provider's schedule in Python and inserts one row per
+slot (what a per-object ORM loop sends to the database); its time is
+multiplied by the number of providers. The set-based path is
+:func:`app.services.slot_generator.generate_slots`, which runs one
+``generate_series`` statement for every provider at once. The benchmark then
+edits one schedule and times :func:`regenerate_changed`.
+
+Run against a scratch database (``DATABASE_URL``) with the schema loaded::
+
+    python -m benchmarks.bench_slot_generation
+"""
+
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.services.models.models import SessionLocal, engine
+from app.services.slot_generator import generate_slots, regenerate_changed
+
+PROVIDERS = 50
+START = datetime(2031, 1, 1, tzinfo=timezone.utc)
+END = START + timedelta(days=365)
+
+_INSERT_ONE = text(
+    """
+    INSERT INTO slot (schedule_id, start_time, end_time, status, service_type)
+    VALUES (:schedule_id, :start_time, :end_time, 'free', 'bench')
+    """
+)
+
+
+def setup(conn) -> tuple[str, list[str]]:
+    clinic = str(uuid.uuid4())
+    conn.execute(
+        text("INSERT INTO clinic (clinic_id, name, address_json) VALUES (:c, 'Bench', '{}')"),
+        {"c": clinic},
+    )
+    schedules = []
+    for _ in range(PROVIDERS):
+        provider, schedule = str(uuid.uuid4()), str(uuid.uuid4())
+        conn.execute(
+            text(
+                """INSERT INTO provider (provider_id, clinic_id, npi_number, display_name)
+                   VALUES (:p, :c, :npi, 'Dr Bench')"""
+            ),
+            {"p": provider, "c": clinic, "npi": uuid.uuid4().hex},
+        )
+        conn.execute(
+            text(
+                """INSERT INTO schedule (schedule_id, provider_id, service_type,
+                                         period_start, period_end, slots_generated_at)
+                   VALUES (:s, :p, 'bench', :start, :end, now())"""
+            ),
+            {"s": schedule, "p": provider, "start": START, "end": END},
+        )
+        schedules.append(schedule)
+    return clinic, schedules
+
+
+def row_at_a_time(schedule_id: str) -> int:
+    """Default pattern (weekdays 09:00-17:00 UTC, 15 minutes), one INSERT per slot."""
+    db = SessionLocal()
+    count = 0
+    try:
+        day = START
+        while day < END:
+            if day.isoweekday() <= 5:
+                start = day.replace(hour=9)
+                while start < day.replace(hour=17):
+                    end = start + timedelta(minutes=15)
+                    db.execute(
+                        _INSERT_ONE,
+                        {"schedule_id": schedule_id, "start_time": start, "end_time": end},
+                    )
+                    count += 1
+                    start = end
+            day += timedelta(days=1)
+        db.commit()
+    finally:
+        db.close()
+    return count
+
+
+def main() -> None:
+    with engine.begin() as conn:
+        clinic, schedules = setup(conn)
+    try:
+        started = time.perf_counter()
+        rows = row_at_a_time(schedules[0])
+        elapsed = time.perf_counter() - started
+        print(
+            f"row at a time  {rows:7} slots (1 provider) in {elapsed:6.2f}s "
+            f"-> ~{elapsed * PROVIDERS:7.1f}s for {PROVIDERS} providers"
+        )
+
+        started = time.perf_counter()
+        inserted, _ = generate_slots(schedules, since=START, until=END)
+        elapsed = time.perf_counter() - started
+        print(
+            f"set based      {inserted:7} slots ({PROVIDERS - 1} new providers) "
+            f"in {elapsed:6.2f}s = {inserted / elapsed:8.0f} slots/s"
+        )
+
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE schedule SET day_end = '13:00' WHERE schedule_id = :s"),
+                {"s": schedules[1]},
+            )
+        started = time.perf_counter()
+        inserted, removed = regenerate_changed(since=START, until=END)
+        elapsed = time.perf_counter() - started
+        print(f"regenerate 1   +{inserted} / -{removed} slots in {elapsed * 1000:6.1f}ms")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM clinic WHERE clinic_id = :c"), {"c": clinic})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Parse cost per WhatsApp webhook payload: dict walking vs. the typed decoder.
+
+Run with ``python -m benchmarks.bench_webhook_parse``.
+"""
+
+import json
+import timeit
+
+from app.services.webhook_payload import (
+    WebhookKind,
+    classify,
+    iter_messages,
+    parse_webhook,
+)
+
+MESSAGE_PAYLOAD = json.dumps(
+    {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "102290129340398",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15550783881",
+                                "phone_number_id": "106540352242922",
+                            },
+                            "contacts": [{"profile": {"name": "Ana"}, "wa_id": "16505551234"}],
+                            "messages": [
+                                {
+                                    "from": "16505551234",
+                                    "id": "wamid.HBgLMTY1MDM4Nzk0MzkVAgASGBQzQTRBNjU5OUFFRTAzODEwMTQ0RgA=",
+                                    "timestamp": "1749416383",
+                                    "type": "text",
+                                    "text": {"body": "I have had a headache for three days"},
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+).encode()
+
+STATUS_PAYLOAD = json.dumps(
+    {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "102290129340398",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "15550783881",
+                                "phone_number_id": "106540352242922",
+                            },
+                            "statuses": [
+                                {
+                                    "id": "wamid.HBgLMTY1MDM4Nzk0MzkVAgARGBI3MUE0NjM0RDEzMTQzNUI4QzQA",
+                                    "status": "delivered",
+                                    "timestamp": "1749416390",
+                                    "recipient_id": "16505551234",
+                                    "conversation": {
+                                        "id": "6ceb9d929c1ad2d5e5ee6b0c5b1c2f3a",
+                                        "origin": {"type": "service"},
+                                    },
+                                    "pricing": {
+                                        "billable": True,
+                                        "pricing_model": "CBP",
+                                        "category": "service",
+                                    },
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+).encode()
+
+
+def dict_walk(body: bytes) -> list:
+    """The original handler: json.loads then nested .get() chains."""
+    found = []
+    data = json.loads(body)
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for message in value.get("messages", []):
+                found.append((message.get("from"), message.get("text", {}).get("body", "")))
+    return found
+
+
+def typed(body: bytes) -> list:
+    if classify(body) is not WebhookKind.MESSAGE:
+        return []
+    return [
+        (m["from"], m.get("text", {}).get("body", ""))
+        for m in iter_messages(parse_webhook(body))
+    ]
+
+
+def main(number: int = 50_000) -> None:
+    for label, payload in (("message", MESSAGE_PAYLOAD), ("status", STATUS_PAYLOAD)):
+        for name, parse in (("dict walk", dict_walk), ("typed", typed)):
+            seconds = min(timeit.repeat(lambda: parse(payload), number=number, repeat=3))
+            print(f"{label:8} {name:10} {seconds / number * 1e6:8.2f} µs/payload")
+
+
+if __name__ == "__main__":
+    main()
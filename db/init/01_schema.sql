@@ -26,9 +26,10 @@ CREATE TABLE provider (
 CREATE TABLE patient (
     patient_id        UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     full_name         BYTEA
-        DEFAULT pgp_sym_encrypt('', '<<KMS-key-alias>>', 'compress-always'),
+        DEFAULT pgp_sym_encrypt('', '<<KMS-key-alias>>'),
     date_of_birth     DATE,
     phone_e164        TEXT UNIQUE,
+    contact_phone     TEXT,
     email             TEXT UNIQUE,
     address_json      JSONB,
     created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
@@ -37,26 +38,113 @@ CREATE TABLE patient (
 
 COMMENT ON COLUMN patient.full_name IS
 'PHI: encrypted using pgcrypto; expose via a SECURITY DEFINER view';
+COMMENT ON COLUMN patient.phone_e164 IS
+'Verified WhatsApp sender number; identifies a returning patient';
+COMMENT ON COLUMN patient.contact_phone IS
+'Phone number as typed by the patient during intake; not verified';
 
+-- Range-partitioned by month on created_at so old months can be archived and
+-- dropped whole (app/services/retention.py) and recent reads prune to a few
+-- partitions. There is deliberately no DEFAULT partition: it would rule out
+-- DETACH PARTITION ... CONCURRENTLY. Partitions are created ahead of time by
+-- fn_create_conversation_partitions.
 CREATE TABLE conversations(
-    id                BIGSERIAL PRIMARY KEY,
+    id                BIGSERIAL,
     patient_id        UUID REFERENCES patient(patient_id) ON DELETE SET NULL,
     sender            TEXT NOT NULL,
     message           TEXT NOT NULL,
     response          TEXT,
-    created_at        TIMESTAMPTZ NOT NULL DEFAULT now()
-
-);
+    created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 CREATE INDEX idx_conversations_patient ON conversations(patient_id);
-CREATE INDEX idx_conversations_sender ON conversations(sender);
+-- Keyset pagination of a sender's history, newest first
+-- (app/services/conversation_history.py)
+CREATE INDEX idx_conversations_sender_recent
+    ON conversations(sender, created_at DESC, id DESC);
+
+-- Create the monthly partitions (conversations_pYYYY_MM, UTC months) from the
+-- current month through months_ahead; returns the names it created.
+CREATE OR REPLACE FUNCTION fn_create_conversation_partitions(months_ahead INT DEFAULT 3)
+RETURNS SETOF TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    month_start TIMESTAMPTZ;
+    partition_name TEXT;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            date_trunc('month', now(), 'UTC'),
+            date_trunc('month', now(), 'UTC') + make_interval(months => months_ahead),
+            interval '1 month')
+    LOOP
+        partition_name := 'conversations_p' || to_char(month_start AT TIME ZONE 'UTC', 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF conversations FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start,
+                (month_start AT TIME ZONE 'UTC' + interval '1 month') AT TIME ZONE 'UTC');
+            RETURN NEXT partition_name;
+        END IF;
+    END LOOP;
+END; $$;
+
+SELECT fn_create_conversation_partitions();
 
 COMMENT ON TABLE conversations IS 'Chat exchanges captured by MedBot';
 COMMENT ON COLUMN conversations.sender   IS 'E.164 number, user handle, or system tag';
 COMMENT ON COLUMN conversations.message  IS 'Message received from the user';
 COMMENT ON COLUMN conversations.response IS 'Reply generated by the bot';
 
+-- Webhook idempotency --------------------------------------------------------
+-- Meta redelivers webhooks it considers unacknowledged. Every inbound message ID
+-- is claimed here first so a redelivery is detected by any worker.
+CREATE TABLE processed_message (
+    message_id        TEXT PRIMARY KEY,
+    received_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_processed_message_received ON processed_message(received_at);
+
+COMMENT ON TABLE processed_message IS 'WhatsApp message IDs already handled (prune rows older than the redelivery window)';
+
+-- Delivery tracking ----------------------------------------------------------
+-- Written in batches by app/services/delivery_status.py; joined on message_id
+-- to measure send -> delivered -> read latency.
+CREATE TABLE outbound_message (
+    message_id        TEXT PRIMARY KEY,
+    sent_at           TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX idx_outbound_message_sent ON outbound_message(sent_at);
+
+CREATE TABLE message_status (
+    id                BIGSERIAL PRIMARY KEY,
+    message_id        TEXT NOT NULL,
+    status            TEXT NOT NULL,
+    status_at         TIMESTAMPTZ NOT NULL,
+    received_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_message_status_message ON message_status(message_id, status);
+
+CREATE VIEW message_delivery_latency AS
+SELECT o.message_id,
+       o.sent_at,
+       min(s.status_at) FILTER (WHERE s.status = 'delivered') - o.sent_at AS delivered_after,
+       min(s.status_at) FILTER (WHERE s.status = 'read') - o.sent_at      AS read_after
+FROM outbound_message o
+JOIN message_status s ON s.message_id = o.message_id
+GROUP BY o.message_id, o.sent_at;
+
 -- FHIR-aligned scheduling --------------------------------------------------
+CREATE OR REPLACE FUNCTION fn_touch_updated_at() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END; $$;
+
 CREATE TABLE schedule (
     schedule_id       UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     provider_id       UUID REFERENCES provider(provider_id) ON DELETE CASCADE,
@@ -65,10 +153,44 @@ CREATE TABLE schedule (
     period_start      TIMESTAMPTZ NOT NULL,
     period_end        TIMESTAMPTZ NOT NULL,
     is_active         BOOLEAN NOT NULL DEFAULT TRUE,
+    -- Slot pattern expanded by app/services/slot_generator.py
+    slot_minutes      INTEGER NOT NULL DEFAULT 15 CHECK (slot_minutes > 0),
+    day_start         TIME NOT NULL DEFAULT '09:00',
+    day_end           TIME NOT NULL DEFAULT '17:00',
+    working_days      SMALLINT[] NOT NULL DEFAULT '{1,2,3,4,5}',  -- ISO weekdays
+    time_zone         TEXT NOT NULL DEFAULT 'UTC',
+    slots_generated_at TIMESTAMPTZ,
+    created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT chk_period CHECK (period_end > period_start),
+    CONSTRAINT chk_day CHECK (day_end > day_start)
+);
+
+-- Schedules changed since their slots were last generated
+CREATE INDEX idx_schedule_regenerate ON schedule(updated_at)
+    WHERE slots_generated_at IS NULL OR updated_at > slots_generated_at;
+
+CREATE TRIGGER trg_schedule_touch
+BEFORE UPDATE ON schedule
+FOR EACH ROW EXECUTE FUNCTION fn_touch_updated_at();
+
+-- Answers to common patient questions (parking, insurance, ...), served by the
+-- local FAQ index in app/services/faq.py together with clinic, provider and
+-- schedule details.
+CREATE TABLE clinic_faq (
+    faq_id            UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    clinic_id         UUID REFERENCES clinic(clinic_id) ON DELETE CASCADE,
+    language          TEXT NOT NULL DEFAULT 'en' CHECK (language IN ('en','es')),
+    question          TEXT NOT NULL,
+    answer            TEXT NOT NULL,
     created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
-    CONSTRAINT chk_period CHECK (period_end > period_start)
+    updated_at        TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
+CREATE TRIGGER trg_clinic_faq_touch
+BEFORE UPDATE ON clinic_faq
+FOR EACH ROW EXECUTE FUNCTION fn_touch_updated_at();
+
 CREATE TABLE slot (
     slot_id           UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     schedule_id       UUID REFERENCES schedule(schedule_id) ON DELETE CASCADE,
@@ -77,10 +199,18 @@ CREATE TABLE slot (
     status            TEXT NOT NULL CHECK (status IN ('free','busy','reserved','cancelled')),
     service_type      TEXT,
     created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
     UNIQUE (start_time, end_time, schedule_id)
 );
 
 CREATE INDEX idx_slot_status_time ON slot(status, start_time);
+-- Lets the in-memory availability index pull only the slots changed since its
+-- last refresh (app/services/scheduler.py).
+CREATE INDEX idx_slot_updated ON slot(updated_at);
+
+CREATE TRIGGER trg_slot_touch
+BEFORE UPDATE ON slot
+FOR EACH ROW EXECUTE FUNCTION fn_touch_updated_at();
 
 CREATE TABLE appointment (
     appointment_id    UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -93,6 +223,21 @@ CREATE TABLE appointment (
     updated_at        TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
+-- Completed intakes ----------------------------------------------------------
+-- The validated PatientHistory of every finished intake, without the name and
+-- signature (the name is kept encrypted on the patient row). Exported as FHIR
+-- QuestionnaireResponse resources by app/services/fhir_export.py.
+CREATE TABLE intake_response (
+    intake_id         UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    patient_id        UUID REFERENCES patient(patient_id) ON DELETE SET NULL,
+    sender            TEXT NOT NULL,
+    answers           JSONB NOT NULL,
+    completed_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_intake_response_patient ON intake_response(patient_id);
+CREATE INDEX idx_intake_response_sender ON intake_response(sender);
+
 -- Wait‑list ----------------------------------------------------------------
 CREATE TABLE waitlist_request (
     request_id        UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -102,17 +247,24 @@ CREATE TABLE waitlist_request (
     priority          INTEGER NOT NULL DEFAULT 0,
     requested_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
     fulfilled_slot    UUID REFERENCES slot(slot_id),
-    fulfilled_at      TIMESTAMPTZ
+    fulfilled_at      TIMESTAMPTZ,
+    -- The offered slot stays 'reserved' until the patient accepts it (booked)
+    -- or the hold expires (slot back to 'free'); app/services/waitlist.py
+    hold_expires_at   TIMESTAMPTZ,
+    accepted_at       TIMESTAMPTZ,
+    released_at       TIMESTAMPTZ
 );
 
 CREATE INDEX idx_waitlist_unfilled ON waitlist_request(fulfilled_at) WHERE fulfilled_at IS NULL;
+CREATE INDEX idx_waitlist_open_holds ON waitlist_request(hold_expires_at)
+    WHERE accepted_at IS NULL AND released_at IS NULL;
 
 -- Notification outbox ------------------------------------------------------
 CREATE TABLE notification_outbox (
     outbox_id         UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     patient_id        UUID REFERENCES patient(patient_id),
     appointment_id    UUID REFERENCES appointment(appointment_id),
-    channel           TEXT NOT NULL CHECK (channel IN ('sms','email')),
+    channel           TEXT NOT NULL CHECK (channel IN ('sms','email','whatsapp')),
     template_name     TEXT NOT NULL,
     payload_json      JSONB NOT NULL,
     send_after        TIMESTAMPTZ NOT NULL,
@@ -120,9 +272,13 @@ CREATE TABLE notification_outbox (
     status            TEXT NOT NULL DEFAULT 'pending'
         CHECK (status IN ('pending','sent','failed')),
     retry_count       SMALLINT NOT NULL DEFAULT 0,
-    created_at        TIMESTAMPTZ NOT NULL DEFAULT now()
+    created_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    -- One reminder of each kind per appointment, however often the planner runs
+    CONSTRAINT uq_outbox_appointment_template UNIQUE (appointment_id, template_name)
 );
 
+CREATE INDEX idx_outbox_pending ON notification_outbox(send_after) WHERE status = 'pending';
+
 -- Audit log ----------------------------------------------------------------
 CREATE TABLE audit_log (
     audit_id          BIGSERIAL PRIMARY KEY,
@@ -134,32 +290,69 @@ CREATE TABLE audit_log (
     diff_json         JSONB NOT NULL
 );
 
+-- Statement-level: one set-based insert per statement, reading the rows it
+-- changed from transition tables. TG_ARGV[0] names the table's key column.
+-- Transition tables only work with single-event triggers, hence three each.
 CREATE OR REPLACE FUNCTION fn_audit_trigger() RETURNS trigger
 LANGUAGE plpgsql AS $$
+DECLARE
+    key_column TEXT := TG_ARGV[0];
+    diff TEXT;
 BEGIN
     IF TG_OP = 'INSERT' THEN
         INSERT INTO audit_log(table_name, record_id, action, diff_json)
-        VALUES (TG_TABLE_NAME, NEW.*::json->>'id', 'INSERT', to_jsonb(NEW));
-        RETURN NEW;
+        SELECT TG_TABLE_NAME, (to_jsonb(n) ->> key_column)::uuid, 'INSERT', to_jsonb(n)
+        FROM new_rows n;
     ELSIF TG_OP = 'DELETE' THEN
         INSERT INTO audit_log(table_name, record_id, action, diff_json)
-        VALUES (TG_TABLE_NAME, OLD.*::json->>'id', 'DELETE', to_jsonb(OLD));
-        RETURN OLD;
+        SELECT TG_TABLE_NAME, (to_jsonb(o) ->> key_column)::uuid, 'DELETE', to_jsonb(o)
+        FROM old_rows o;
     ELSE
-        INSERT INTO audit_log(table_name, record_id, action, diff_json)
-        VALUES (TG_TABLE_NAME, NEW.*::json->>'id', 'UPDATE',
-                jsonb_strip_nulls(to_jsonb(NEW) - to_jsonb(OLD)));
-        RETURN NEW;
+        -- Only the columns whose value changed. The comparison is generated
+        -- from the catalog once per statement: diffing two jsonb documents
+        -- key by key for every row costs more than the update itself.
+        SELECT string_agg(format(
+                   'CASE WHEN n.%1$I::text IS DISTINCT FROM o.%1$I::text '
+                   'THEN jsonb_build_object(%1$L, n.%1$I) ELSE ''{}'' END', attname),
+                   ' || ' ORDER BY attnum)
+        INTO diff
+        FROM pg_attribute
+        WHERE attrelid = TG_RELID AND attnum > 0 AND NOT attisdropped;
+
+        EXECUTE format(
+            'INSERT INTO audit_log(table_name, record_id, action, diff_json)
+             SELECT %L, n.%I, ''UPDATE'', d.diff
+             FROM new_rows n JOIN old_rows o USING (%I)
+             CROSS JOIN LATERAL (SELECT %s AS diff) d
+             WHERE d.diff <> ''{}''',
+            TG_TABLE_NAME, key_column, key_column, diff);
     END IF;
+    RETURN NULL;
 END; $$;
 
-CREATE TRIGGER trg_patient_audit
-AFTER INSERT OR UPDATE OR DELETE ON patient
-FOR EACH ROW EXECUTE FUNCTION fn_audit_trigger();
+CREATE TRIGGER trg_patient_audit_insert
+AFTER INSERT ON patient REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('patient_id');
+
+CREATE TRIGGER trg_patient_audit_update
+AFTER UPDATE ON patient REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('patient_id');
+
+CREATE TRIGGER trg_patient_audit_delete
+AFTER DELETE ON patient REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('patient_id');
+
+CREATE TRIGGER trg_appointment_audit_insert
+AFTER INSERT ON appointment REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('appointment_id');
+
+CREATE TRIGGER trg_appointment_audit_update
+AFTER UPDATE ON appointment REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('appointment_id');
 
-CREATE TRIGGER trg_appointment_audit
-AFTER INSERT OR UPDATE OR DELETE ON appointment
-FOR EACH ROW EXECUTE FUNCTION fn_audit_trigger();
+CREATE TRIGGER trg_appointment_audit_delete
+AFTER DELETE ON appointment REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION fn_audit_trigger('appointment_id');
 
 -- Row‑level security stubs --------------------------------------------------
 ALTER TABLE patient ENABLE ROW LEVEL SECURITY;